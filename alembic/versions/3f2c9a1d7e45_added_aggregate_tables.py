@@ -0,0 +1,51 @@
+"""Added aggregate tables
+
+Revision ID: 3f2c9a1d7e45
+Revises: da3b197b95cd
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2c9a1d7e45'
+down_revision = 'da3b197b95cd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('bundesland_summen',
+                    sa.Column('bundesland', sa.String(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('new_cases', sa.Integer(), nullable=True),
+                    sa.Column('new_cases_last_week', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('bundesland', 'date'))
+    op.create_table('kreis_inzidenzen',
+                    sa.Column('kreis_id', sa.Integer(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('seven_day_cases', sa.Integer(), nullable=True),
+                    sa.Column('seven_day_incidence', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['kreis_id'], ['kreise.id']),
+                    sa.PrimaryKeyConstraint('kreis_id', 'date'))
+
+    # Backfill (same queries as data_modules.sql.refresh_*, but for every date at once)
+    op.execute("INSERT INTO bundesland_summen (bundesland, date, new_cases, new_cases_last_week) "
+               "SELECT k.bundesland, f.date, SUM(f.number_of_new_cases), COALESCE(SUM(w.number_of_new_cases), 0) "
+               "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+               "LEFT JOIN fallzahlen w ON w.kreis_id = f.kreis_id AND w.date = f.date - 7 "
+               "WHERE f.is_already_entered = True "
+               "GROUP BY k.bundesland, f.date")
+    op.execute("INSERT INTO kreis_inzidenzen (kreis_id, date, seven_day_cases, seven_day_incidence) "
+               "SELECT k.id, d.date, SUM(f.number_of_new_cases), (SUM(f.number_of_new_cases) * 100000 / k.population)::integer "
+               "FROM (SELECT DISTINCT date + 1 AS date FROM fallzahlen) d "
+               "INNER JOIN fallzahlen f ON f.date >= d.date - 7 AND f.date < d.date "
+               "INNER JOIN kreise k ON f.kreis_id = k.id "
+               "GROUP BY k.id, d.date")
+
+
+def downgrade():
+    op.drop_table('kreis_inzidenzen')
+    op.drop_table('bundesland_summen')
@@ -0,0 +1,37 @@
+"""Added indexes for handler queries
+
+Revision ID: 8b41e6f0c2d3
+Revises: 3f2c9a1d7e45
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b41e6f0c2d3'
+down_revision = '3f2c9a1d7e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_kreise_kreis', 'kreise', ['kreis'])
+    op.create_index('ix_kreise_bundesland', 'kreise', ['bundesland'])
+    op.create_index('ix_fallzahlen_date', 'fallzahlen', ['date', 'kreis_id', 'number_of_new_cases', 'is_already_entered'])
+    op.create_index('ix_fallzahlen_date_entered', 'fallzahlen', ['date', 'kreis_id'],
+                    postgresql_where=sa.text('is_already_entered'))
+    op.create_index('ix_notifications_active', 'notifications', ['chat_id'], postgresql_where=sa.text('is_active'))
+    op.create_index('ix_bundesland_summen_date', 'bundesland_summen', ['date'])
+    op.create_index('ix_kreis_inzidenzen_date_incidence', 'kreis_inzidenzen', ['date', 'seven_day_incidence'])
+
+
+def downgrade():
+    op.drop_index('ix_kreis_inzidenzen_date_incidence', table_name='kreis_inzidenzen')
+    op.drop_index('ix_bundesland_summen_date', table_name='bundesland_summen')
+    op.drop_index('ix_notifications_active', table_name='notifications')
+    op.drop_index('ix_fallzahlen_date_entered', table_name='fallzahlen')
+    op.drop_index('ix_fallzahlen_date', table_name='fallzahlen')
+    op.drop_index('ix_kreise_bundesland', table_name='kreise')
+    op.drop_index('ix_kreise_kreis', table_name='kreise')
@@ -0,0 +1,54 @@
+"""Dropped aggregate tables
+
+Revision ID: a9c1e3f5b7d2
+Revises: e7b2d4f6a8c1
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c1e3f5b7d2'
+down_revision = 'e7b2d4f6a8c1'
+branch_labels = None
+depends_on = None
+
+
+# The read commands are answered from the case matrix (data_modules/case_matrix.py), nothing reads the aggregates
+def upgrade():
+    op.drop_table('kreis_inzidenzen')
+    op.drop_table('bundesland_summen')
+
+
+def downgrade():
+    op.create_table('bundesland_summen',
+                    sa.Column('bundesland', sa.String(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('new_cases', sa.Integer(), nullable=True),
+                    sa.Column('new_cases_last_week', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('bundesland', 'date'))
+    op.create_table('kreis_inzidenzen',
+                    sa.Column('kreis_id', sa.Integer(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('seven_day_cases', sa.Integer(), nullable=True),
+                    sa.Column('seven_day_incidence', sa.Integer(), nullable=True),
+                    sa.ForeignKeyConstraint(['kreis_id'], ['kreise.id']),
+                    sa.PrimaryKeyConstraint('kreis_id', 'date'))
+    op.create_index('ix_bundesland_summen_date', 'bundesland_summen', ['date'])
+    op.create_index('ix_kreis_inzidenzen_date_incidence', 'kreis_inzidenzen', ['date', 'seven_day_incidence'])
+
+    # Backfill, like 3f2c9a1d7e45
+    op.execute("INSERT INTO bundesland_summen (bundesland, date, new_cases, new_cases_last_week) "
+               "SELECT k.bundesland, f.date, SUM(f.number_of_new_cases), COALESCE(SUM(w.number_of_new_cases), 0) "
+               "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+               "LEFT JOIN fallzahlen w ON w.kreis_id = f.kreis_id AND w.date = f.date - 7 "
+               "WHERE f.is_already_entered = True "
+               "GROUP BY k.bundesland, f.date")
+    op.execute("INSERT INTO kreis_inzidenzen (kreis_id, date, seven_day_cases, seven_day_incidence) "
+               "SELECT k.id, d.date, SUM(f.number_of_new_cases), (SUM(f.number_of_new_cases) * 100000 / k.population)::integer "
+               "FROM (SELECT DISTINCT date + 1 AS date FROM fallzahlen) d "
+               "INNER JOIN fallzahlen f ON f.date >= d.date - 7 AND f.date < d.date "
+               "INNER JOIN kreise k ON f.kreis_id = k.id "
+               "GROUP BY k.id, d.date")
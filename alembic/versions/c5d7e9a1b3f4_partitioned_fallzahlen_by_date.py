@@ -0,0 +1,70 @@
+"""Partitioned fallzahlen by date
+
+Revision ID: c5d7e9a1b3f4
+Revises: 8b41e6f0c2d3
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d7e9a1b3f4'
+down_revision = '8b41e6f0c2d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The old table is renamed, its index names are needed for the new table
+    op.rename_table('fallzahlen', 'fallzahlen_unpartitioned')
+    op.execute("ALTER INDEX fallzahlen_pkey RENAME TO fallzahlen_unpartitioned_pkey")
+    op.drop_index('ix_fallzahlen_date_entered', table_name='fallzahlen_unpartitioned')
+    op.drop_index('ix_fallzahlen_date', table_name='fallzahlen_unpartitioned')
+
+    op.create_table('fallzahlen',
+                    sa.Column('kreis_id', sa.Integer(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('number_of_new_cases', sa.Integer(), nullable=True),
+                    sa.Column('link', sa.String(), nullable=True),
+                    sa.Column('is_already_entered', sa.Boolean(), nullable=True),
+                    sa.ForeignKeyConstraint(['kreis_id'], ['kreise.id']),
+                    sa.PrimaryKeyConstraint('kreis_id', 'date'),
+                    postgresql_partition_by='RANGE (date)')
+    op.create_index('ix_fallzahlen_date', 'fallzahlen', ['date', 'kreis_id', 'number_of_new_cases', 'is_already_entered'])
+    op.create_index('ix_fallzahlen_date_entered', 'fallzahlen', ['date', 'kreis_id'],
+                    postgresql_where=sa.text('is_already_entered'))
+
+    # One partition per day that has data (same names as data_modules.partitions), the ingest creates the next ones
+    op.execute("DO $$ DECLARE day date; BEGIN "
+               "FOR day IN SELECT DISTINCT date FROM fallzahlen_unpartitioned LOOP "
+               "EXECUTE format('CREATE TABLE %I PARTITION OF fallzahlen FOR VALUES FROM (%L) TO (%L)', "
+               "'fallzahlen_' || to_char(day, 'YYYYMMDD'), day, day + 1); "
+               "END LOOP; END $$")
+    op.execute("INSERT INTO fallzahlen (kreis_id, date, number_of_new_cases, link, is_already_entered) "
+               "SELECT kreis_id, date, number_of_new_cases, link, is_already_entered FROM fallzahlen_unpartitioned")
+    op.drop_table('fallzahlen_unpartitioned')
+
+
+def downgrade():
+    op.rename_table('fallzahlen', 'fallzahlen_partitioned')
+    op.execute("ALTER INDEX fallzahlen_pkey RENAME TO fallzahlen_partitioned_pkey")
+    op.drop_index('ix_fallzahlen_date_entered', table_name='fallzahlen_partitioned')
+    op.drop_index('ix_fallzahlen_date', table_name='fallzahlen_partitioned')
+
+    op.create_table('fallzahlen',
+                    sa.Column('kreis_id', sa.Integer(), nullable=False),
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('number_of_new_cases', sa.Integer(), nullable=True),
+                    sa.Column('link', sa.String(), nullable=True),
+                    sa.Column('is_already_entered', sa.Boolean(), nullable=True),
+                    sa.ForeignKeyConstraint(['kreis_id'], ['kreise.id']),
+                    sa.PrimaryKeyConstraint('kreis_id', 'date'))
+    op.create_index('ix_fallzahlen_date', 'fallzahlen', ['date', 'kreis_id', 'number_of_new_cases', 'is_already_entered'])
+    op.create_index('ix_fallzahlen_date_entered', 'fallzahlen', ['date', 'kreis_id'],
+                    postgresql_where=sa.text('is_already_entered'))
+    op.execute("INSERT INTO fallzahlen (kreis_id, date, number_of_new_cases, link, is_already_entered) "
+               "SELECT kreis_id, date, number_of_new_cases, link, is_already_entered FROM fallzahlen_partitioned")
+    # Drops the partitions as well
+    op.drop_table('fallzahlen_partitioned')
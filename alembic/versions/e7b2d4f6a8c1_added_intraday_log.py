@@ -0,0 +1,35 @@
+"""Added intraday log
+
+Revision ID: e7b2d4f6a8c1
+Revises: c5d7e9a1b3f4
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7b2d4f6a8c1'
+down_revision = 'c5d7e9a1b3f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fallzahlen_log',
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('bucket', sa.SmallInteger(), nullable=False),
+                    sa.Column('kreis_id', sa.SmallInteger(), nullable=False),
+                    sa.Column('delta', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('date', 'bucket', 'kreis_id'))
+    op.create_table('fallzahlen_kurven',
+                    sa.Column('date', sa.Date(), nullable=False),
+                    sa.Column('bucket', sa.SmallInteger(), nullable=False),
+                    sa.Column('cumulative_cases', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('date', 'bucket'))
+
+
+def downgrade():
+    op.drop_table('fallzahlen_kurven')
+    op.drop_table('fallzahlen_log')
@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, time as Time
+from typing import List, Dict, Optional, Callable, Awaitable, Tuple
+
+import aiohttp
+
+import start_bot
+from data_modules import helper_functions as help, sql, metrics
+from data_modules.archive import FallzahlenArchive, archive_completed_days
+from data_modules.async_clients import AsyncPostgresDatabase, AsyncRisklayerClient, AsyncTelegramClient, TelegramApiError
+from data_modules.broadcast import BroadcastReport, GLOBAL_MESSAGES_PER_SECOND, MESSAGES_PER_SECOND_PER_CHAT, create_report
+from data_modules.cache import ResponseCache
+from data_modules.case_matrix import CaseMatrix
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import FallzahlenIngest, Changeset
+from data_modules.rate_limit import TokenBucket, ChatRateLimiter
+from data_modules.risklayer import KreisInformation
+from data_modules.routing import CommandRouter, Route, BUNDESLAND
+from data_modules.scheduling import AdaptivePollSchedule
+from data_modules.scheme import Kreis
+
+# Optional asyncio runtime (BOT_RUNTIME=asyncio): commands, the Risklayer polling, the retention job and the daily
+# notification all run in one event loop instead of one thread per job and the worker threads of python-telegram-bot.
+# The read commands are answered by the same functions as in start_bot.py, from the case matrix. The ingest keeps
+# using the blocking FallzahlenIngest (its writes have to be in one transaction with the intraday log), in a single
+# executor thread.
+
+GET_UPDATES_TIMEOUT: int = 30
+MAX_CONCURRENT_COMMANDS: int = 100
+
+
+class AsyncNotificationBroadcaster:
+
+    def __init__(self, telegram: AsyncTelegramClient, database: AsyncPostgresDatabase, workers: int = 8,
+                 max_attempts: int = 5):
+        self._telegram: AsyncTelegramClient = telegram
+        self._database: AsyncPostgresDatabase = database
+        self._workers: int = workers
+        self._max_attempts: int = max_attempts
+        self._global_bucket: TokenBucket = TokenBucket(GLOBAL_MESSAGES_PER_SECOND, 1)
+
+    async def broadcast(self, render_message: Callable[[], str]) -> BroadcastReport:
+        chat_ids: List[int] = (await self._database.get(sql.get_active_chat_ids(), "get_active_chat_ids"))\
+            .convert_to_primitive_type(int)
+        message_markdown: str = render_message()
+
+        start: float = time.perf_counter()
+        workers: asyncio.Semaphore = asyncio.Semaphore(self._workers)
+        # Like NotificationBroadcaster, the buckets of the chats only live as long as the broadcast
+        chat_buckets: Dict[int, TokenBucket] = {}
+        latencies: List[Optional[float]] = await asyncio.gather(*[self._send(chat_id, message_markdown, workers, chat_buckets)
+                                                                  for chat_id in chat_ids])
+        duration: float = time.perf_counter() - start
+        metrics.observe("notification_broadcast_seconds", duration)
+        return create_report(latencies, duration)
+
+    async def _send(self, chat_id: int, message_markdown: str, workers: asyncio.Semaphore,
+                    chat_buckets: Dict[int, TokenBucket]) -> Optional[float]:
+        async with workers:
+            start: float = time.perf_counter()
+            for attempt in range(self._max_attempts):
+                await self._global_bucket.acquire_async()
+                await chat_buckets.setdefault(chat_id, TokenBucket(MESSAGES_PER_SECOND_PER_CHAT, 1)).acquire_async()
+                try:
+                    with metrics.track("notification_send"):
+                        await self._telegram.send_message(chat_id, message_markdown, parse_mode="MarkdownV2")
+                    latency: float = time.perf_counter() - start
+                    metrics.observe("notification_delivery_seconds", latency)
+                    return latency
+                except TelegramApiError as error:
+                    if error.retry_after is not None:
+                        metrics.increment("notification_retries_total", reason="retry_after")
+                        await asyncio.sleep(error.retry_after)
+                    elif error.error_code >= 500:
+                        metrics.increment("notification_retries_total", reason="network")
+                        await asyncio.sleep(2 ** attempt)
+                    else:
+                        logging.exception(f"Could not notify chat {chat_id}:")
+                        metrics.increment("notification_failures_total", reason="bad_request")
+                        return None
+                # Timeouts and connection problems
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    metrics.increment("notification_retries_total", reason="network")
+                    await asyncio.sleep(2 ** attempt)
+            logging.error(f"Giving up on notifying chat {chat_id} after {self._max_attempts} attempts")
+            metrics.increment("notification_failures_total", reason="attempts_exhausted")
+            return None
+
+
+class AsyncBot:
+
+    def __init__(self, telegram: AsyncTelegramClient, database: AsyncPostgresDatabase,
+                 fetch_new_data: Callable[[], Awaitable[Optional[List[KreisInformation]]]], commit_fetch: Callable[[], None],
+                 fallzahlen_ingest: FallzahlenIngest, response_cache: ResponseCache, command_router: CommandRouter,
+                 archive: FallzahlenArchive, case_matrix: CaseMatrix, blocking_database: PostgresDatabase,
+                 broadcaster: AsyncNotificationBroadcaster, poll_schedule: AdaptivePollSchedule,
+                 chat_rate_limiter: ChatRateLimiter, max_concurrent_commands: int = MAX_CONCURRENT_COMMANDS):
+        self._telegram: AsyncTelegramClient = telegram
+        self._database: AsyncPostgresDatabase = database
+        self._fetch_new_data: Callable[[], Awaitable[Optional[List[KreisInformation]]]] = fetch_new_data
+        self._commit_fetch: Callable[[], None] = commit_fetch
+        self._fallzahlen_ingest: FallzahlenIngest = fallzahlen_ingest
+        self._response_cache: ResponseCache = response_cache
+        self._command_router: CommandRouter = command_router
+        self._archive: FallzahlenArchive = archive
+        self._case_matrix: CaseMatrix = case_matrix
+        self._blocking_database: PostgresDatabase = blocking_database
+        self._broadcaster: AsyncNotificationBroadcaster = broadcaster
+        self._poll_schedule: AdaptivePollSchedule = poll_schedule
+        self._chat_rate_limiter: ChatRateLimiter = chat_rate_limiter
+        self._commands: asyncio.Semaphore = asyncio.Semaphore(max_concurrent_commands)
+        self._ingest_executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._bot_username: str = ""
+
+    async def run(self, notification_time: Time):
+        self._bot_username = (await self._telegram.get_me())["username"]
+        await self.refresh_routes()
+        # Schedule Updates, Deletes and Notifications
+        await asyncio.gather(
+            help.periodic_async(3600, self.refresh_routes),
+            help.periodic_adaptive_async(self.poll_data, self._poll_schedule.last_interval),
+            help.periodic_async(86400, self.delete_data),
+            self.notify_users_daily(notification_time),
+            self.poll_updates(),
+        )
+
+    # Scheduled Jobs
+
+    async def refresh_routes(self):
+        kreise: List[Kreis] = (await self._database.get(sql.get_all_kreise(), "get_all_kreise")).convert_rows_to_records(Kreis)
+        self._command_router.set_kreise(kreise)
+
+    async def poll_data(self) -> float:
+        return self._poll_schedule.next_interval(await self.update_data(), help.get_current_german_time())
+
+    # Returns the number of Kreise whose row changed, for the poll schedule: 0 when the sheet is unchanged, the first
+    # rows of a new day do not count. None when the data was not ingested.
+    async def update_data(self) -> Optional[int]:
+        print(f"Updating Values, date={help.get_current_german_time()}")
+        with metrics.track("job", job="update_data") as tracker:
+            kreis_infos: Optional[List[KreisInformation]] = await self._fetch_new_data()
+            if kreis_infos is None:
+                return 0
+            if start_bot.data_was_resetted(kreis_infos):
+                print("data was resetted")
+                return
+            changeset: Changeset = await asyncio.get_running_loop().run_in_executor(
+                self._ingest_executor, self._fallzahlen_ingest.ingest, kreis_infos)
+            self._commit_fetch()
+            tracker.rows = len(changeset.changes)
+        print(f"{len(changeset.changes)} Kreise changed, {len(changeset.get_newly_entered())} newly entered")
+        return len(changeset.get_updated())
+
+    async def delete_data(self):
+        date_to_delete_everything_before: datetime.date = datetime.date(help.get_current_german_time() - timedelta(days=28))
+        with metrics.track("job", job="delete_data"):
+            # Archiving and dropping the partitions use the blocking database, like the ingest that creates them.
+            # Every completed day is archived first, nothing is dropped when that fails.
+            await asyncio.get_running_loop().run_in_executor(
+                self._ingest_executor, archive_completed_days, self._blocking_database, self._archive,
+                start_bot.get_today() - timedelta(days=1))
+            await asyncio.get_running_loop().run_in_executor(
+                self._ingest_executor, self._fallzahlen_ingest.partitions.drop_until, date_to_delete_everything_before)
+            await self._database.execute(sql.delete_aggregates_from_before(date_to_delete_everything_before),
+                                         "delete_aggregates_from_before")
+
+    async def notify_users_daily(self, notification_time: Time):
+        while True:
+            await asyncio.sleep(get_seconds_until(notification_time))
+            try:
+                await self._broadcaster.broadcast(lambda: self._response_cache.get_or_render(
+                    start_bot.get_case_number_key(), lambda: start_bot.get_summarized_case_number(self._case_matrix)))
+            except Exception:
+                logging.exception("Notification Failed:")
+
+    # Updates
+
+    async def poll_updates(self):
+        offset: Optional[int] = None
+        while True:
+            try:
+                updates: List[Dict] = await self._telegram.get_updates(offset, GET_UPDATES_TIMEOUT)
+            except (TelegramApiError, aiohttp.ClientError, asyncio.TimeoutError):
+                logging.exception("Getting updates failed:")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                offset = update["update_id"] + 1
+                await self._commands.acquire()
+                asyncio.create_task(self._handle_update(update))
+
+    async def _handle_update(self, update: Dict):
+        try:
+            await self.handle_update(update)
+        except Exception:
+            logging.exception("Handling an update failed:")
+        finally:
+            self._commands.release()
+
+    async def handle_update(self, update: Dict):
+        message: Optional[Dict] = update.get("message")
+        command: Optional[Tuple[str, List[str]]] = self._parse_command(message)
+        if command is None:
+            return
+        name, args = command
+        chat: Dict = message["chat"]
+        # Like start_bot.throttle_commands, floods of a chat are dropped
+        if not self._chat_rate_limiter.try_acquire(chat["id"]):
+            metrics.increment("commands_throttled_total")
+            return
+        # Like python-telegram-bot, replies only quote the command outside of private chats
+        reply_to: Optional[int] = message["message_id"] if chat.get("type") != "private" else None
+
+        if name == "update":
+            with metrics.track("command", command="update"):
+                text: str = self._response_cache.get_or_render(
+                    start_bot.get_case_number_key(), lambda: start_bot.get_summarized_case_number(self._case_matrix))
+                await self._telegram.send_message(chat["id"], text, "MarkdownV2", reply_to)
+        elif name == "start" or name == "stop":
+            with metrics.track("command", command=name):
+                await self._database.upsert("notifications", [{"chat_id": chat["id"], "is_active": name == "start"}])
+                await self._telegram.send_message(chat["id"], "You will now get a notification each day at 22h!"
+                                                  if name == "start" else "You succesfully unsubscribed!", None, reply_to)
+        elif name == "risikogebiete":
+            with metrics.track("command", command="risikogebiete"):
+                text = self._response_cache.get_or_render(
+                    ("risikogebiete", start_bot.get_today()), lambda: start_bot.get_summarized_risikogebiete(self._case_matrix))
+                await self._telegram.send_message(chat["id"], text, "MarkdownV2", reply_to)
+        elif name == "history":
+            # Reads a few pages of the memory-mapped archive, not worth an executor
+            with metrics.track("command", command="history"):
+                text = start_bot.get_summarized_history(self._archive, args)
+                await self._telegram.send_message(chat["id"], text, "MarkdownV2", reply_to)
+        else:
+            route: Optional[Route] = self._command_router.find_route(name)
+            if route is None:
+                return
+            with metrics.track("command", command=route.kind):
+                if route.kind == BUNDESLAND:
+                    text = self._response_cache.get_or_render(
+                        ("bundesland", route.name, start_bot.get_today()),
+                        lambda: start_bot.get_summarized_bundesland(self._case_matrix, route.name))
+                else:
+                    text = self._response_cache.get_or_render(
+                        ("kreis", route.name, start_bot.get_today()),
+                        lambda: start_bot.get_summarized_kreis(self._case_matrix, route.name))
+                await self._telegram.send_message(chat["id"], text, "MarkdownV2", reply_to)
+
+    # Same rules as the CommandHandler of python-telegram-bot: the message has to start with the command, and a command
+    # addressed to another bot (/update@OtherBot) is ignored
+    def _parse_command(self, message: Optional[Dict]) -> Optional[Tuple[str, List[str]]]:
+        if not message or not message.get("text") or not message.get("entities"):
+            return None
+        entity: Dict = message["entities"][0]
+        if entity["type"] != "bot_command" or entity["offset"] != 0:
+            return None
+        text: str = message["text"]
+        command, _, bot_name = text[1:entity["length"]].partition("@")
+        if bot_name and bot_name.lower() != self._bot_username.lower():
+            return None
+        return command.lower(), text.split()[1:]
+
+
+def get_seconds_until(time_of_day: Time) -> float:
+    now: datetime = help.get_current_german_time()
+    next_run: datetime = now.replace(hour=time_of_day.hour, minute=time_of_day.minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def run(telegram_token: str, api_key: str, database_url: str, database_pool_size: int,
+              fallzahlen_ingest: FallzahlenIngest, response_cache: ResponseCache, command_router: CommandRouter,
+              archive: FallzahlenArchive, case_matrix: CaseMatrix, blocking_database: PostgresDatabase, notification_workers: int,
+              notification_time: Time, poll_schedule: AdaptivePollSchedule, chat_rate_limiter: ChatRateLimiter,
+              blocking_risklayer_client=None):
+    database: AsyncPostgresDatabase = await AsyncPostgresDatabase.connect(database_url, database_pool_size)
+    async with aiohttp.ClientSession() as session:
+        telegram: AsyncTelegramClient = AsyncTelegramClient(telegram_token, session)
+        if blocking_risklayer_client is not None:
+            # A recorded response is replayed by the blocking client
+            fetch_new_data = lambda: asyncio.get_running_loop().run_in_executor(None, blocking_risklayer_client.get_new_data)
+            commit_fetch = blocking_risklayer_client.commit_fetch
+        else:
+            risklayer_client: AsyncRisklayerClient = AsyncRisklayerClient(api_key, session)
+            fetch_new_data = risklayer_client.get_new_data_async
+            commit_fetch = risklayer_client.commit_fetch
+        broadcaster: AsyncNotificationBroadcaster = AsyncNotificationBroadcaster(telegram, database, notification_workers)
+        bot: AsyncBot = AsyncBot(telegram, database, fetch_new_data, commit_fetch, fallzahlen_ingest, response_cache, command_router,
+                                 archive, case_matrix, blocking_database, broadcaster, poll_schedule, chat_rate_limiter)
+        try:
+            await bot.run(notification_time)
+        finally:
+            await database.close()
@@ -0,0 +1,135 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import List, Dict, Callable
+
+import start_bot
+from benchmarks.dataset import seed_database, create_kreis_infos, get_poll_time, SyntheticKreis
+from benchmarks.harness import throwaway_database, measure
+from data_modules import sql
+from data_modules.case_matrix import CaseMatrix
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import FallzahlenIngest
+from data_modules.intraday import log_changes
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet
+from data_modules.scheme import Kreis
+
+# Parity check of the case matrix: every read query of data_modules/sql.py the matrix replaces is compared with the
+# matrix, for every Bundesland and Kreis, in a throwaway database with synthetic data:
+#   1. right after the matrix was built from the database
+#   2. after further polls of today were ingested and applied in place
+#   3. for tomorrow before its first poll, and after it (which rebuilds the matrix)
+#   python -m benchmarks.check_case_matrix
+# BENCHMARK_DATABASE_URL  server to create the throwaway database on, otherwise a temporary cluster is started
+# BENCHMARK_RUNS          runs of the timing of the matrix and the queries (200)
+
+DAYS_BACK: int = 7
+HISTORY_DAYS: List[int] = [8, 28]
+
+
+# The queries the read commands used before the case matrix
+
+def get_sql_bundesland_summen(postgres_db: PostgresDatabase, today: datetime.date) -> List[BundeslandSummary]:
+    return postgres_db.get(sql.get_bundesland_summen(today, today - timedelta(days=DAYS_BACK)), "get_bundesland_summen")\
+        .convert_rows_to(BundeslandSummary)
+
+
+def get_sql_kreiszahlen_of_bundesland(postgres_db: PostgresDatabase, today: datetime.date, bundesland: str) -> List[KreisComparison]:
+    return postgres_db.get(sql.get_kreiszahlen_of_bundesland(today, today - timedelta(days=DAYS_BACK), bundesland),
+                           "get_kreiszahlen_of_bundesland").convert_rows_to(KreisComparison)
+
+
+def get_sql_history_for_kreis(postgres_db: PostgresDatabase, kreis: str, today: datetime.date, days: int) -> List[KreisHistoryEntry]:
+    return postgres_db.get(sql.get_history_for_kreis(kreis, today, days), "get_history_for_kreis")\
+        .convert_rows_to(KreisHistoryEntry)
+
+
+def get_sql_risikogebiete(postgres_db: PostgresDatabase, today: datetime.date) -> List[Risikogebiet]:
+    return postgres_db.get(sql.get_risikogebiete(today), "get_risikogebiete").convert_rows_to(Risikogebiet)
+
+
+def compare(postgres_db: PostgresDatabase, case_matrix: CaseMatrix, today: datetime.date) -> List[str]:
+    kreise: List[Kreis] = postgres_db.get(sql.get_all_kreise(), "get_all_kreise").convert_rows_to_records(Kreis)
+    differences: List[str] = []
+    if case_matrix.get_bundesland_summen(today) != get_sql_bundesland_summen(postgres_db, today):
+        differences.append(f"get_bundesland_summen {today}")
+    for bundesland in sorted(set([kreis.bundesland for kreis in kreise])):
+        if case_matrix.get_kreiszahlen_of_bundesland(today, bundesland) != get_sql_kreiszahlen_of_bundesland(postgres_db, today, bundesland):
+            differences.append(f"get_kreiszahlen_of_bundesland {today} {bundesland}")
+    for kreis in kreise:
+        for days in HISTORY_DAYS:
+            if case_matrix.get_history_for_kreis(kreis.kreis, today, days) != get_sql_history_for_kreis(postgres_db, kreis.kreis, today, days):
+                differences.append(f"get_history_for_kreis {today} {kreis.kreis} {days}")
+    # The order of Kreise with the same incidence is not defined by the query
+    matrix_risikogebiete: List[Risikogebiet] = case_matrix.get_risikogebiete(today)
+    sql_risikogebiete: List[Risikogebiet] = get_sql_risikogebiete(postgres_db, today)
+    if [risikogebiet.seven_day_incidence for risikogebiet in matrix_risikogebiete] != [risikogebiet.seven_day_incidence for risikogebiet in sql_risikogebiete] \
+            or sorted([(risikogebiet.seven_day_incidence, risikogebiet.kreis) for risikogebiet in matrix_risikogebiete]) \
+            != sorted([(risikogebiet.seven_day_incidence, risikogebiet.kreis) for risikogebiet in sql_risikogebiete]):
+        differences.append(f"get_risikogebiete {today}")
+    return differences
+
+
+def check(name: str, postgres_db: PostgresDatabase, case_matrix: CaseMatrix, today: datetime.date,
+          expect_risikogebiete: bool) -> bool:
+    differences: List[str] = compare(postgres_db, case_matrix, today)
+    if expect_risikogebiete and not case_matrix.get_risikogebiete(today):
+        differences.append(f"get_risikogebiete {today} has no Risikogebiete to compare")
+    for difference in differences:
+        print(f"{name}: {difference} differs")
+    if not differences:
+        print(f"{name}: ok")
+    return not differences
+
+
+def measure_queries(postgres_db: PostgresDatabase, case_matrix: CaseMatrix, today: datetime.date, runs: int):
+    queries: Dict[str, List[Callable[[], object]]] = {
+        "get_bundesland_summen": [lambda: get_sql_bundesland_summen(postgres_db, today),
+                                  lambda: case_matrix.get_bundesland_summen(today)],
+        "get_kreiszahlen_of_bundesland Bayern": [lambda: get_sql_kreiszahlen_of_bundesland(postgres_db, today, "Bayern"),
+                                                 lambda: case_matrix.get_kreiszahlen_of_bundesland(today, "Bayern")],
+        "get_history_for_kreis Dithmarschen": [lambda: get_sql_history_for_kreis(postgres_db, "Dithmarschen", today, DAYS_BACK + 1),
+                                               lambda: case_matrix.get_history_for_kreis("Dithmarschen", today, DAYS_BACK + 1)],
+        "get_risikogebiete": [lambda: get_sql_risikogebiete(postgres_db, today),
+                              lambda: case_matrix.get_risikogebiete(today)],
+    }
+    for name, (sql_query, matrix_query) in queries.items():
+        sql_p50: float = measure(f"sql.{name}", sql_query, runs).p50_ms
+        matrix_p50: float = measure(f"CaseMatrix.{name}", matrix_query, runs).p50_ms
+        print(f"{name}: {sql_p50 / matrix_p50 if matrix_p50 > 0 else 0:.0f}x faster")
+    measure("CaseMatrix.rebuild", lambda: case_matrix.rebuild(today), max(1, runs // 20))
+
+
+if __name__ == "__main__":
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "200"))
+    TODAY: datetime.date = start_bot.get_today()
+    TOMORROW: datetime.date = TODAY + timedelta(days=1)
+    passed: bool = True
+
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+        kreise: List[SyntheticKreis] = seed_database(postgres_db, database_url, TODAY, 14)
+
+        case_matrix: CaseMatrix = CaseMatrix(postgres_db)
+        case_matrix.rebuild(TODAY)
+        passed &= check("built", postgres_db, case_matrix, TODAY, True)
+
+        fallzahlen_ingest: FallzahlenIngest = FallzahlenIngest(postgres_db)
+        fallzahlen_ingest.add_writer(log_changes)
+        fallzahlen_ingest.subscribe(case_matrix.apply)
+        for hour in [15, 18, 23.9]:
+            fallzahlen_ingest.ingest(create_kreis_infos(kreise, TODAY, hour), get_poll_time(TODAY, hour))
+        passed &= check("applied in place", postgres_db, case_matrix, TODAY, True)
+        passed &= check("tomorrow before the first poll", postgres_db, case_matrix, TOMORROW, True)
+
+        fallzahlen_ingest.ingest(create_kreis_infos(kreise, TOMORROW, 13), get_poll_time(TOMORROW, 13))
+        if case_matrix.end_date != TOMORROW:
+            print("new day: the matrix was not rebuilt")
+            passed = False
+        passed &= check("new day", postgres_db, case_matrix, TOMORROW, True)
+
+        measure_queries(postgres_db, case_matrix, TOMORROW, RUNS)
+        postgres_db.close()
+
+    if not passed:
+        sys.exit(1)
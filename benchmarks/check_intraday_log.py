@@ -0,0 +1,143 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+
+from psycopg2.sql import SQL
+
+import start_bot
+from benchmarks.dataset import seed_database, create_kreis_infos, get_poll_time, SyntheticKreis, DEFAULT_POLL_HOURS
+from benchmarks.harness import throwaway_database
+from data_modules import sql
+from data_modules.case_matrix import CaseMatrix
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import FallzahlenIngest
+from data_modules.intraday import log_changes, get_bucket, get_hour_shares, BUCKETS_PER_DAY
+from data_modules.scheme import FallzahlenKurve
+
+# Checks the intraday log in a throwaway database with synthetic data, polled at DEFAULT_POLL_HOURS every day:
+#   1. the log of every completed day was compacted, only today is left
+#   2. the curve of every completed day has the cases of all Kreise at every poll, and fallzahlen at the end of the day
+#   3. after a restart, the log of today continues where it was, and a day whose log started late still ends with
+#      the cases in fallzahlen
+#   4. the prognosis of the case matrix extrapolates today with the curve of last week
+#   5. the hour shares the poll schedule is seeded with (data_modules/scheduling.py) are the ones of the polls
+#   python -m benchmarks.check_intraday_log
+# BENCHMARK_DATABASE_URL  server to create the throwaway database on, otherwise a temporary cluster is started
+
+DAYS: int = 9
+
+
+def get_curves(postgres_db: PostgresDatabase, first_day: datetime.date, last_day: datetime.date) -> Dict[datetime.date, List[int]]:
+    curves: Dict[datetime.date, List[int]] = {}
+    for kurve in postgres_db.get(sql.get_fallzahlen_kurven_between(first_day, last_day), "get_fallzahlen_kurven_between")\
+            .convert_rows_to_records(FallzahlenKurve):
+        curves.setdefault(kurve.date, []).append(kurve.cumulative_cases)
+    return curves
+
+
+def get_cases_total(postgres_db: PostgresDatabase, date: datetime.date) -> int:
+    return postgres_db.get(SQL("SELECT COALESCE(SUM(number_of_new_cases), 0)::integer FROM fallzahlen WHERE date = %s" % f"'{date}'"))\
+        .rows[0][0]
+
+
+def get_log_total(postgres_db: PostgresDatabase, date: datetime.date) -> int:
+    return postgres_db.get(SQL("SELECT COALESCE(SUM(delta), 0)::integer FROM fallzahlen_log WHERE date = %s" % f"'{date}'"))\
+        .rows[0][0]
+
+
+def check_completed_days(postgres_db: PostgresDatabase, kreise: List[SyntheticKreis], today: datetime.date) -> List[str]:
+    problems: List[str] = []
+    log_dates: List = postgres_db.get(sql.get_fallzahlen_log_dates_before(today)).rows
+    if log_dates:
+        problems.append(f"the log still has {len(log_dates)} completed days")
+    curves: Dict[datetime.date, List[int]] = get_curves(postgres_db, today - timedelta(days=DAYS), today)
+    for day in range(1, DAYS):
+        date: datetime.date = today - timedelta(days=day)
+        curve: List[int] = curves.get(date, [])
+        if len(curve) != BUCKETS_PER_DAY:
+            problems.append(f"{date} has {len(curve)} buckets")
+            continue
+        for hour in DEFAULT_POLL_HOURS:
+            polled: int = sum([kreis_info.number_of_new_cases for kreis_info in create_kreis_infos(kreise, date, hour)])
+            if curve[get_bucket(date, get_poll_time(date, hour))] != polled:
+                problems.append(f"{date} has {curve[get_bucket(date, get_poll_time(date, hour))]} cases at {hour}h, polled were {polled}")
+        if curve[-1] != get_cases_total(postgres_db, date):
+            problems.append(f"{date} ends with {curve[-1]} cases, fallzahlen has {get_cases_total(postgres_db, date)}")
+    return problems
+
+
+def check_restart(postgres_db: PostgresDatabase, kreise: List[SyntheticKreis], today: datetime.date) -> List[str]:
+    problems: List[str] = []
+    # A restart in the afternoon continues the log of today
+    fallzahlen_ingest: FallzahlenIngest = FallzahlenIngest(postgres_db)
+    fallzahlen_ingest.add_writer(log_changes)
+    fallzahlen_ingest.ingest(create_kreis_infos(kreise, today, 15), get_poll_time(today, 15))
+    if get_log_total(postgres_db, today) != get_cases_total(postgres_db, today):
+        problems.append(f"after the restart the log has {get_log_total(postgres_db, today)} cases, fallzahlen {get_cases_total(postgres_db, today)}")
+
+    # Without the log of the morning (like on the day the log was deployed), the morning counts as the first bucket
+    postgres_db.execute(SQL("DELETE FROM fallzahlen_log WHERE bucket < %s" % get_bucket(today, get_poll_time(today, 15))))
+    fallzahlen_ingest.ingest(create_kreis_infos(kreise, today, 23.9), get_poll_time(today, 23.9))
+    fallzahlen_ingest.ingest(create_kreis_infos(kreise, today + timedelta(days=1), 9), get_poll_time(today + timedelta(days=1), 9))
+    curve: List[int] = get_curves(postgres_db, today, today).get(today, [])
+    if not curve or curve[-1] != get_cases_total(postgres_db, today):
+        problems.append(f"the day with a partial log ends with {curve[-1] if curve else None} cases, fallzahlen has {get_cases_total(postgres_db, today)}")
+    elif curve[0] != sum([kreis_info.number_of_new_cases for kreis_info in create_kreis_infos(kreise, today, 9)]):
+        problems.append(f"the day with a partial log starts with {curve[0]} cases instead of the cases of the morning")
+    return problems
+
+
+def check_prognosis(postgres_db: PostgresDatabase, today: datetime.date) -> List[str]:
+    case_matrix: CaseMatrix = CaseMatrix(postgres_db)
+    case_matrix.rebuild(today)
+    curve_last_week: List[int] = get_curves(postgres_db, today - timedelta(days=7), today - timedelta(days=7))[today - timedelta(days=7)]
+    bucket: int = get_bucket(today, get_poll_time(today, 12))
+    expected: float = get_cases_total(postgres_db, today) * curve_last_week[-1] / curve_last_week[bucket]
+    prognosis = case_matrix.get_prognosis(today, bucket)
+    if prognosis is None or abs(prognosis - expected) > 1e-6:
+        return [f"the prognosis is {prognosis}, expected {expected}"]
+    if case_matrix.get_prognosis(today, get_bucket(today, get_poll_time(today, 1))) is not None:
+        return ["there is a prognosis at night, before anything was reported last week"]
+    return []
+
+
+def check_hour_shares(postgres_db: PostgresDatabase, kreise: List[SyntheticKreis], today: datetime.date) -> List[str]:
+    expected: List[float] = [0.0] * 24
+    for day in range(1, 8):
+        date: datetime.date = today - timedelta(days=day)
+        cases_before: int = 0
+        cases_of_day: int = get_cases_total(postgres_db, date)
+        for hour in DEFAULT_POLL_HOURS:
+            polled: int = sum([kreis_info.number_of_new_cases for kreis_info in create_kreis_infos(kreise, date, hour)])
+            expected[int(hour)] += max(0.0, (polled - cases_before) / cases_of_day) / 7
+            cases_before = polled
+    shares: Optional[List[float]] = get_hour_shares(postgres_db, today - timedelta(days=7), today - timedelta(days=1))
+    if shares is None or any([abs(share - expected_share) > 1e-9 for share, expected_share in zip(shares, expected)]):
+        return [f"the hour shares are {shares}, expected {expected}"]
+    interval: float = start_bot.create_poll_schedule(postgres_db, 600, 120, 1800).next_interval(0, get_poll_time(today, 17))
+    if not 120 <= interval < 600:
+        return [f"the seeded schedule waits {interval:.0f} s at the poll of 17h"]
+    return []
+
+
+if __name__ == "__main__":
+    TODAY: datetime.date = start_bot.get_today()
+    checks: Dict[str, List[str]] = {}
+
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+        kreise: List[SyntheticKreis] = seed_database(postgres_db, database_url, TODAY, DAYS)
+        checks["compacted days"] = check_completed_days(postgres_db, kreise, TODAY)
+        checks["prognosis"] = check_prognosis(postgres_db, TODAY)
+        checks["hour shares"] = check_hour_shares(postgres_db, kreise, TODAY)
+        checks["restart"] = check_restart(postgres_db, kreise, TODAY)
+        postgres_db.close()
+
+    for name, problems in checks.items():
+        for problem in problems:
+            print(f"{name}: {problem}")
+        if not problems:
+            print(f"{name}: ok")
+    if any(checks.values()):
+        sys.exit(1)
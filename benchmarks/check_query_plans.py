@@ -0,0 +1,105 @@
+import os
+import re
+import sys
+from datetime import date
+from typing import List, Dict, Iterator, Set
+
+import psycopg2
+from psycopg2.sql import SQL
+
+from benchmarks.dataset import seed_database, get_queries
+from benchmarks.harness import throwaway_database
+from data_modules.database import PostgresDatabase
+
+# Plan regression check: seeds a throwaway database, runs EXPLAIN for every query in data_modules/sql.py and fails if
+# one of them reads a whole hot table. Sequential scans are disabled for the check, so the planner only picks one when
+# no index fits (on a small dataset it would otherwise always prefer them). Without a fitting index it can still walk
+# through a complete index instead, so index scans have to restrict the leading column of their index as well.
+# fallzahlen is partitioned by date. A partition only holds one day, so reading all of it is fine as long as the query
+# does not read every partition.
+#   BENCHMARK_DATABASE_URL=postgresql://... python -m benchmarks.check_query_plans
+# (without BENCHMARK_DATABASE_URL a temporary cluster is started, see benchmarks/harness.py)
+
+HOT_TABLES: List[str] = ["fallzahlen"]
+TODAY: date = date(2020, 11, 20)
+DAYS: int = 28
+
+
+# The hot table of every partition, and of the hot tables themselves
+def get_hot_tables(cursor) -> Dict[str, str]:
+    cursor.execute("""SELECT partition_class.relname, parent_class.relname FROM pg_inherits
+                      JOIN pg_class partition_class ON partition_class.oid = pg_inherits.inhrelid
+                      JOIN pg_class parent_class ON parent_class.oid = pg_inherits.inhparent
+                      WHERE parent_class.relname = ANY(%s)""", (HOT_TABLES,))
+    return dict(cursor.fetchall() + [(table_name, table_name) for table_name in HOT_TABLES])
+
+
+def get_leading_columns(cursor) -> Dict[str, str]:
+    cursor.execute("""SELECT index_class.relname, attribute.attname FROM pg_index
+                      JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+                      JOIN pg_class table_class ON table_class.oid = pg_index.indrelid
+                      JOIN pg_attribute attribute ON attribute.attrelid = pg_index.indrelid
+                                                 AND attribute.attnum = pg_index.indkey[0]
+                      WHERE table_class.relname = ANY(%s)""", (HOT_TABLES,))
+    return {index_name: column for index_name, column in cursor.fetchall()}
+
+
+def get_scanned_relations(plan: Dict) -> Iterator[str]:
+    if "Relation Name" in plan:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from get_scanned_relations(child)
+
+
+def find_full_scans(plan: Dict, leading_columns: Dict[str, str], hot_tables: Dict[str, str]) -> Iterator[str]:
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name") in hot_tables:
+        yield f"sequential scan on {plan['Relation Name']}"
+    index_name: str = plan.get("Index Name", "")
+    if index_name in leading_columns:
+        column: str = leading_columns[index_name]
+        if not re.search(rf"\b{column}\b", plan.get("Index Cond", "")):
+            yield f"full scan of {index_name}"
+    for child in plan.get("Plans", []):
+        yield from find_full_scans(child, leading_columns, hot_tables)
+
+
+def check_plans(database_url: str) -> List[str]:
+    failures: List[str] = []
+    connection = psycopg2.connect(database_url)
+    with connection.cursor() as cursor:
+        cursor.execute("SET enable_seqscan = off")
+        hot_tables: Dict[str, str] = get_hot_tables(cursor)
+        leading_columns: Dict[str, str] = get_leading_columns(cursor)
+        partitions: Dict[str, List[str]] = {table_name: [partition for partition, parent in hot_tables.items()
+                                                         if parent == table_name and partition != table_name]
+                                            for table_name in HOT_TABLES}
+        for name, query in get_queries(TODAY, DAYS):
+            # Some of the queries consist of several statements, each one is explained on its own
+            for statement in query.as_string(connection).split(";"):
+                if not statement.strip():
+                    continue
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement)
+                plan: Dict = cursor.fetchone()[0][0]["Plan"]
+                full_scans: List[str] = list(find_full_scans(plan, leading_columns, hot_tables))
+                scanned_relations: Set[str] = set(get_scanned_relations(plan))
+                for table_name, table_partitions in partitions.items():
+                    if len(table_partitions) > 1 and all([partition in scanned_relations for partition in table_partitions]):
+                        full_scans.append(f"every partition of {table_name}")
+                print(f"{name}: {', '.join(full_scans) if full_scans else 'ok'}")
+                if full_scans:
+                    failures.append(name)
+    connection.rollback()
+    connection.close()
+    return failures
+
+
+if __name__ == "__main__":
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+        seed_database(postgres_db, database_url, TODAY, DAYS)
+        postgres_db.execute(SQL("ANALYZE"))
+        failed_queries: List[str] = check_plans(database_url)
+        postgres_db.close()
+    if failed_queries:
+        print(f"Full scans in: {', '.join(failed_queries)}")
+        sys.exit(1)
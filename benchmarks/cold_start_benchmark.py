@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Dict
+
+import start_bot
+from benchmarks.dataset import seed_database, create_sheet_response, SyntheticKreis
+from benchmarks.harness import throwaway_database, _get_free_port
+from benchmarks.webhook_check import FakeBotApi, TOKEN, WEBHOOK_PATH, create_update, post_update
+from data_modules.database import PostgresDatabase
+
+# Starts start_bot.py as a new process (webhook mode, against a fake Bot API server and a recorded Risklayer response)
+# and measures how long it takes until the first /update is answered. Fails when the median is over the budget.
+#   python -m benchmarks.cold_start_benchmark
+# BENCHMARK_DATABASE_URL  server to create the throwaway database on, otherwise a temporary cluster is started
+# BENCHMARK_RUNS          process starts (5)
+# STARTUP_BUDGET_SECONDS  cold start budget (5, like the bot)
+
+POLL_INTERVAL_SECONDS: float = 0.01
+
+
+def start_bot_process(database_url: str, api_url: str, port: int, recorded_response: Path, budget: float) -> subprocess.Popen:
+    environment: Dict[str, str] = dict(os.environ, API_KEY="benchmark", TELEGRAM_TOKEN=TOKEN, TELEGRAM_API_URL=api_url,
+                                       DATABASE_URL=database_url, RISKLAYER_RECORDED_RESPONSE=str(recorded_response),
+                                       BOT_MODE="webhook", WEBHOOK_URL="https://bot.example.org", WEBHOOK_PATH=WEBHOOK_PATH,
+                                       WEBHOOK_HOST="127.0.0.1", WEBHOOK_PORT=str(port),
+                                       STARTUP_BUDGET_SECONDS=str(budget), PYTHONUNBUFFERED="1")
+    return subprocess.Popen([sys.executable, str(Path(start_bot.__file__))], env=environment, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, text=True)
+
+
+def measure_first_answer(database_url: str, fake_bot_api: FakeBotApi, recorded_response: Path, budget: float) -> float:
+    port: int = _get_free_port()
+    answers_before: int = len(fake_bot_api.get_calls("sendMessage"))
+    start: float = time.perf_counter()
+    process: subprocess.Popen = start_bot_process(database_url, fake_bot_api.url, port, recorded_response, budget)
+    try:
+        # Telegram would retry the update as well until the webhook accepts it
+        while True:
+            try:
+                if post_update(port, create_update(1, "/update"))[0] == 200:
+                    break
+            except ConnectionError:
+                pass
+            if process.poll() is not None:
+                raise Exception(f"The bot stopped during the boot:\n{process.stdout.read()}")
+            time.sleep(POLL_INTERVAL_SECONDS)
+        while len(fake_bot_api.get_calls("sendMessage")) == answers_before:
+            time.sleep(POLL_INTERVAL_SECONDS)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        output: str = process.communicate()[0]
+        print("\n".join(["  " + line for line in output.splitlines() if "process started" in line or "budget" in line]))
+
+
+if __name__ == "__main__":
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "5"))
+    BUDGET: float = float(os.environ.get("STARTUP_BUDGET_SECONDS", "5"))
+    fake_bot_api: FakeBotApi = FakeBotApi()
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url, \
+            tempfile.TemporaryDirectory() as directory:
+        kreise: List[SyntheticKreis] = seed_database(PostgresDatabase(database_url), database_url, start_bot.get_today(), 9)
+        recorded_response: Path = Path(directory) / "risklayer.json"
+        recorded_response.write_bytes(create_sheet_response(kreise, start_bot.get_today(), 18))
+        durations: List[float] = []
+        for run in range(RUNS):
+            durations.append(measure_first_answer(database_url, fake_bot_api, recorded_response, BUDGET))
+            print(f"Run {run + 1}: first answer after {durations[-1]:.2f}s")
+    fake_bot_api.stop()
+
+    median: float = sorted(durations)[len(durations) // 2]
+    print(f"Median time to the first answer: {median:.2f}s, budget {BUDGET:.2f}s")
+    if median > BUDGET:
+        sys.exit(1)
@@ -0,0 +1,33 @@
+import os
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+from benchmarks.harness import Timing, read_report
+
+# Compares two result files of benchmarks/suite.py and exits with 1 if the p50 of a path got slower by more than
+# BENCHMARK_TOLERANCE (0.2 = 20 %).
+#   python -m benchmarks.compare baseline.json benchmark_results.json
+
+
+def compare(baseline: Dict[str, Timing], current: Dict[str, Timing], tolerance: float) -> List[str]:
+    regressions: List[str] = []
+    for name, timing in current.items():
+        if name not in baseline:
+            print(f"{name}: new, p50 {timing.p50_ms:.2f} ms")
+            continue
+        ratio: float = timing.p50_ms / baseline[name].p50_ms if baseline[name].p50_ms > 0 else 1.0
+        is_regression: bool = ratio > 1 + tolerance
+        print(f"{name}: p50 {baseline[name].p50_ms:.2f} -> {timing.p50_ms:.2f} ms ({ratio:.2f}x), "
+              f"p99 {baseline[name].p99_ms:.2f} -> {timing.p99_ms:.2f} ms{'  REGRESSION' if is_regression else ''}")
+        if is_regression:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    TOLERANCE: float = float(os.environ.get("BENCHMARK_TOLERANCE", "0.2"))
+    regressions: List[str] = compare(read_report(Path(sys.argv[1])), read_report(Path(sys.argv[2])), TOLERANCE)
+    if regressions:
+        print(f"{len(regressions)} regressions: {', '.join(regressions)}")
+        sys.exit(1)
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Callable, Awaitable, Tuple
+
+import start_bot
+from benchmarks.check_case_matrix import get_sql_bundesland_summen, get_sql_kreiszahlen_of_bundesland, \
+    get_sql_history_for_kreis, get_sql_risikogebiete
+from benchmarks.dataset import seed_database
+from benchmarks.harness import throwaway_database
+from data_modules import sql
+from data_modules.async_clients import AsyncPostgresDatabase
+from data_modules.database import PostgresDatabase
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet, \
+    render_case_number, render_bundesland, render_kreis, render_risikogebiete
+
+# Renders the same mix of commands concurrently with the threaded runtime (a pool of worker threads on the blocking
+# connection pool, like the dispatcher of python-telegram-bot) and with the asyncio runtime (one event loop on aiopg).
+# The read commands are answered from the case matrix now, so both runtimes run the database queries they used before
+# it, as load on the database. The response cache is not used, so every command queries the database.
+#   python -m benchmarks.concurrency_benchmark
+# BENCHMARK_DATABASE_URL  server to create the throwaway database on, otherwise a temporary cluster is started
+# BENCHMARK_COMMANDS      commands per runtime (2000)
+# BENCHMARK_CONCURRENCY   commands in flight at the same time (100)
+# BENCHMARK_WORKERS       worker threads of the threaded runtime (4, the default of python-telegram-bot)
+# BENCHMARK_POOL_SIZE     database connections of both runtimes (4)
+
+BUNDESLAENDER: List[str] = ["Bayern", "Bremen", "Hessen", "Berlin"]
+KREISE: List[str] = ["Dithmarschen", "Köln", "München", "Nordfriesland"]
+
+
+async def get_async_case_number(database: AsyncPostgresDatabase, today: datetime.date) -> str:
+    bundesland_summen: List[BundeslandSummary] = (await database.get(
+        sql.get_bundesland_summen(today, today - timedelta(days=start_bot.DAYS_BACK)), "get_bundesland_summen"))\
+        .convert_rows_to(BundeslandSummary)
+    return render_case_number(bundesland_summen)
+
+
+async def get_async_bundesland(database: AsyncPostgresDatabase, today: datetime.date, bundesland: str) -> str:
+    kreis_comparisons: List[KreisComparison] = (await database.get(
+        sql.get_kreiszahlen_of_bundesland(today, today - timedelta(days=start_bot.DAYS_BACK), bundesland), "get_kreiszahlen_of_bundesland"))\
+        .convert_rows_to(KreisComparison)
+    return render_bundesland(bundesland, kreis_comparisons)
+
+
+async def get_async_kreis(database: AsyncPostgresDatabase, today: datetime.date, kreis: str) -> str:
+    kreis_cases_history: List[KreisHistoryEntry] = (await database.get(
+        sql.get_history_for_kreis(kreis, today, start_bot.DAYS_BACK + 1), "get_history_for_kreis"))\
+        .convert_rows_to(KreisHistoryEntry)
+    return render_kreis(kreis, kreis_cases_history)
+
+
+async def get_async_risikogebiete(database: AsyncPostgresDatabase, today: datetime.date) -> str:
+    risikogebiete: List[Risikogebiet] = (await database.get(sql.get_risikogebiete(today), "get_risikogebiete"))\
+        .convert_rows_to(Risikogebiet)
+    return render_risikogebiete(risikogebiete)
+
+
+def get_blocking_commands(postgres_db: PostgresDatabase) -> List[Callable[[], str]]:
+    today: datetime.date = start_bot.get_today()
+    commands: List[Callable[[], str]] = [lambda: render_case_number(get_sql_bundesland_summen(postgres_db, today)),
+                                         lambda: render_risikogebiete(get_sql_risikogebiete(postgres_db, today))]
+    commands += [lambda bundesland=bundesland: render_bundesland(bundesland, get_sql_kreiszahlen_of_bundesland(postgres_db, today, bundesland))
+                 for bundesland in BUNDESLAENDER]
+    commands += [lambda kreis=kreis: render_kreis(kreis, get_sql_history_for_kreis(postgres_db, kreis, today, start_bot.DAYS_BACK + 1))
+                 for kreis in KREISE]
+    return commands
+
+
+def get_async_commands(database: AsyncPostgresDatabase) -> List[Callable[[], Awaitable[str]]]:
+    today: datetime.date = start_bot.get_today()
+    commands: List[Callable[[], Awaitable[str]]] = [lambda: get_async_case_number(database, today),
+                                                    lambda: get_async_risikogebiete(database, today)]
+    commands += [lambda bundesland=bundesland: get_async_bundesland(database, today, bundesland)
+                 for bundesland in BUNDESLAENDER]
+    commands += [lambda kreis=kreis: get_async_kreis(database, today, kreis) for kreis in KREISE]
+    return commands
+
+
+def run_threaded(database_url: str, commands: int, workers: int, pool_size: int) -> Tuple[float, int]:
+    postgres_db: PostgresDatabase = PostgresDatabase(database_url, pool_size=pool_size)
+    blocking_commands: List[Callable[[], str]] = get_blocking_commands(postgres_db)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start: float = time.perf_counter()
+        futures = [executor.submit(blocking_commands[i % len(blocking_commands)]) for i in range(commands)]
+        threads: int = threading.active_count()
+        for future in futures:
+            future.result()
+        duration: float = time.perf_counter() - start
+    postgres_db.close()
+    return duration, threads
+
+
+async def run_async(database_url: str, commands: int, concurrency: int, pool_size: int) -> Tuple[float, int]:
+    database: AsyncPostgresDatabase = await AsyncPostgresDatabase.connect(database_url, pool_size)
+    async_commands: List[Callable[[], Awaitable[str]]] = get_async_commands(database)
+    in_flight: asyncio.Semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_command(i: int):
+        async with in_flight:
+            await async_commands[i % len(async_commands)]()
+
+    start: float = time.perf_counter()
+    tasks = [asyncio.ensure_future(run_command(i)) for i in range(commands)]
+    await asyncio.sleep(0)
+    threads: int = threading.active_count()
+    await asyncio.gather(*tasks)
+    duration: float = time.perf_counter() - start
+    await database.close()
+    return duration, threads
+
+
+def check_same_messages(database_url: str):
+    postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+    blocking_messages: List[str] = [command() for command in get_blocking_commands(postgres_db)]
+    postgres_db.close()
+
+    async def render_all() -> List[str]:
+        database: AsyncPostgresDatabase = await AsyncPostgresDatabase.connect(database_url)
+        messages: List[str] = [await command() for command in get_async_commands(database)]
+        await database.close()
+        return messages
+
+    if blocking_messages != asyncio.run(render_all()):
+        raise Exception("The asyncio runtime renders different messages than the threaded runtime")
+
+
+if __name__ == "__main__":
+    COMMANDS: int = int(os.environ.get("BENCHMARK_COMMANDS", "2000"))
+    CONCURRENCY: int = int(os.environ.get("BENCHMARK_CONCURRENCY", "100"))
+    WORKERS: int = int(os.environ.get("BENCHMARK_WORKERS", "4"))
+    POOL_SIZE: int = int(os.environ.get("BENCHMARK_POOL_SIZE", "4"))
+
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        seed_database(PostgresDatabase(database_url), database_url, start_bot.get_today(), 14)
+        check_same_messages(database_url)
+        threaded_duration, threaded_threads = run_threaded(database_url, COMMANDS, WORKERS, POOL_SIZE)
+        async_duration, async_threads = asyncio.run(run_async(database_url, COMMANDS, CONCURRENCY, POOL_SIZE))
+
+    print(f"threads: {COMMANDS / threaded_duration:.0f} commands/s with {WORKERS} workers, {threaded_threads} threads")
+    print(f"asyncio: {COMMANDS / async_duration:.0f} commands/s with {CONCURRENCY} in flight, {async_threads} threads")
@@ -0,0 +1,167 @@
+import bisect
+import csv
+import html
+import json
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+from psycopg2.sql import Composed
+
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import FallzahlenIngest
+from data_modules.intraday import log_changes
+from data_modules.risklayer import KreisInformation, HAUPT_RANGES, RISKLAYER_SPREADSHEET_ID, PUBHTML_LINK_COLUMN, \
+    PUBHTML_NEW_CASES_COLUMN
+from data_modules.scheme import get_table_metadata
+
+# Synthetic Risklayer data for benchmarks and checks: the 401 Kreise of data/kreise_table.csv, each with a stable
+# incidence level and a time of day at which it reports. The reporting curve says which share of the Kreise has
+# reported by which hour (German time) and is interpolated linearly in between.
+
+KREISE_CSV: Path = Path(__file__).parent.parent / "data" / "kreise_table.csv"
+DEFAULT_REPORTING_CURVE: Dict[float, float] = {0: 0.0, 8: 0.02, 10: 0.1, 12: 0.25, 14: 0.4, 16: 0.55, 18: 0.75,
+                                               20: 0.9, 22: 0.97, 24: 1.0}
+DEFAULT_POLL_HOURS: List[float] = [9, 13, 17, 21, 23.9]
+
+
+@dataclass
+class SyntheticKreis:
+    id: int
+    bundesland: str
+    kreis: str
+    population: int
+    weekly_incidence: float
+    reporting_hour: float
+
+
+def read_kreise(seed: int = 0, reporting_curve: Dict[float, float] = None) -> List[SyntheticKreis]:
+    rng: random.Random = random.Random(seed)
+    curve: Dict[float, float] = reporting_curve or DEFAULT_REPORTING_CURVE
+    with KREISE_CSV.open(encoding="utf-8") as file:
+        rows: List[List[str]] = list(csv.reader(file))
+    return [SyntheticKreis(id=int(row[1]), bundesland=row[0], kreis=row[2], population=int(row[3]),
+                           weekly_incidence=rng.lognormvariate(4, 0.6), reporting_hour=_draw_reporting_hour(curve, rng))
+            for row in rows]
+
+
+def create_kreis_infos(kreise: List[SyntheticKreis], date: datetime.date, hour: float, seed: int = 0) -> List[KreisInformation]:
+    # The numbers of a day only depend on the date and the Kreis, so repeated polls of one day are consistent
+    infos: List[KreisInformation] = []
+    for kreis in kreise:
+        rng: random.Random = random.Random(f"{seed}-{date}-{kreis.id}")
+        new_cases: int = max(0, int(rng.gauss(kreis.weekly_incidence / 7, kreis.weekly_incidence / 21) * kreis.population / 100_000))
+        is_already_entered: bool = kreis.reporting_hour <= hour
+        infos.append(KreisInformation(kreis.id, kreis.kreis, is_already_entered, new_cases if is_already_entered else 0,
+                                      f"https://example.org/{kreis.id}", None, date))
+    return infos
+
+
+def create_sheet_response(kreise: List[SyntheticKreis], date: datetime.date, hour: float, seed: int = 0) -> bytes:
+    # The same numbers as create_kreis_infos, as a values:batchGet response of the Sheets API for HAUPT_RANGES
+    kreis_names: List[List[str]] = []
+    new_cases_today: List[List[str]] = []
+    contributors: List[List[str]] = []
+    links: List[List[str]] = []
+    for kreis_info in create_kreis_infos(kreise, date, hour, seed):
+        kreis_names.append([kreis_info.kreis])
+        new_cases_today.append([f"{kreis_info.number_of_new_cases:,}".replace(",", " ")])
+        contributors.append(["Team"] if kreis_info.is_already_entered else ["Vorläufig"] if kreis_info.kreis_id % 2 else [])
+        links.append([kreis_info.link])
+    # Like Google, leave out the empty rows at the end of a range
+    while contributors and not contributors[-1]:
+        contributors.pop()
+    value_ranges: List[Dict] = [{"range": value_range, "majorDimension": "ROWS", "values": values}
+                                for value_range, values in zip(HAUPT_RANGES, [kreis_names, new_cases_today, contributors, links])]
+    return json.dumps({"spreadsheetId": RISKLAYER_SPREADSHEET_ID, "valueRanges": value_ranges}).encode()
+
+
+def create_pubhtml(kreise: List[SyntheticKreis], date: datetime.date, hour: float, seed: int = 0) -> str:
+    # The same numbers as create_kreis_infos, as the published sheet: a style block, row headers in <th>, header and
+    # sum rows that are not Kreise, and the columns of a Kreis row where the pubhtml parser expects them
+    rng: random.Random = random.Random(seed)
+    columns: int = PUBHTML_NEW_CASES_COLUMN + 10
+    rows: List[str] = []
+
+    def add_row(cells: List[str]):
+        tds: str = "".join([f'<td class="s{i % 7}" dir="ltr">{html.escape(cell)}</td>' for i, cell in enumerate(cells)])
+        rows.append(f'<tr style="height: 20px"><th id="0R{len(rows)}" style="height: 20px;" class="row-headers-background">'
+                    f'<div class="row-header-wrapper" style="line-height: 20px">{len(rows) + 1}</div></th>{tds}</tr>')
+
+    add_row(["Risklayer", f"Stand {date}"] + [""] * (columns - 2))
+    add_row(["Kreis", "Bundesland", "Art", "Einwohner", "Fälle", "Anteil"] + [f"Spalte {i}" for i in range(6, columns)])
+    for kreis, kreis_info in zip(kreise, create_kreis_infos(kreise, date, hour, seed)):
+        cells: List[str] = [kreis_info.kreis, kreis.bundesland, "Landkreis" if kreis.id % 3 else "Kreisfreie Stadt",
+                            f"{kreis.population:,}".replace(",", "."), str(rng.randint(0, 5000)), f"{rng.random() * 5:.1f}%"]
+        cells += [str(rng.randint(0, 1000)) for column in range(6, PUBHTML_LINK_COLUMN)]
+        cells += [kreis_info.link, "Team" if kreis_info.is_already_entered else "Vorläufig" if kreis_info.kreis_id % 2 else "",
+                  f"{kreis_info.number_of_new_cases:,}".replace(",", " ") if kreis_info.is_already_entered else ""]
+        cells += [f"{rng.random() * 100:.2f}" for column in range(PUBHTML_NEW_CASES_COLUMN + 1, columns)]
+        add_row(cells)
+    for bundesland in sorted({kreis.bundesland for kreis in kreise}):
+        add_row([bundesland, "Summe", "", "", "", ""] + [""] * (columns - 6))
+    style: str = "".join([f".ritz .waffle .s{i}{{border-bottom:1px SOLID #000000;background-color:#ffffff;text-align:left;"
+                          f"color:#000000;font-family:'Arial';font-size:10pt;vertical-align:bottom;white-space:nowrap;"
+                          f"direction:ltr;padding:2px 3px 2px 3px;}}" for i in range(7)])
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><style type="text/css">{style}</style></head>'
+            f'<body><div id="sheets-viewport"><div class="ritz grid-container"><table class="waffle" cellspacing="0" '
+            f'cellpadding="0"><thead><tr><th class="row-header freezebar-origin-ltr"></th></tr></thead><tbody>'
+            f'{"".join(rows)}</tbody></table></div></div></body></html>')
+
+
+def seed_database(postgres_db: PostgresDatabase, database_url: str, today: datetime.date, days: int,
+                  poll_hours: List[float] = None, seed: int = 0,
+                  reporting_curve: Optional[Dict[float, float]] = None) -> List[SyntheticKreis]:
+    postgres_db.initialize_tables(database_url, get_table_metadata())
+    kreise: List[SyntheticKreis] = read_kreise(seed, reporting_curve)
+    postgres_db.upsert("kreise", [{"id": kreis.id, "bundesland": kreis.bundesland, "kreis": kreis.kreis,
+                                   "population": kreis.population} for kreis in kreise])
+    fallzahlen_ingest: FallzahlenIngest = FallzahlenIngest(postgres_db)
+    fallzahlen_ingest.add_writer(log_changes)
+    for day in range(days - 1, -1, -1):
+        date: datetime.date = today - timedelta(days=day)
+        hours: List[float] = poll_hours or DEFAULT_POLL_HOURS
+        # Today is only polled until noon, so there are Kreise that did not report yet
+        for hour in hours if day > 0 else [hour for hour in hours if hour <= 12] or hours[:1]:
+            fallzahlen_ingest.ingest(create_kreis_infos(kreise, date, hour, seed), get_poll_time(date, hour))
+    return kreise
+
+
+def get_poll_time(date: datetime.date, hour: float) -> datetime:
+    return datetime.combine(date, datetime.min.time()) + timedelta(hours=hour)
+
+
+# Every query of data_modules/sql.py, with parameters that hit a database seeded with seed_database(..., today, days)
+def get_queries(today: datetime.date, days: int) -> List[Tuple[str, Composed]]:
+    last_week: datetime.date = today - timedelta(days=7)
+    return [
+        ("get_bundesland_cases_on_date", sql.get_bundesland_cases_on_date(last_week, today)),
+        ("get_case_number_on_data", sql.get_case_number_on_data(last_week)),
+        ("get_kreiszahlen_of_bundesland", sql.get_kreiszahlen_of_bundesland(today, last_week, "Bayern")),
+        ("get_bundesland_summen", sql.get_bundesland_summen(today, last_week)),
+        ("get_risikogebiete", sql.get_risikogebiete(today)),
+        ("get_history_for_kreis", sql.get_history_for_kreis("Dithmarschen", today, 8)),
+        ("get_fallzahlen_on_date", sql.get_fallzahlen_on_date(today)),
+        ("get_fallzahlen_between", sql.get_fallzahlen_between(today - timedelta(days=2), today - timedelta(days=1))),
+        ("get_all_kreise", sql.get_all_kreise()),
+        ("get_kreise_in_name_order", sql.get_kreise_in_name_order()),
+        ("get_active_chat_ids", sql.get_active_chat_ids()),
+        ("append_fallzahlen_log", sql.append_fallzahlen_log(today, 48, [(1, 3), (2, -1)])),
+        ("get_fallzahlen_log_dates_before", sql.get_fallzahlen_log_dates_before(today)),
+        ("compact_fallzahlen_log", sql.compact_fallzahlen_log(today - timedelta(days=1), 96)),
+        ("get_fallzahlen_kurven_between", sql.get_fallzahlen_kurven_between(today - timedelta(days=8), today)),
+        ("delete_aggregates_from_before", sql.delete_aggregates_from_before(today - timedelta(days=days))),
+    ]
+
+
+def _draw_reporting_hour(curve: Dict[float, float], rng: random.Random) -> float:
+    hours: List[float] = sorted(curve.keys())
+    shares: List[float] = [curve[hour] for hour in hours]
+    share: float = rng.random()
+    index: int = min(max(1, bisect.bisect_left(shares, share)), len(shares) - 1)
+    lower_share, upper_share = shares[index - 1], shares[index]
+    fraction: float = (share - lower_share) / (upper_share - lower_share) if upper_share > lower_share else 0.0
+    return hours[index - 1] + fraction * (hours[index] - hours[index - 1])
@@ -0,0 +1,119 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Callable
+
+import start_bot
+from benchmarks.dataset import read_kreise, create_kreis_infos, SyntheticKreis
+from data_modules.risklayer import KreisInformation
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet, WeeklyCases
+
+# Renders every bot message from fixed synthetic inputs (no database needed) and compares it with the saved golden
+# output in benchmarks/golden, byte for byte. After an intended change of a message, --write saves the new output.
+#   python -m benchmarks.golden_check [--write]
+
+GOLDEN_DIRECTORY: Path = Path(__file__).parent / "golden"
+TODAY: datetime.date = datetime(2021, 1, 14).date()
+HOUR: float = 18
+
+
+def get_days(kreise: List[SyntheticKreis], days: int) -> List[List[KreisInformation]]:
+    # Today first, then the days before
+    return [create_kreis_infos(kreise, TODAY - timedelta(days=day), HOUR if day == 0 else 24) for day in range(days)]
+
+
+def create_bundesland_summen(kreise: List[SyntheticKreis], days: List[List[KreisInformation]]) -> List[BundeslandSummary]:
+    bundeslaender: Dict[int, str] = {kreis.id: kreis.bundesland for kreis in kreise}
+    cases_total_last_week: int = sum([kreis_info.number_of_new_cases for kreis_info in days[7]])
+    summen: Dict[str, BundeslandSummary] = {}
+    for kreis_info, kreis_info_last_week in zip(days[0], days[7]):
+        if not kreis_info.is_already_entered:
+            continue
+        summe: BundeslandSummary = summen.setdefault(bundeslaender[kreis_info.kreis_id],
+                                                     BundeslandSummary(bundeslaender[kreis_info.kreis_id], 0, 0, cases_total_last_week))
+        summe.new_cases += kreis_info.number_of_new_cases
+        summe.new_cases_last_week += kreis_info_last_week.number_of_new_cases
+    return [summen[bundesland] for bundesland in sorted(summen)]
+
+
+def create_kreis_comparisons(kreise: List[SyntheticKreis], days: List[List[KreisInformation]],
+                             bundesland: str) -> List[KreisComparison]:
+    return sorted([KreisComparison(kreis_info.kreis, kreis_info.number_of_new_cases, kreis_info_last_week.number_of_new_cases)
+                   for kreis, kreis_info, kreis_info_last_week in zip(kreise, days[0], days[7])
+                   if kreis.bundesland == bundesland and kreis_info.is_already_entered], key=lambda comparison: comparison.kreis)
+
+
+def create_kreis_history(kreise: List[SyntheticKreis], days: List[List[KreisInformation]], kreis_id: int) -> List[KreisHistoryEntry]:
+    return [KreisHistoryEntry(kreise[kreis_id].kreis, kreise[kreis_id].population, day[kreis_id].number_of_new_cases,
+                              day[kreis_id].link) for day in days[:8]]
+
+
+def create_risikogebiete(kreise: List[SyntheticKreis], days: List[List[KreisInformation]]) -> List[Risikogebiet]:
+    risikogebiete: List[Risikogebiet] = []
+    for kreis in kreise:
+        seven_day_cases: int = sum([day[kreis.id].number_of_new_cases for day in days[1:8]])
+        incidence: int = int(seven_day_cases / kreis.population * 100_000)
+        if incidence >= 50:
+            risikogebiete.append(Risikogebiet(incidence, kreis.kreis))
+    return sorted(risikogebiete, key=lambda risikogebiet: risikogebiet.seven_day_incidence, reverse=True)
+
+
+def create_weekly_cases(days: List[List[KreisInformation]], kreis_id: int, weeks: int) -> List[WeeklyCases]:
+    # The oldest week has no data, like after a downtime of the bot
+    weekly_cases: List[WeeklyCases] = []
+    for week in range(weeks - 1, -1, -1):
+        last_day: datetime.date = TODAY - timedelta(days=1 + 7 * week)
+        new_cases: int = sum([day[kreis_id].number_of_new_cases for day in days[1 + 7 * week:8 + 7 * week]])
+        weekly_cases.append(WeeklyCases(last_day - timedelta(days=6), last_day, new_cases if week < weeks - 1 else None))
+    return weekly_cases
+
+
+def get_golden_messages() -> Dict[str, Callable[[], str]]:
+    kreise: List[SyntheticKreis] = read_kreise()
+    days: List[List[KreisInformation]] = get_days(kreise, 29)
+    kreis_with_parentheses: SyntheticKreis = [kreis for kreis in kreise if "(" in kreis.kreis][0]
+    # A correction of the sheet can make the new cases of a day negative
+    corrected_history: List[KreisHistoryEntry] = create_kreis_history(kreise, days, 3)
+    corrected_history[2].number_of_new_cases = -4
+    return {
+        "update": lambda: start_bot.render_case_number(create_bundesland_summen(kreise, days)),
+        "update_with_prognosis": lambda: start_bot.render_case_number(create_bundesland_summen(kreise, days), 23456.7),
+        "bundesland_bayern": lambda: start_bot.render_bundesland("Bayern", create_kreis_comparisons(kreise, days, "Bayern")),
+        "bundesland_baden_wuerttemberg": lambda: start_bot.render_bundesland(
+            "Baden-Württemberg", create_kreis_comparisons(kreise, days, "Baden-Württemberg")),
+        # Every MarkdownV2 special character, the old escaping missed most of them
+        "bundesland_special_characters": lambda: start_bot.render_bundesland(
+            "\\_*[]()~`>#+-=|{}.!", [KreisComparison("Neu-Ulm (Stadt) [Test]!", 5, -1)]),
+        "kreis_dithmarschen": lambda: start_bot.render_kreis("Dithmarschen", create_kreis_history(kreise, days, 0)),
+        "kreis_with_parentheses": lambda: start_bot.render_kreis(
+            kreis_with_parentheses.kreis, create_kreis_history(kreise, days, kreis_with_parentheses.id)),
+        "kreis_corrected": lambda: start_bot.render_kreis(kreise[3].kreis, corrected_history),
+        "kreis_first_day": lambda: start_bot.render_kreis("Dithmarschen", create_kreis_history(kreise, days, 0)[:1]),
+        "risikogebiete": lambda: start_bot.render_risikogebiete(create_risikogebiete(kreise, days)),
+        "history": lambda: start_bot.render_history(kreis_with_parentheses.kreis, kreis_with_parentheses.population,
+                                                    create_weekly_cases(days, kreis_with_parentheses.id, 4)),
+        "history_usage": lambda: start_bot.render_history_usage(8, True),
+        "history_usage_no_archive": lambda: start_bot.render_history_usage(8, False),
+    }
+
+
+if __name__ == "__main__":
+    WRITE: bool = "--write" in sys.argv[1:]
+    GOLDEN_DIRECTORY.mkdir(exist_ok=True)
+    different: List[str] = []
+    for name, render in get_golden_messages().items():
+        message: str = render()
+        golden_path: Path = GOLDEN_DIRECTORY / f"{name}.md"
+        if WRITE:
+            golden_path.write_text(message, encoding="utf-8")
+            continue
+        if not golden_path.exists() or golden_path.read_text(encoding="utf-8") != message:
+            different.append(name)
+            print(f"{name}: differs from {golden_path.name}")
+        else:
+            print(f"{name}: ok")
+    if WRITE:
+        print(f"Wrote the golden output to {GOLDEN_DIRECTORY}")
+    elif different:
+        print(f"{len(different)} messages differ from the golden output: {', '.join(different)}")
+        sys.exit(1)
@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List, Callable, Optional, Dict, Iterator
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from psycopg2.sql import SQL, Identifier, Literal, Composed
+
+import data_modules.helper_functions as help
+
+
+@dataclass
+class Timing:
+    name: str
+    runs: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    mean_ms: float
+
+
+def measure(name: str, action: Callable[[], object], runs: int, setup: Optional[Callable[[], None]] = None) -> Timing:
+    # setup runs before every run and is not part of the timing
+    durations: List[float] = []
+    for run in range(runs):
+        if setup is not None:
+            setup()
+        start: float = time.perf_counter()
+        action()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    timing: Timing = Timing(name=name, runs=runs, p50_ms=help.get_percentile(durations, 50),
+                            p95_ms=help.get_percentile(durations, 95), p99_ms=help.get_percentile(durations, 99),
+                            mean_ms=sum(durations) / len(durations))
+    print(f"{name}: p50 {timing.p50_ms:.2f} ms, p95 {timing.p95_ms:.2f} ms, p99 {timing.p99_ms:.2f} ms")
+    return timing
+
+
+def write_report(path: Path, timings: List[Timing], parameters: Dict):
+    report: Dict = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "parameters": parameters,
+                    "results": [asdict(timing) for timing in timings]}
+    path.write_text(json.dumps(report, indent=2))
+
+
+def read_report(path: Path) -> Dict[str, Timing]:
+    results: List[Dict] = json.loads(path.read_text())["results"]
+    return {result["name"]: Timing(**result) for result in results}
+
+
+# Yields the URL of an empty database that is dropped afterwards. With a server URL (postgresql://...), the database is created on that
+# server. Without one, a temporary cluster is started with initdb and pg_ctl from the PATH (this does not work as root).
+@contextmanager
+def throwaway_database(server_url: Optional[str]) -> Iterator[str]:
+    if server_url:
+        with _throwaway_database_on(server_url) as database_url:
+            yield database_url
+    else:
+        with _throwaway_cluster() as cluster_url, _throwaway_database_on(cluster_url) as database_url:
+            yield database_url
+
+
+@contextmanager
+def _throwaway_database_on(server_url: str) -> Iterator[str]:
+    database_name: str = f"benchmark_{uuid.uuid4().hex[:12]}"
+    _execute_autocommit(server_url, SQL("CREATE DATABASE {name} ENCODING 'UTF8' TEMPLATE template0").format(name=Identifier(database_name)))
+    try:
+        yield urlunsplit(urlsplit(server_url)._replace(path=f"/{database_name}"))
+    finally:
+        # The connection pools of the benchmark may still be connected
+        _execute_autocommit(server_url, SQL("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = {name}")
+                            .format(name=Literal(database_name)))
+        _execute_autocommit(server_url, SQL("DROP DATABASE IF EXISTS {name}").format(name=Identifier(database_name)))
+
+
+@contextmanager
+def _throwaway_cluster() -> Iterator[str]:
+    directory: str = tempfile.mkdtemp(prefix="benchmark_postgres_")
+    data_directory: str = os.path.join(directory, "data")
+    port: int = _get_free_port()
+    subprocess.run(["initdb", "-D", data_directory, "-U", "postgres", "-E", "UTF8", "--locale=C", "--auth=trust"],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run(["pg_ctl", "-D", data_directory, "-o", f"-p {port} -k {directory} -c fsync=off",
+                    "-l", os.path.join(directory, "postgres.log"), "-w", "start"], check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield f"postgresql://postgres@localhost:{port}/postgres"
+    finally:
+        subprocess.run(["pg_ctl", "-D", data_directory, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _execute_autocommit(database_url: str, sql: Composed):
+    connection = psycopg2.connect(database_url)
+    try:
+        connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+    finally:
+        connection.close()
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,68 @@
+import random
+import time
+from datetime import date, timedelta
+from typing import List, Dict, Tuple, Callable
+
+from data_modules.database import DbResult, _instanciate_new_instance, _get_variables_of_type
+from data_modules.risklayer import KreisInformation
+from data_modules.scheme import Kreis, Fallzahl
+
+# Maps a result of 28 days x 401 Kreise (fallzahlen joined with kreise, like the handler queries) with the old
+# dict-per-row mapper and with the row mapping plans of DbResult.
+
+DAYS: int = 28
+NUMBER_OF_KREISE: int = 401
+RUNS: int = 10
+
+
+def create_result() -> DbResult:
+    column_names: List[str] = ["kreis_id", "date", "number_of_new_cases", "link", "is_already_entered",
+                               "id", "bundesland", "kreis", "population"]
+    first_day: date = date(2020, 11, 1)
+    rows: List[Tuple] = [(kreis_id, first_day + timedelta(days=day), random.randint(0, 300), f"https://example.org/{kreis_id}",
+                          True, kreis_id, "Bayern", f"Kreis {kreis_id}", random.randint(30_000, 3_000_000))
+                         for day in range(DAYS) for kreis_id in range(NUMBER_OF_KREISE)]
+    return DbResult(column_names, rows)
+
+
+def legacy_convert_rows_to(data: List[Dict], type) -> List:
+    instance_variables: List[str] = _get_variables_of_type(_instanciate_new_instance(type))
+    result: List = []
+    for entry in data:
+        new_instance = _instanciate_new_instance(type)
+        for variable in instance_variables:
+            if variable in entry.keys():
+                value = entry[variable]
+            elif DbResult.get_column_alias(type.__tablename__, variable) in entry.keys():
+                value = entry[DbResult.get_column_alias(type.__tablename__, variable)]
+            else:
+                value = None
+            setattr(new_instance, variable, value)
+        result.append(new_instance)
+    return result
+
+
+def legacy_get(result: DbResult) -> List[Dict]:
+    # The old PostgresDatabase.get built one dict per row before anything was mapped
+    return [dict(zip(result.column_names, row)) for row in result.rows]
+
+
+def measure(name: str, action: Callable[[], object]):
+    timings: List[float] = []
+    for run in range(RUNS):
+        start: float = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name}: median {timings[len(timings) // 2] * 1000:.1f} ms, best {timings[0] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    result: DbResult = create_result()
+    print(f"{len(result.rows)} rows")
+    measure("legacy KreisInformation", lambda: legacy_convert_rows_to(legacy_get(result), KreisInformation))
+    measure("planned KreisInformation", lambda: result.convert_rows_to(KreisInformation))
+    measure("planned KreisInformation records", lambda: result.convert_rows_to_records(KreisInformation))
+    measure("legacy (Kreis, Fallzahl)", lambda: list(zip(legacy_convert_rows_to(legacy_get(result), Kreis),
+                                                         legacy_convert_rows_to(legacy_get(result), Fallzahl))))
+    measure("planned (Kreis, Fallzahl)", lambda: result.convert_to_two_types(Kreis, Fallzahl))
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import tracemalloc
+import warnings
+from pathlib import Path
+from typing import List, Tuple, Callable
+
+import start_bot
+from benchmarks.dataset import read_kreise, create_pubhtml, create_kreis_infos, SyntheticKreis
+from benchmarks.harness import measure
+from data_modules.risklayer import PubhtmlParser, KreisInformation, PUBHTML_CHUNK_SIZE, _preprocess_raw_data
+
+# Compares the BeautifulSoup parsing of the published sheet that was used before with the streaming PubhtmlParser:
+# parse time and peak memory (tracemalloc) for a saved page, and that both find the same rows.
+#   python -m benchmarks.pubhtml_benchmark
+# BENCHMARK_PUBHTML  a page saved with risklayer.record_pubhtml, otherwise a synthetic page is generated
+# BENCHMARK_RUNS     runs per parser (20)
+
+RawData = Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]
+
+
+def legacy_parse(path: Path) -> RawData:
+    from bs4 import BeautifulSoup
+
+    def is_valid_row(row) -> bool:
+        if len(row.findAll("td")) < 5:
+            return False
+        if "kreis" not in str(row.findAll("td")[2].text).lower():
+            return False
+        if "%" not in str(row.findAll("td")[5].text).lower():
+            return False
+        return True
+
+    # The old code as it was, including the deprecated findAll
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        html_page: BeautifulSoup = BeautifulSoup(path.read_text(encoding="utf-8"))
+        only_valid_rows = [row for row in html_page.findAll("tr") if is_valid_row(row)]
+        kreis_names_raw: List[List[str]] = []
+        new_cases_today_raw: List[List[str]] = []
+        contributors_raw: List[List[str]] = []
+        links_raw: List[List[str]] = []
+        for row in only_valid_rows:
+            kreis_names_raw.append([str(row.findAll("td")[0].text)])
+            new_cases_today_raw.append([str(row.findAll("td")[20].text)])
+            contributors_raw.append([str(row.findAll("td")[19].text)])
+            links_raw.append([str(row.findAll("td")[18].text)])
+    return kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw
+
+
+def streaming_parse(path: Path) -> RawData:
+    # Reads the file in the chunks the HTTP response would be read in
+    parser: PubhtmlParser = PubhtmlParser()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(PUBHTML_CHUNK_SIZE), b""):
+            parser.feed_chunk(chunk)
+    return parser.finish()
+
+
+def get_peak_memory(parse: Callable[[Path], RawData], path: Path) -> int:
+    tracemalloc.start()
+    parse(path)
+    peak: int = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+if __name__ == "__main__":
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "20"))
+    PUBHTML: str = os.environ.get("BENCHMARK_PUBHTML", "")
+    expected_kreis_infos: List[KreisInformation] = []
+    with tempfile.TemporaryDirectory() as directory:
+        path: Path = Path(PUBHTML) if PUBHTML else Path(directory) / "pubhtml.html"
+        if not PUBHTML:
+            kreise: List[SyntheticKreis] = read_kreise()
+            path.write_text(create_pubhtml(kreise, start_bot.get_today(), 15), encoding="utf-8")
+            expected_kreis_infos = create_kreis_infos(kreise, start_bot.get_today(), 15)
+        print(f"Page: {path.stat().st_size / 1024:.0f} KiB")
+
+        legacy_rows: RawData = legacy_parse(path)
+        streaming_rows: RawData = streaming_parse(path)
+        if legacy_rows != streaming_rows:
+            raise Exception("The streaming parser found different rows than BeautifulSoup")
+        if expected_kreis_infos and [(kreis_info.kreis, kreis_info.number_of_new_cases, kreis_info.is_already_entered)
+                                     for kreis_info in _preprocess_raw_data(*streaming_rows)] != \
+                [(kreis_info.kreis, kreis_info.number_of_new_cases, kreis_info.is_already_entered)
+                 for kreis_info in expected_kreis_infos]:
+            raise Exception("The rows of the streaming parser do not match the synthetic data")
+        print(f"Both parsers found the same {len(streaming_rows[0])} Kreise")
+
+        for name, parse in [("BeautifulSoup", legacy_parse), ("PubhtmlParser", streaming_parse)]:
+            measure(name, lambda: parse(path), RUNS)
+            print(f"{name}: peak memory {get_peak_memory(parse, path) / 1024 / 1024:.1f} MiB")
@@ -0,0 +1,118 @@
+import os
+import sys
+from typing import List, Dict, Callable
+
+import start_bot
+from benchmarks.golden_check import get_days, create_bundesland_summen, create_kreis_comparisons, \
+    create_kreis_history, create_risikogebiete
+from benchmarks.dataset import read_kreise, SyntheticKreis
+from benchmarks.harness import measure, Timing
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet, \
+    get_emoji_for_case_numbers
+from data_modules.risklayer import KreisInformation
+from data_modules.routing import create_bundesland_command, create_kreis_command
+
+# Compares the rendering of the bot messages with the old way: += concatenation and escaping the whole message with
+# chains of str.replace afterwards. Both have to give the same messages for the synthetic data.
+#   python -m benchmarks.rendering_benchmark
+# BENCHMARK_RUNS  runs per message and renderer (2000)
+
+
+# The old code as it was
+
+def legacy_escape_markdown_chars(unescaped_markdown: str) -> str:
+    escaped_unsafe: str = unescaped_markdown.replace("(", "\\(")
+    escaped_unsafe = escaped_unsafe.replace(")", "\\)")
+    escaped_unsafe = escaped_unsafe.replace("*", "\\*")
+    escaped_unsafe = escaped_unsafe.replace("_", "\\_")
+    escaped_unsafe = escaped_unsafe.replace("%", "\\%")
+    return escaped_unsafe
+
+
+def legacy_escape_unnormal_markdown_chars(unescaped_markdown: str) -> str:
+    markdown = unescaped_markdown.replace("-", "\\-")
+    markdown = markdown.replace(".", "\\.")
+    markdown = markdown.replace("+", "\\+")
+    markdown = markdown.replace("#", "\\#")
+    markdown = markdown.replace("=", "\\=")
+    return markdown
+
+
+def legacy_render_case_number(bundesland_summen: List[BundeslandSummary]) -> str:
+    cases_one_week_ago: int = bundesland_summen[0].cases_total_last_week if bundesland_summen else 0
+    sorted_desc_by_growth: List[BundeslandSummary] = sorted(bundesland_summen, key=lambda summe: summe.new_cases - summe.new_cases_last_week, reverse=True)
+    cases_today_so_far: int = sum([summe.new_cases for summe in bundesland_summen])
+    cases_last_week_same_districts: int = sum([summe.new_cases_last_week for summe in bundesland_summen])
+    markdown: str = f"Today there are *{cases_today_so_far}* new cases so far. For the same districts, there" \
+                    f" were *{cases_last_week_same_districts}* cases last week. " \
+                    f"Prognosis for today: *{round(cases_today_so_far/cases_last_week_same_districts * cases_one_week_ago, 0)}* cases \n \n"
+    for summe in sorted_desc_by_growth:
+        emoji: str = get_emoji_for_case_numbers(int(summe.new_cases_last_week), int(summe.new_cases))
+        bundesland_name: str = legacy_escape_markdown_chars(create_bundesland_command(summe.bundesland))
+        markdown += f'{emoji} */{bundesland_name}*: {summe.new_cases} \\({summe.new_cases_last_week}\\) \n'
+    return legacy_escape_unnormal_markdown_chars(markdown)
+
+
+def legacy_render_bundesland(bundesland: str, kreis_comparisons: List[KreisComparison]) -> str:
+    markdown = f"*{bundesland}*:\n"
+    for kreis in kreis_comparisons:
+        emoji: str = get_emoji_for_case_numbers(kreis.number_of_new_cases_last_week, kreis.number_of_new_cases)
+        kreis_name = legacy_escape_markdown_chars(create_kreis_command(kreis.kreis))
+        markdown += f"{emoji} */{kreis_name}*: " \
+                    f"{kreis.number_of_new_cases} \\({kreis.number_of_new_cases_last_week}\\) \n"
+    return legacy_escape_unnormal_markdown_chars(markdown)
+
+
+def legacy_render_kreis(kreis: str, kreis_cases_history: List[KreisHistoryEntry]) -> str:
+    markdown = f"*{legacy_escape_markdown_chars(kreis)}*:\n"
+    markdown += "*Last Seven Days:* "
+    for case_number in kreis_cases_history[1:8]:
+        markdown += f"{case_number.number_of_new_cases}-"
+    case_number_sum: int = sum([case_number.number_of_new_cases for case_number in kreis_cases_history[1:8]])
+    markdown = markdown[:-1]
+    markdown += "\n"
+    markdown += "*Average*: "
+    markdown += f"{round(case_number_sum/7, 2)} \n"
+    markdown += f"*7-Day Incidence*: {round(case_number_sum / kreis_cases_history[0].population * 100_000, 2)} per 100.000 \n"
+    markdown += f"*Link:* [{legacy_escape_markdown_chars(kreis_cases_history[0].kreis)}]({legacy_escape_markdown_chars(kreis_cases_history[0].link)})"
+    return legacy_escape_unnormal_markdown_chars(markdown)
+
+
+def legacy_render_risikogebiete(risikogebiete: List[Risikogebiet]) -> str:
+    markdown: str = f"Here are the risky areas of Germany. There are in total *{len(risikogebiete)}* of such areas. Incidence per 100k: \n \n"
+    for risikogebiet in risikogebiete:
+        kreis_name = legacy_escape_markdown_chars(create_kreis_command(risikogebiet.kreis))
+        markdown += f"*/{kreis_name}*: {risikogebiet.seven_day_incidence} \n"
+    return legacy_escape_unnormal_markdown_chars(markdown)
+
+
+def get_renderers(kreise: List[SyntheticKreis], days: List[List[KreisInformation]]) -> Dict[str, List[Callable[[], str]]]:
+    # The inputs are created once, only the rendering is measured
+    bundesland_summen: List[BundeslandSummary] = create_bundesland_summen(kreise, days)
+    kreis_comparisons: List[KreisComparison] = create_kreis_comparisons(kreise, days, "Bayern")
+    kreis_history: List[KreisHistoryEntry] = create_kreis_history(kreise, days, 0)
+    risikogebiete: List[Risikogebiet] = create_risikogebiete(kreise, days)
+    return {
+        "update": [lambda: legacy_render_case_number(bundesland_summen),
+                   lambda: start_bot.render_case_number(bundesland_summen)],
+        "bundesland": [lambda: legacy_render_bundesland("Bayern", kreis_comparisons),
+                       lambda: start_bot.render_bundesland("Bayern", kreis_comparisons)],
+        "kreis": [lambda: legacy_render_kreis("Dithmarschen", kreis_history),
+                  lambda: start_bot.render_kreis("Dithmarschen", kreis_history)],
+        "risikogebiete": [lambda: legacy_render_risikogebiete(risikogebiete),
+                          lambda: start_bot.render_risikogebiete(risikogebiete)],
+    }
+
+
+if __name__ == "__main__":
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "2000"))
+    kreise: List[SyntheticKreis] = read_kreise()
+    renderers: Dict[str, List[Callable[[], str]]] = get_renderers(kreise, get_days(kreise, 29))
+    for name, (legacy_render, render) in renderers.items():
+        if legacy_render() != render():
+            print(f"{name}: the messages differ")
+            sys.exit(1)
+        print(f"{name}: {len(render())} characters")
+        legacy: Timing = measure(f"{name} (concatenate and replace)", legacy_render, RUNS)
+        current: Timing = measure(f"{name} (templates and translate)", render, RUNS)
+        print(f"{name}: {legacy.p50_ms / current.p50_ms if current.p50_ms > 0 else 0:.1f}x faster")
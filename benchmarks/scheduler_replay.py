@@ -0,0 +1,191 @@
+import bisect
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Callable, Optional, Dict, Tuple
+
+import start_bot
+import data_modules.helper_functions as help
+from benchmarks.dataset import read_kreise, SyntheticKreis, DEFAULT_REPORTING_CURVE
+from data_modules.ingest import Changeset, KreisChange, _has_changed, _to_change
+from data_modules.risklayer import KreisInformation
+from data_modules.scheduling import AdaptivePollSchedule
+from data_modules.scheme import Fallzahl
+
+# Replays days of Risklayer changes against the fixed 600 s poll interval and the adaptive schedule
+# (data_modules/scheduling.py), without a database or network. A changed row is one Kreis entering its numbers at its
+# reporting time (benchmarks/dataset.py), some Kreise correct them a few hours later. Every poll goes through
+# start_bot.update_data with a replayed sheet and ingest, so the schedule sees what it sees in production: 0 while the
+# sheet is unchanged, and the first poll of a day inserts a row for every Kreis. The staleness of a change is the time
+# until the next poll picks it up. The adaptive schedule has to need fewer polls at an equal or lower mean and p95
+# staleness, on the days after it learned the profile from the warm up days, and it has to back off at night.
+#   python -m benchmarks.scheduler_replay
+# BENCHMARK_DAYS         replayed days after the warm up (14)
+# BENCHMARK_WARMUP_DAYS  days the adaptive schedule learns from first (7)
+
+FIXED_SECONDS: float = 600
+MAX_SECONDS: float = 1800
+START: datetime = datetime(2020, 11, 2)
+# Every fourth day reports later, like on the weekend
+LATE_REPORTING_CURVE: Dict[float, float] = {0: 0.0, 10: 0.02, 12: 0.08, 14: 0.2, 16: 0.35, 18: 0.55, 20: 0.75,
+                                            22: 0.92, 24: 1.0}
+CORRECTED_SHARE: float = 0.1
+# Nothing is reported before this hour, the schedule should poll at max_seconds until then
+NIGHT_END_HOUR: int = 5
+
+
+@dataclass
+class ReplayResult:
+    polls: int
+    mean_staleness: float
+    p95_staleness: float
+    max_staleness: float
+    night_polls: int
+
+
+# Seconds since START and index of the Kreis of every changed row
+def create_changes(kreise: List[SyntheticKreis], days: int) -> List[Tuple[float, int]]:
+    changes: List[Tuple[float, int]] = []
+    for day in range(days):
+        rng: random.Random = random.Random(f"replay-{day}")
+        curve: Dict[float, float] = LATE_REPORTING_CURVE if day % 4 == 3 else DEFAULT_REPORTING_CURVE
+        for index, kreis in enumerate(read_kreise(day, curve)):
+            reported: float = day * 86400 + kreis.reporting_hour * 3600
+            changes.append((reported, index))
+            if rng.random() < CORRECTED_SHARE:
+                changes.append((min(reported + rng.uniform(1, 3) * 3600, (day + 1) * 86400 - 1), index))
+    return sorted(changes)
+
+
+# Stand-in for RisklayerClient: the sheet at the replayed time, None while it is the one of the last committed fetch
+# (like the digest, which includes the date)
+class ReplaySheet:
+
+    def __init__(self, kreise: List[SyntheticKreis], changes: List[Tuple[float, int]]):
+        self.now: float = 0.0
+        self._kreise: List[SyntheticKreis] = kreise
+        self._changes: List[Tuple[float, int]] = changes
+        self._next_change: int = 0
+        self._day: int = -1
+        # Changes of every Kreis on the current day
+        self._reported: Dict[int, int] = {}
+        self._version: int = 0
+        self._fetched_version: int = 0
+        self._committed_version: int = 0
+
+    def get_new_data(self) -> Optional[List[KreisInformation]]:
+        while self._next_change < len(self._changes) and self._changes[self._next_change][0] <= self.now:
+            seconds, index = self._changes[self._next_change]
+            self._start_day(int(seconds // 86400))
+            self._reported[index] = self._reported.get(index, 0) + 1
+            self._version += 1
+            self._next_change += 1
+        self._start_day(int(self.now // 86400))
+        self._fetched_version = self._version
+        if self._version == self._committed_version:
+            return None
+        date: datetime.date = (START + timedelta(days=self._day)).date()
+        return [KreisInformation(kreis.id, kreis.kreis, index in self._reported, 1000 + self._reported.get(index, 0), "",
+                                 kreis.bundesland, date)
+                for index, kreis in enumerate(self._kreise)]
+
+    def commit_fetch(self):
+        self._committed_version = self._fetched_version
+
+    def _start_day(self, day: int):
+        if day != self._day:
+            self._day = day
+            self._reported = {}
+            self._version += 1
+
+
+# Stand-in for FallzahlenIngest without the database: the same comparison with the snapshot of the day, which is
+# empty on a new day
+class ReplayIngest:
+
+    def __init__(self):
+        self._snapshot: Dict[int, Fallzahl] = {}
+        self._snapshot_date: Optional[datetime.date] = None
+
+    def ingest(self, kreis_infos: List[KreisInformation], polled_at: Optional[datetime] = None) -> Changeset:
+        date: datetime.date = kreis_infos[0].date
+        snapshot_reloaded: bool = date != self._snapshot_date
+        if snapshot_reloaded:
+            self._snapshot = {}
+            self._snapshot_date = date
+        changed: List[KreisInformation] = [kreis_info for kreis_info in kreis_infos
+                                            if _has_changed(self._snapshot.get(kreis_info.kreis_id), kreis_info)]
+        changes: List[KreisChange] = [_to_change(self._snapshot.get(kreis_info.kreis_id), kreis_info) for kreis_info in changed]
+        for kreis_info in changed:
+            self._snapshot[kreis_info.kreis_id] = Fallzahl(kreis_id=kreis_info.kreis_id, date=kreis_info.date,
+                                                           number_of_new_cases=kreis_info.number_of_new_cases,
+                                                           link=kreis_info.link, is_already_entered=kreis_info.is_already_entered)
+        return Changeset(date, changes, snapshot_reloaded, polled_at)
+
+
+# Polls from START until the end of the last day, next_interval gets what update_data returned and the time of the poll
+def replay(kreise: List[SyntheticKreis], changes: List[Tuple[float, int]], days: int,
+           next_interval: Callable[[Optional[int], datetime], float], measured_from: int) -> ReplayResult:
+    sheet: ReplaySheet = ReplaySheet(kreise, changes)
+    fallzahlen_ingest: ReplayIngest = ReplayIngest()
+    polls: List[float] = []
+    now: float = 0.0
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        while now < days * 86400:
+            polls.append(now)
+            sheet.now = now
+            now += next_interval(start_bot.update_data(fallzahlen_ingest, sheet), START + timedelta(seconds=now))
+    polls.append(now)
+
+    staleness: List[float] = []
+    for change, _ in changes:
+        if measured_from * 86400 <= change < days * 86400:
+            staleness.append(polls[bisect.bisect_left(polls, change)] - change)
+    staleness.sort()
+    measured_polls: List[float] = [poll for poll in polls[:-1] if poll >= measured_from * 86400]
+    return ReplayResult(polls=len(measured_polls), mean_staleness=sum(staleness) / len(staleness),
+                        p95_staleness=help.get_percentile(staleness, 95), max_staleness=staleness[-1],
+                        night_polls=len([poll for poll in measured_polls if poll % 86400 < NIGHT_END_HOUR * 3600]))
+
+
+def print_result(name: str, result: ReplayResult):
+    print(f"{name}: {result.polls} polls, staleness mean {result.mean_staleness:.0f} s, "
+          f"p95 {result.p95_staleness:.0f} s, max {result.max_staleness:.0f} s, {result.night_polls} polls before {NIGHT_END_HOUR}h")
+
+
+if __name__ == "__main__":
+    DAYS: int = int(os.environ.get("BENCHMARK_DAYS", "14"))
+    WARMUP_DAYS: int = int(os.environ.get("BENCHMARK_WARMUP_DAYS", "7"))
+    kreise: List[SyntheticKreis] = read_kreise()
+    changes: List[Tuple[float, int]] = create_changes(kreise, WARMUP_DAYS + DAYS)
+
+    fixed: ReplayResult = replay(kreise, changes, WARMUP_DAYS + DAYS, lambda changed_rows, now: FIXED_SECONDS, WARMUP_DAYS)
+    schedule: AdaptivePollSchedule = AdaptivePollSchedule(max_seconds=MAX_SECONDS)
+    adaptive: ReplayResult = replay(kreise, changes, WARMUP_DAYS + DAYS, schedule.next_interval, WARMUP_DAYS)
+    cold_schedule: AdaptivePollSchedule = AdaptivePollSchedule(max_seconds=MAX_SECONDS)
+    cold: ReplayResult = replay(kreise, changes, DAYS, cold_schedule.next_interval, 0)
+    fixed_cold: ReplayResult = replay(kreise, changes, DAYS, lambda changed_rows, now: FIXED_SECONDS, 0)
+    print_result(f"fixed {FIXED_SECONDS:.0f} s", fixed)
+    print_result("adaptive", adaptive)
+    print_result(f"fixed {FIXED_SECONDS:.0f} s without warm up", fixed_cold)
+    print_result("adaptive without warm up", cold)
+
+    problems: List[str] = []
+    if adaptive.polls >= fixed.polls:
+        problems.append(f"the adaptive schedule polls {adaptive.polls} times, the fixed one {fixed.polls} times")
+    if adaptive.mean_staleness > fixed.mean_staleness:
+        problems.append(f"the mean staleness is {adaptive.mean_staleness:.0f} s instead of {fixed.mean_staleness:.0f} s")
+    if adaptive.p95_staleness > fixed.p95_staleness:
+        problems.append(f"the p95 staleness is {adaptive.p95_staleness:.0f} s instead of {fixed.p95_staleness:.0f} s")
+    # One poll at max_seconds per night, plus the one that crosses into the night
+    max_night_polls: int = DAYS * (int(NIGHT_END_HOUR * 3600 / MAX_SECONDS) + 1)
+    if adaptive.night_polls > max_night_polls:
+        problems.append(f"the adaptive schedule polls {adaptive.night_polls} times before {NIGHT_END_HOUR}h, at most {max_night_polls} expected")
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+    print(f"{1 - adaptive.polls / fixed.polls:.0%} fewer polls")
@@ -0,0 +1,150 @@
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional, Callable
+
+import psycopg2
+from psycopg2.sql import SQL
+
+import start_bot
+from benchmarks.dataset import SyntheticKreis, seed_database, create_sheet_response, get_queries, DEFAULT_REPORTING_CURVE
+from benchmarks.harness import Timing, measure, write_report, throwaway_database
+from data_modules.case_matrix import CaseMatrix
+from data_modules.database import PostgresDatabase, DbResult
+from data_modules.ingest import FallzahlenIngest
+from data_modules.intraday import log_changes
+from data_modules.risklayer import KreisInformation, RisklayerClient, RecordedSession, _preprocess_raw_data
+from data_modules.scheme import Kreis, Fallzahl
+
+# Times the hot paths of the bot against synthetic data in a throwaway database and writes p50/p95/p99 per path as
+# JSON, so two runs can be compared with benchmarks/compare.py.
+#   python -m benchmarks.suite
+# BENCHMARK_DATABASE_URL    server to create the throwaway database on (postgresql://...), otherwise a temporary cluster
+#                           is started with initdb and pg_ctl
+# BENCHMARK_RUNS            runs per path (50)
+# BENCHMARK_DAYS            days of data (28, like the retention of the bot)
+# BENCHMARK_REPORTING_CURVE share of reported Kreise per hour as JSON, for instance {"8": 0.1, "24": 1.0}
+# BENCHMARK_SEED            seed of the synthetic data (0)
+# BENCHMARK_OUTPUT          where the results are written (benchmark_results.json)
+
+LARGEST_BUNDESLAND: str = "Bayern"
+SMALLEST_BUNDESLAND: str = "Bremen"
+KREIS: str = "Dithmarschen"
+
+
+def benchmark_preprocessing(kreise: List[SyntheticKreis], today: datetime.date, runs: int, seed: int) -> Timing:
+    value_ranges: List[Dict] = json.loads(create_sheet_response(kreise, today, 15, seed))["valueRanges"]
+    kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw = [value_range.get("values", []) for value_range in value_ranges]
+    return measure("_preprocess_raw_data", lambda: _preprocess_raw_data(kreis_names_raw, new_cases_today_raw,
+                                                                        contributors_raw, links_raw), runs)
+
+
+def benchmark_mapping(postgres_db: PostgresDatabase, runs: int) -> List[Timing]:
+    result: DbResult = postgres_db.get(SQL("SELECT * FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id"))
+    return [
+        measure(f"DbResult.convert_rows_to KreisInformation ({len(result.rows)} rows)",
+                lambda: result.convert_rows_to(KreisInformation), runs),
+        measure(f"DbResult.convert_rows_to_records Fallzahl ({len(result.rows)} rows)",
+                lambda: result.convert_rows_to_records(Fallzahl), runs),
+        measure(f"DbResult.convert_to_two_types Kreis, Fallzahl ({len(result.rows)} rows)",
+                lambda: result.convert_to_two_types(Kreis, Fallzahl), runs),
+    ]
+
+
+def benchmark_queries(database_url: str, today: datetime.date, days: int, runs: int) -> List[Timing]:
+    # Every query runs in a transaction that is rolled back, so the writing queries do not change the data
+    timings: List[Timing] = []
+    connection = psycopg2.connect(database_url)
+    with connection.cursor() as cursor:
+        def run_query(query):
+            cursor.execute(query)
+            if cursor.description is not None:
+                cursor.fetchall()
+            connection.rollback()
+        for name, query in get_queries(today, days):
+            timings.append(measure(f"sql.{name}", lambda: run_query(query), runs))
+    connection.close()
+    return timings
+
+
+def benchmark_message_builders(postgres_db: PostgresDatabase, today: datetime.date, runs: int) -> List[Timing]:
+    case_matrix: CaseMatrix = CaseMatrix(postgres_db)
+
+    def rebuild():
+        with redirect_stdout(io.StringIO()):
+            case_matrix.rebuild(today)
+
+    timings: List[Timing] = [measure("CaseMatrix.rebuild", rebuild, runs)]
+    builders: Dict[str, Callable[[], str]] = {
+        "get_summarized_case_number": lambda: start_bot.get_summarized_case_number(case_matrix),
+        f"get_summarized_bundesland {LARGEST_BUNDESLAND}": lambda: start_bot.get_summarized_bundesland(case_matrix, LARGEST_BUNDESLAND),
+        f"get_summarized_bundesland {SMALLEST_BUNDESLAND}": lambda: start_bot.get_summarized_bundesland(case_matrix, SMALLEST_BUNDESLAND),
+        f"get_summarized_kreis {KREIS}": lambda: start_bot.get_summarized_kreis(case_matrix, KREIS),
+        "get_summarized_risikogebiete": lambda: start_bot.get_summarized_risikogebiete(case_matrix),
+    }
+    return timings + [measure(name, builder, runs) for name, builder in builders.items()]
+
+
+def benchmark_ingest(postgres_db: PostgresDatabase, kreise: List[SyntheticKreis], today: datetime.date, runs: int,
+                     seed: int) -> Timing:
+    # Alternates between the sheet at noon and in the evening, so every run writes the Kreise that reported in between
+    responses: List[bytes] = [create_sheet_response(kreise, today, 18, seed), create_sheet_response(kreise, today, 12, seed)]
+    response_file = tempfile.NamedTemporaryFile(suffix=".json", delete=False)
+    response_path: Path = Path(response_file.name)
+    response_file.close()
+    risklayer_client: RisklayerClient = RisklayerClient("benchmark", session=RecordedSession(response_path))
+    fallzahlen_ingest: FallzahlenIngest = FallzahlenIngest(postgres_db)
+    fallzahlen_ingest.add_writer(log_changes)
+    fallzahlen_ingest.load_snapshot(today)
+    polls: List[int] = [0]
+
+    def write_next_response():
+        response_path.write_bytes(responses[polls[0] % len(responses)])
+        polls[0] += 1
+
+    def update_data():
+        with redirect_stdout(io.StringIO()):
+            start_bot.update_data(fallzahlen_ingest, risklayer_client)
+
+    timing: Timing = measure("update_data ingest", update_data, runs, setup=write_next_response)
+    response_path.unlink()
+    return timing
+
+
+def run_suite(database_url: str, runs: int, days: int, seed: int, reporting_curve: Dict[float, float]) -> List[Timing]:
+    today: datetime.date = start_bot.get_today()
+    postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+    print(f"Seeding {days} days of synthetic data")
+    kreise: List[SyntheticKreis] = seed_database(postgres_db, database_url, today, days, seed=seed,
+                                                 reporting_curve=reporting_curve)
+    postgres_db.execute(SQL("ANALYZE"))
+
+    timings: List[Timing] = [benchmark_preprocessing(kreise, today, runs, seed)]
+    timings += benchmark_mapping(postgres_db, runs)
+    timings += benchmark_queries(database_url, today, days, runs)
+    timings += benchmark_message_builders(postgres_db, today, runs)
+    # The ingest changes the data of today, so it comes last
+    timings.append(benchmark_ingest(postgres_db, kreise, today, runs, seed))
+    postgres_db.close()
+    return timings
+
+
+if __name__ == "__main__":
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "50"))
+    DAYS: int = int(os.environ.get("BENCHMARK_DAYS", "28"))
+    SEED: int = int(os.environ.get("BENCHMARK_SEED", "0"))
+    REPORTING_CURVE_JSON: Optional[str] = os.environ.get("BENCHMARK_REPORTING_CURVE")
+    REPORTING_CURVE: Dict[float, float] = {float(hour): share for hour, share in json.loads(REPORTING_CURVE_JSON).items()} \
+        if REPORTING_CURVE_JSON else DEFAULT_REPORTING_CURVE
+    OUTPUT: Path = Path(os.environ.get("BENCHMARK_OUTPUT", "benchmark_results.json"))
+    if DAYS <= 7:
+        raise Exception("BENCHMARK_DAYS has to be at least 8, the messages compare today with one week ago")
+
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        timings: List[Timing] = run_suite(database_url, RUNS, DAYS, SEED, REPORTING_CURVE)
+    write_report(OUTPUT, timings, {"runs": RUNS, "days": DAYS, "seed": SEED, "reporting_curve": REPORTING_CURVE})
+    print(f"Results written to {OUTPUT}")
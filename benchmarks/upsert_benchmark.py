@@ -0,0 +1,94 @@
+import csv
+import os
+import random
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Dict, Any, Callable
+
+from psycopg2.extensions import cursor as Cursor
+from psycopg2.sql import SQL, Identifier, Literal, Composable
+
+from data_modules.database import PostgresDatabase
+from data_modules.partitions import FallzahlenPartitions, DAYS_AHEAD
+from data_modules.scheme import get_table_metadata
+
+# Compares the row-by-row upsert that was used before with the batched upsert of PostgresDatabase. Both write one
+# complete fallzahlen snapshot (401 Kreise), which is what update_data does every 10 minutes.
+# Only run this against a throwaway database: the tables get created and rows for BENCHMARK_DATE are written (into its
+# own partition, which is dropped again afterwards).
+
+BENCHMARK_DATE: date = date(2000, 1, 1)
+KREISE_CSV: Path = Path(__file__).parent.parent / "data" / "kreise_table.csv"
+
+
+class CountingCursor(Cursor):
+
+    statements: int = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.statements += 1
+        return super().execute(query, vars)
+
+
+def legacy_upsert(postgres_db: PostgresDatabase, table_name: str, data: List[Dict]):
+    primary_keys: List[str] = [result["attname"] for result in postgres_db.get(
+        SQL("SELECT a.attname FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = {table_name}::regclass AND i.indisprimary").format(table_name=Literal(table_name))).data]
+    column_names: List[Identifier] = [Identifier(key) for key in data[0].keys()]
+    remaining_columns: List[Identifier] = [column_name for column_name in column_names if not column_name.string in primary_keys]
+    with postgres_db._cursor() as cursor:
+        for entry in data:
+            as_literals: List[Literal] = [Literal(value) for value in entry.values()]
+            sql: Composable = SQL("INSERT INTO {table_name} ({fields}) VALUES ({as_literals}) ON CONFLICT ({primary_keys}) "
+                                  "DO UPDATE SET ({remaining_columns}) = ({remaining_values})") \
+                .format(table_name=Identifier(table_name), fields=SQL(",").join(column_names),
+                        as_literals=SQL(",").join(as_literals), primary_keys=SQL(",").join([Identifier(key) for key in primary_keys]),
+                        remaining_columns=SQL(",").join(remaining_columns),
+                        remaining_values=SQL("EXCLUDED.") + SQL(", EXCLUDED.").join(remaining_columns))
+            cursor.execute(sql)
+
+
+def create_snapshot() -> List[Dict[str, Any]]:
+    with KREISE_CSV.open(encoding="utf-8") as file:
+        kreis_ids: List[int] = [int(row[1]) for row in csv.reader(file)]
+    return [{"kreis_id": kreis_id, "date": BENCHMARK_DATE, "number_of_new_cases": random.randint(0, 200),
+             "link": f"https://example.org/{kreis_id}", "is_already_entered": random.random() < 0.5}
+            for kreis_id in kreis_ids]
+
+
+def prepare_database(database_url: str, postgres_db: PostgresDatabase):
+    postgres_db.initialize_tables(database_url, get_table_metadata())
+    with KREISE_CSV.open(encoding="utf-8") as file:
+        kreise: List[Dict] = [{"id": int(row[1]), "bundesland": row[0], "kreis": row[2], "population": int(row[3])}
+                              for row in csv.reader(file)]
+    postgres_db.upsert("kreise", kreise)
+    FallzahlenPartitions(postgres_db).create_ahead(BENCHMARK_DATE)
+
+
+def measure(name: str, postgres_db: PostgresDatabase, upsert: Callable[[List[Dict]], None], runs: int):
+    timings: List[float] = []
+    CountingCursor.statements = 0
+    for run in range(runs):
+        snapshot: List[Dict] = create_snapshot()
+        start: float = time.perf_counter()
+        upsert(snapshot)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name}: {CountingCursor.statements / runs:.0f} statements per ingest, "
+          f"median {timings[len(timings) // 2] * 1000:.1f} ms, best {timings[0] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    DATABASE_URL: str = os.environ["BENCHMARK_DATABASE_URL"]
+    RUNS: int = int(os.environ.get("BENCHMARK_RUNS", "20"))
+    postgres_db: PostgresDatabase = PostgresDatabase(DATABASE_URL, cursor_factory=CountingCursor)
+    prepare_database(DATABASE_URL, postgres_db)
+
+    measure("row by row", postgres_db, lambda data: legacy_upsert(postgres_db, "fallzahlen", data), RUNS)
+    for batch_size in [100, 1000]:
+        postgres_db._upsert_batch_size = batch_size
+        measure(f"batched ({batch_size} rows per statement)", postgres_db,
+                lambda data: postgres_db.upsert("fallzahlen", data), RUNS)
+
+    FallzahlenPartitions(postgres_db).drop_until(BENCHMARK_DATE + timedelta(days=DAYS_AHEAD))
@@ -0,0 +1,315 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.client import HTTPConnection
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import List, Dict, Tuple, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Updater, CallbackContext, MessageHandler, Filters
+
+import start_bot
+from benchmarks.dataset import seed_database
+from benchmarks.harness import throwaway_database
+from data_modules.archive import FallzahlenArchive, archive_completed_days
+from data_modules.cache import ResponseCache
+from data_modules.case_matrix import CaseMatrix
+from data_modules.database import PostgresDatabase
+from data_modules.rate_limit import ChatRateLimiter
+from data_modules.rendering import Risikogebiet
+from data_modules.routing import CommandRouter
+from data_modules.serving import WebhookServer, UpdatePoller, set_webhook, SHED, BUSY, BUSY_MESSAGE
+
+# Runs the webhook and the polling mode against a fake Bot API server on localhost, so nothing is sent to Telegram:
+#   1. commands posted to the webhook are answered by the real handlers (with a throwaway database)
+#   2. a flooding chat is throttled and identical commands at the same time are rendered once
+#   3. a full queue answers with 503 and Retry-After instead of accepting more updates
+#   4. a full queue while polling sheds the updates, or tells the chats that the bot is busy
+#   5. how long the webhook takes to accept a burst of updates
+#   python -m benchmarks.webhook_check
+# BENCHMARK_DATABASE_URL  server to create the throwaway database on, otherwise a temporary cluster is started
+# BENCHMARK_UPDATES       updates of the burst (1000)
+
+TOKEN: str = "123456:webhook-check"
+WEBHOOK_PATH: str = "webhook"
+
+
+class FakeBotApi:
+
+    def __init__(self):
+        self.calls: List[Tuple[str, Dict]] = []
+        self._pending_updates: List[Dict] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._server: ThreadingHTTPServer = ThreadingHTTPServer(("127.0.0.1", 0), self._create_request_handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/bot"
+
+    def get_calls(self, method: str) -> List[Dict]:
+        with self._lock:
+            return [parameters for called_method, parameters in self.calls if called_method == method]
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Returned by the next getUpdates
+    def add_updates(self, updates: List[Dict]):
+        with self._lock:
+            self._pending_updates += updates
+
+    def _answer(self, method: str, parameters: Dict) -> object:
+        with self._lock:
+            self.calls.append((method, parameters))
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Corona", "username": "CoronaBot"}
+        if method == "getMyCommands":
+            return []
+        if method == "getUpdates":
+            with self._lock:
+                updates, self._pending_updates = self._pending_updates, []
+            if not updates:
+                # Instead of the long poll
+                time.sleep(0.05)
+            return updates
+        if method == "sendMessage":
+            return {"message_id": len(self.calls), "date": int(time.time()), "text": parameters["text"],
+                    "chat": {"id": int(parameters["chat_id"]), "type": "private"}}
+        return True
+
+    def _create_request_handler(self):
+        fake_bot_api: FakeBotApi = self
+
+        class FakeBotApiRequestHandler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                method: str = self.path.rsplit("/", 1)[-1]
+                body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                parameters: Dict = json.loads(body) if body else {}
+                response: bytes = json.dumps({"ok": True, "result": fake_bot_api._answer(method, parameters)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return FakeBotApiRequestHandler
+
+
+def create_update(update_id: int, text: str, chat_id: Optional[int] = None) -> Dict:
+    chat_id = chat_id if chat_id is not None else 1000 + update_id
+    entities: List[Dict] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}] if text.startswith("/") else []
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": int(time.time()), "text": text,
+                                                "entities": entities, "chat": {"id": chat_id, "type": "private"},
+                                                "from": {"id": chat_id, "is_bot": False, "first_name": "User"}}}
+
+
+def post_update(port: int, update: Dict) -> Tuple[int, Dict[str, str]]:
+    connection: HTTPConnection = HTTPConnection("127.0.0.1", port)
+    connection.request("POST", f"/{WEBHOOK_PATH}", json.dumps(update), {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status, dict(response.getheaders())
+
+
+def check_handlers(database_url: str, fake_bot_api: FakeBotApi):
+    postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+    response_cache: ResponseCache = ResponseCache(16)
+    case_matrix: CaseMatrix = CaseMatrix(postgres_db)
+    case_matrix.rebuild(start_bot.get_today())
+    command_router: CommandRouter = CommandRouter(lambda update, context: start_bot.route_command(update, context, case_matrix, response_cache))
+    command_router.refresh(postgres_db)
+    archive_directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+    archive: FallzahlenArchive = FallzahlenArchive(Path(archive_directory.name))
+    archive_completed_days(postgres_db, archive, start_bot.get_today() - timedelta(days=1))
+    updater: Updater = Updater(bot=Bot(TOKEN, base_url=fake_bot_api.url), use_context=True)
+    start_bot.register_handlers(updater.dispatcher, postgres_db, response_cache, command_router, archive, case_matrix,
+                                ChatRateLimiter(0.5, 5))
+    set_webhook(updater.bot, "https://bot.example.org", WEBHOOK_PATH)
+
+    webhook_server: WebhookServer = WebhookServer(updater.dispatcher, "127.0.0.1", 0, WEBHOOK_PATH, queue_size=16, workers=4)
+    webhook_server.start()
+    port: int = webhook_server.server_address[1]
+    commands: List[str] = ["/update", "/Bayern", "/dithmarschen", "/risikogebiete", "/start", "no command",
+                           "/history Dithmarschen 2"]
+    statuses: List[int] = [post_update(port, create_update(i, command))[0] for i, command in enumerate(commands)]
+    webhook_server.stop()
+
+    if statuses != [200] * len(commands):
+        raise Exception(f"The webhook did not accept every update: {statuses}")
+    if fake_bot_api.get_calls("setWebhook")[0]["url"] != f"https://bot.example.org/{WEBHOOK_PATH}":
+        raise Exception("The webhook was not registered")
+    answers: Dict[int, str] = {int(parameters["chat_id"]) - 1000: parameters["text"] for parameters in fake_bot_api.get_calls("sendMessage")}
+    expected: Dict[int, str] = {0: start_bot.get_summarized_case_number(case_matrix),
+                                1: start_bot.get_summarized_bundesland(case_matrix, "Bayern"),
+                                2: start_bot.get_summarized_kreis(case_matrix, "Dithmarschen"),
+                                3: start_bot.get_summarized_risikogebiete(case_matrix),
+                                4: "You will now get a notification each day at 22h!",
+                                6: start_bot.get_summarized_history(archive, ["Dithmarschen", "2"])}
+    if answers != expected:
+        raise Exception(f"Unexpected answers for the updates {sorted(answers)}, expected {sorted(expected)}")
+    archive.close()
+    archive_directory.cleanup()
+    postgres_db.close()
+    print("Handlers: every command was answered like in polling mode")
+
+
+# Renders the Risikogebiete slowly, so the commands that arrive meanwhile have to wait for the same render
+class SlowCaseMatrix(CaseMatrix):
+
+    def __init__(self, postgres_db: PostgresDatabase):
+        super().__init__(postgres_db)
+        self.risikogebiete_calls: int = 0
+
+    def get_risikogebiete(self, today) -> List[Risikogebiet]:
+        self.risikogebiete_calls += 1
+        time.sleep(0.2)
+        return super().get_risikogebiete(today)
+
+
+def check_flood(database_url: str, fake_bot_api: FakeBotApi):
+    postgres_db: PostgresDatabase = PostgresDatabase(database_url)
+    response_cache: ResponseCache = ResponseCache(16)
+    case_matrix: SlowCaseMatrix = SlowCaseMatrix(postgres_db)
+    case_matrix.rebuild(start_bot.get_today())
+    command_router: CommandRouter = CommandRouter(lambda update, context: start_bot.route_command(update, context, case_matrix, response_cache))
+    command_router.refresh(postgres_db)
+    chat_rate_limiter: ChatRateLimiter = ChatRateLimiter(0.01, 5)
+    updater: Updater = Updater(bot=Bot(TOKEN, base_url=fake_bot_api.url), use_context=True)
+    start_bot.register_handlers(updater.dispatcher, postgres_db, response_cache, command_router, None, case_matrix,
+                                chat_rate_limiter)
+    webhook_server: WebhookServer = WebhookServer(updater.dispatcher, "127.0.0.1", 0, WEBHOOK_PATH, queue_size=64, workers=4)
+    webhook_server.start()
+    port: int = webhook_server.server_address[1]
+    # 20 commands of one chat, only the burst of 5 gets through
+    for update_id in range(100, 120):
+        post_update(port, create_update(update_id, "/dithmarschen", 5000))
+    # 12 chats that ask for the Risikogebiete at once, with 4 workers
+    for update_id in range(200, 212):
+        post_update(port, create_update(update_id, "/risikogebiete"))
+    webhook_server.stop()
+
+    answers: List[Dict] = fake_bot_api.get_calls("sendMessage")
+    flood_answers: int = len([parameters for parameters in answers if int(parameters["chat_id"]) == 5000])
+    risikogebiete_answers: List[str] = [parameters["text"] for parameters in answers if 1200 <= int(parameters["chat_id"]) < 1212]
+    if flood_answers != 5 or chat_rate_limiter.throttled != 15:
+        raise Exception(f"The flooding chat got {flood_answers} answers, {chat_rate_limiter.throttled} commands were throttled")
+    if len(risikogebiete_answers) != 12 or len(set(risikogebiete_answers)) != 1:
+        raise Exception(f"{len(risikogebiete_answers)} of 12 chats got the Risikogebiete, {len(set(risikogebiete_answers))} different answers")
+    if case_matrix.risikogebiete_calls != 1:
+        raise Exception(f"The Risikogebiete were rendered {case_matrix.risikogebiete_calls} times")
+    postgres_db.close()
+    print(f"Flood: 15 of 20 commands of one chat were throttled, 12 Risikogebiete were rendered once "
+          f"({response_cache.coalesced} coalesced, {response_cache.hits} cache hits)")
+
+
+def check_backpressure(fake_bot_api: FakeBotApi):
+    # One worker that blocks on the first update and a queue with room for two more
+    updater: Updater = Updater(bot=Bot(TOKEN, base_url=fake_bot_api.url), use_context=True)
+    handling: threading.Event = threading.Event()
+    release: threading.Event = threading.Event()
+
+    def block(update: Update, context: CallbackContext):
+        handling.set()
+        release.wait()
+
+    updater.dispatcher.add_handler(MessageHandler(Filters.all, block))
+    webhook_server: WebhookServer = WebhookServer(updater.dispatcher, "127.0.0.1", 0, WEBHOOK_PATH, queue_size=2, workers=1)
+    webhook_server.start()
+    port: int = webhook_server.server_address[1]
+    responses: List[Tuple[int, Dict[str, str]]] = [post_update(port, create_update(0, "first"))]
+    handling.wait(5)
+    responses += [post_update(port, create_update(i, "queued")) for i in range(1, 5)]
+    release.set()
+    webhook_server.stop()
+
+    statuses: List[int] = [status for status, headers in responses]
+    if statuses != [200, 200, 200, 503, 503] or "Retry-After" not in responses[-1][1]:
+        raise Exception(f"Unexpected answers while the queue was full: {statuses}")
+    print("Backpressure: a full queue is answered with 503 and Retry-After")
+
+
+def check_polling_overload(fake_bot_api: FakeBotApi, overload_policy: str, first_chat_id: int):
+    # Like check_backpressure: one worker that blocks on the first update and a queue with room for two more
+    updater: Updater = Updater(bot=Bot(TOKEN, base_url=fake_bot_api.url), use_context=True)
+    handling: threading.Event = threading.Event()
+    release: threading.Event = threading.Event()
+    handled: List[int] = []
+
+    def block(update: Update, context: CallbackContext):
+        handling.set()
+        release.wait()
+        handled.append(update.effective_chat.id)
+
+    updater.dispatcher.add_handler(MessageHandler(Filters.all, block))
+    update_poller: UpdatePoller = UpdatePoller(updater.dispatcher, queue_size=2, workers=1, overload_policy=overload_policy)
+    update_poller.start()
+    fake_bot_api.add_updates([create_update(0, "/update", first_chat_id)])
+    handling.wait(5)
+    calls: int = len(fake_bot_api.get_calls("getUpdates"))
+    fake_bot_api.add_updates([create_update(i, "/update", first_chat_id + i) for i in range(1, 6)])
+    # After two more getUpdates, the five updates were fetched and queued or rejected
+    while len(fake_bot_api.get_calls("getUpdates")) < calls + 2:
+        time.sleep(0.01)
+    release.set()
+    update_poller.stop()
+
+    busy_chats: List[int] = [int(parameters["chat_id"]) for parameters in fake_bot_api.get_calls("sendMessage")
+                             if parameters["text"] == BUSY_MESSAGE and first_chat_id <= int(parameters["chat_id"]) < first_chat_id + 6]
+    expected_busy_chats: List[int] = [first_chat_id + i for i in range(3, 6)] if overload_policy == BUSY else []
+    if sorted(handled) != [first_chat_id + i for i in range(3)] or sorted(busy_chats) != expected_busy_chats:
+        raise Exception(f"Unexpected handling while the queue was full ({overload_policy}): handled {handled}, busy {busy_chats}")
+    print(f"Polling overload ({overload_policy}): 3 updates were handled, 3 were "
+          f"{'answered with busy' if overload_policy == BUSY else 'shed'}")
+
+
+def measure_burst(fake_bot_api: FakeBotApi, updates: int):
+    updater: Updater = Updater(bot=Bot(TOKEN, base_url=fake_bot_api.url), use_context=True)
+    handled: List[int] = []
+    updater.dispatcher.add_handler(MessageHandler(Filters.all, lambda update, context: handled.append(update.update_id)))
+    webhook_server: WebhookServer = WebhookServer(updater.dispatcher, "127.0.0.1", 0, WEBHOOK_PATH, queue_size=updates, workers=4)
+    webhook_server.start()
+    port: int = webhook_server.server_address[1]
+    latencies: List[float] = []
+
+    def post(first_update_id: int):
+        for update_id in range(first_update_id, updates, 8):
+            start: float = time.perf_counter()
+            post_update(port, create_update(update_id, "burst"))
+            latencies.append(time.perf_counter() - start)
+
+    start: float = time.perf_counter()
+    senders: List[threading.Thread] = [threading.Thread(target=post, args=(i,)) for i in range(8)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    webhook_server.stop()
+    duration: float = time.perf_counter() - start
+    latencies.sort()
+    print(f"Burst: {len(handled)} of {updates} updates handled in {duration:.2f}s, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms to accept")
+
+
+if __name__ == "__main__":
+    UPDATES: int = int(os.environ.get("BENCHMARK_UPDATES", "1000"))
+    fake_bot_api: FakeBotApi = FakeBotApi()
+    with throwaway_database(os.environ.get("BENCHMARK_DATABASE_URL")) as database_url:
+        seed_database(PostgresDatabase(database_url), database_url, start_bot.get_today(), 9)
+        check_handlers(database_url, fake_bot_api)
+        check_flood(database_url, fake_bot_api)
+    check_backpressure(fake_bot_api)
+    check_polling_overload(fake_bot_api, SHED, 7000)
+    check_polling_overload(fake_bot_api, BUSY, 8000)
+    measure_burst(fake_bot_api, UPDATES)
+    fake_bot_api.stop()
@@ -0,0 +1,228 @@
+import json
+import mmap
+import os
+import sys
+import threading
+from array import array
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+
+# Long-term history of the daily new cases, outside of Postgres (which only keeps the last 28 days). The retention job
+# archives every completed day before it drops the expired partitions. The archive is a directory with two files:
+#   fallzahlen.bin  one row per day since first_date, every row has one int32 (little endian) per Kreis id
+#   index.json      first_date, the number of days and columns, and the Kreise (so queries need no database)
+# The matrix is memory-mapped, a Kreis series only reads its column of the requested days and a Bundesland series the
+# rows of the requested days. Kreise without a number on a day (or days without any data) hold MISSING.
+
+MATRIX_FILE: str = "fallzahlen.bin"
+INDEX_FILE: str = "index.json"
+KREIS_COLUMNS: int = 401
+VALUE_SIZE: int = 4
+MISSING: int = -2 ** 31
+DATE_FORMAT: str = "%Y-%m-%d"
+
+
+@dataclass
+class ArchivedKreis:
+    id: int
+    kreis: str
+    bundesland: str
+    population: int
+
+
+@dataclass
+class ArchivedFallzahl:
+    kreis_id: int
+    date: datetime.date
+    number_of_new_cases: int
+
+
+class FallzahlenArchive:
+
+    def __init__(self, directory: Path, columns: int = KREIS_COLUMNS):
+        self._directory: Path = directory
+        self._columns: int = columns
+        self._first_date: Optional[datetime.date] = None
+        self._days: int = 0
+        self._kreise: List[ArchivedKreis] = []
+        self._mmap: Optional[mmap.mmap] = None
+        self._is_loaded: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def first_date(self) -> Optional[datetime.date]:
+        with self._lock:
+            self._load()
+            return self._first_date
+
+    @property
+    def last_date(self) -> Optional[datetime.date]:
+        with self._lock:
+            self._load()
+            return self._get_last_date()
+
+    @property
+    def kreise(self) -> List[ArchivedKreis]:
+        with self._lock:
+            self._load()
+            return list(self._kreise)
+
+    # Writes the days (new cases by Kreis id) after the last archived day, days that are already archived are skipped.
+    # The rows are written before the index, so an interrupted write is overwritten by the next one.
+    def append(self, days: Dict[datetime.date, Dict[int, int]], kreise: List[ArchivedKreis]):
+        with self._lock:
+            self._load()
+            last_date: Optional[datetime.date] = self._get_last_date()
+            new_dates: List[datetime.date] = sorted([date for date in days if last_date is None or date > last_date])
+            if not new_dates:
+                return
+            first_date: datetime.date = self._first_date if self._first_date is not None else new_dates[0]
+            start: int = self._days
+            end: int = (new_dates[-1] - first_date).days + 1
+
+            # Build Rows (days in between without data stay MISSING)
+            matrix: array = array("i", [MISSING]) * ((end - start) * self._columns)
+            for date in new_dates:
+                row_start: int = ((date - first_date).days - start) * self._columns
+                for kreis_id, number_of_new_cases in days[date].items():
+                    if not 0 <= kreis_id < self._columns:
+                        raise Exception(f"Kreis id {kreis_id} does not fit into the {self._columns} archive columns")
+                    matrix[row_start + kreis_id] = number_of_new_cases
+            if sys.byteorder != "little":
+                matrix.byteswap()
+
+            # Write Rows, Then Index
+            self._directory.mkdir(parents=True, exist_ok=True)
+            matrix_path: Path = self._directory / MATRIX_FILE
+            with matrix_path.open("r+b" if matrix_path.exists() else "wb") as file:
+                file.seek(start * self._columns * VALUE_SIZE)
+                file.write(matrix.tobytes())
+                file.truncate()
+                file.flush()
+                os.fsync(file.fileno())
+            self._write_index(first_date, end, kreise)
+            self._first_date, self._days, self._kreise = first_date, end, list(kreise)
+            self._remap()
+        print(f"Archived {len(new_dates)} days of fallzahlen until {new_dates[-1]}")
+
+    # New cases of the Kreis per day between first_day and last_day, as far as they are archived
+    def get_kreis_series(self, kreis_id: int, first_day: datetime.date,
+                         last_day: datetime.date) -> List[Tuple[datetime.date, Optional[int]]]:
+        with self._lock:
+            self._load()
+            start, end = self._get_row_range(first_day, last_day)
+            if start >= end or not 0 <= kreis_id < self._columns:
+                return []
+            view: memoryview = memoryview(self._mmap).cast("i")
+            try:
+                column: array = array("i", view[start * self._columns + kreis_id:end * self._columns:self._columns].tobytes())
+            finally:
+                view.release()
+            return self._to_series(start, self._swap(column).tolist())
+
+    # New cases of all Kreise of the Bundesland per day between first_day and last_day, as far as they are archived
+    def get_bundesland_series(self, bundesland: str, first_day: datetime.date,
+                              last_day: datetime.date) -> List[Tuple[datetime.date, Optional[int]]]:
+        with self._lock:
+            self._load()
+            start, end = self._get_row_range(first_day, last_day)
+            kreis_ids: List[int] = [kreis.id for kreis in self._kreise if kreis.bundesland == bundesland]
+            if start >= end or not kreis_ids:
+                return []
+            view: memoryview = memoryview(self._mmap).cast("i")
+            try:
+                rows: array = array("i", view[start * self._columns:end * self._columns].tobytes())
+            finally:
+                view.release()
+            values: List[int] = self._swap(rows).tolist()
+            sums: List[Optional[int]] = []
+            for row in range(end - start):
+                known: List[int] = [values[row * self._columns + kreis_id] for kreis_id in kreis_ids
+                                    if values[row * self._columns + kreis_id] != MISSING]
+                sums.append(sum(known) if known else None)
+            return self._to_series(start, sums)
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            self._is_loaded = False
+
+    def _load(self):
+        if self._is_loaded:
+            return
+        index_path: Path = self._directory / INDEX_FILE
+        if index_path.exists():
+            index: Dict = json.loads(index_path.read_text(encoding="utf-8"))
+            if index["columns"] != self._columns:
+                raise Exception(f"The archive in {self._directory} has {index['columns']} columns, not {self._columns}")
+            self._first_date = datetime.strptime(index["first_date"], DATE_FORMAT).date()
+            self._days = index["days"]
+            self._kreise = [ArchivedKreis(**kreis) for kreis in index["kreise"]]
+            self._remap()
+        self._is_loaded = True
+
+    def _write_index(self, first_date: datetime.date, days: int, kreise: List[ArchivedKreis]):
+        index: Dict = {"first_date": first_date.strftime(DATE_FORMAT), "days": days, "columns": self._columns,
+                       "kreise": [asdict(kreis) for kreis in kreise]}
+        temporary_path: Path = self._directory / f"{INDEX_FILE}.tmp"
+        temporary_path.write_text(json.dumps(index), encoding="utf-8")
+        os.replace(temporary_path, self._directory / INDEX_FILE)
+
+    def _remap(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._days == 0:
+            return
+        with (self._directory / MATRIX_FILE).open("rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), self._days * self._columns * VALUE_SIZE, access=mmap.ACCESS_READ)
+
+    def _get_last_date(self) -> Optional[datetime.date]:
+        if self._first_date is None:
+            return None
+        return self._first_date + timedelta(days=self._days - 1)
+
+    def _get_row_range(self, first_day: datetime.date, last_day: datetime.date) -> Tuple[int, int]:
+        if self._first_date is None:
+            return 0, 0
+        start: int = max(0, (first_day - self._first_date).days)
+        end: int = min(self._days, (last_day - self._first_date).days + 1)
+        return start, end
+
+    def _to_series(self, start: int, values: List[Optional[int]]) -> List[Tuple[datetime.date, Optional[int]]]:
+        return [(self._first_date + timedelta(days=start + day), None if value is None or value == MISSING else value)
+                for day, value in enumerate(values)]
+
+    @staticmethod
+    def _swap(values: array) -> array:
+        if sys.byteorder != "little":
+            values.byteswap()
+        return values
+
+
+# Archives the days after the last archived day until (and including) until, which has to be a completed day
+def archive_completed_days(postgres_db: PostgresDatabase, archive: FallzahlenArchive, until: datetime.date):
+    last_date: Optional[datetime.date] = archive.last_date
+    if last_date is not None and last_date >= until:
+        return
+    # Get Data
+    first_day: Optional[datetime.date] = last_date + timedelta(days=1) if last_date is not None else None
+    fallzahlen: List[ArchivedFallzahl] = postgres_db\
+        .get(sql.get_fallzahlen_between(first_day, until), "get_fallzahlen_between")\
+        .convert_rows_to(ArchivedFallzahl)
+    kreise: List[ArchivedKreis] = postgres_db.get(sql.get_all_kreise(), "get_all_kreise").convert_rows_to(ArchivedKreis)
+
+    # Group By Day, every day until until is written (without data, if the bot was not running that day)
+    days: Dict[datetime.date, Dict[int, int]] = {}
+    for fallzahl in fallzahlen:
+        days.setdefault(fallzahl.date, {})[fallzahl.kreis_id] = fallzahl.number_of_new_cases or 0
+    if days or last_date is not None:
+        days.setdefault(until, {})
+    archive.append(days, kreise)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from typing import List, Dict, Optional, Tuple, Any
+
+import aiohttp
+import aiopg
+from psycopg2.sql import Composable, Composed, SQL, Literal
+
+from data_modules import metrics
+from data_modules.database import DbResult, UNNAMED_QUERY, create_upsert_statement, get_primary_keys_query
+from data_modules.risklayer import BaseRisklayerClient, KreisInformation, PubhtmlParser, SHEETS_API_URL, PUBHTML_URL, \
+    PUBHTML_CHUNK_SIZE, RISKLAYER_SPREADSHEET_ID, get_batch_parameters, _preprocess_raw_data
+
+# The clients of the asyncio runtime (see async_bot.py). aiohttp and aiopg are only needed when that runtime is used.
+
+
+class AsyncPostgresDatabase:
+
+    def __init__(self, pool: aiopg.Pool):
+        self._pool: aiopg.Pool = pool
+        self._primary_keys: Dict[str, List[str]] = {}
+
+    @classmethod
+    async def connect(cls, database_url: str, pool_size: int = 10) -> "AsyncPostgresDatabase":
+        pool: aiopg.Pool = await aiopg.create_pool(database_url, minsize=1, maxsize=pool_size)
+        return cls(pool)
+
+    async def get(self, sql: Composable, query_name: str = UNNAMED_QUERY) -> DbResult:
+        with metrics.track("db_query", operation="get", query=query_name) as tracker:
+            async with self._pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql)
+                    results_raw: List[Tuple] = await cursor.fetchall()
+                    column_names: List[str] = [desc[0] for desc in cursor.description]
+            tracker.rows = len(results_raw)
+        return DbResult(column_names, results_raw)
+
+    async def execute(self, sql: Composable, query_name: str = UNNAMED_QUERY):
+        # aiopg connections are in autocommit mode, statements that belong together have to be in one Composed
+        with metrics.track("db_query", operation="execute", query=query_name) as tracker:
+            async with self._pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(sql)
+                    tracker.rows = max(cursor.rowcount, 0)
+
+    async def upsert(self, table_name: str, data: List[Dict], query_name: Optional[str] = None):
+        if not data:
+            return
+        primary_keys: List[str] = await self._get_primary_keys(table_name)
+        keys: List[str] = list(data[0].keys())
+        rows_by_primary_key: Dict[Tuple, List[Any]] = {tuple(entry[key] for key in primary_keys): [entry[key] for key in keys]
+                                                       for entry in data}
+        # execute_values needs a blocking cursor, so the rows are composed into the statement as literals
+        values: Composed = SQL(", ").join([SQL("({row})").format(row=SQL(", ").join([Literal(value) for value in row]))
+                                           for row in rows_by_primary_key.values()])
+        statement: Composed = create_upsert_statement(table_name, keys, primary_keys, values)
+        with metrics.track("db_query", operation="upsert", query=query_name or table_name) as tracker:
+            async with self._pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(statement)
+            tracker.rows = len(rows_by_primary_key)
+
+    async def close(self):
+        self._pool.close()
+        await self._pool.wait_closed()
+
+    async def _get_primary_keys(self, table_name: str) -> List[str]:
+        if table_name not in self._primary_keys:
+            results: List[Dict] = (await self.get(get_primary_keys_query(table_name))).data
+            self._primary_keys[table_name] = [result["attname"] for result in results]
+        return self._primary_keys[table_name]
+
+
+class AsyncRisklayerClient(BaseRisklayerClient):
+
+    def __init__(self, api_key: str, session: aiohttp.ClientSession, connect_timeout: float = 5, read_timeout: float = 30,
+                 retries: int = 3, backoff_factor: float = 1, api_url: str = SHEETS_API_URL, pubhtml_url: str = PUBHTML_URL):
+        super().__init__(api_key, api_url=api_url, pubhtml_url=pubhtml_url)
+        self._async_session: aiohttp.ClientSession = session
+        self._client_timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self._retries: int = retries
+        self._backoff_factor: float = backoff_factor
+
+    async def get_new_data_async(self) -> Optional[List[KreisInformation]]:
+        with metrics.track("risklayer_fetch") as tracker:
+            try:
+                raw_data = await self._get_from_API_async()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError):
+                logging.exception("Sheets API failed, using the published sheet:")
+                metrics.increment("risklayer_fallbacks_total")
+                raw_data = await self._get_from_pubhtml_async()
+            if raw_data is None:
+                return None
+            kreis_infos: List[KreisInformation] = _preprocess_raw_data(*raw_data)
+            tracker.rows = len(kreis_infos)
+        return kreis_infos
+
+    async def _get_from_API_async(self):
+        start: float = time.perf_counter()
+        for attempt in range(self._retries + 1):
+            try:
+                async with self._async_session.get(f"{self._api_url}/{RISKLAYER_SPREADSHEET_ID}/values:batchGet",
+                                                   params=get_batch_parameters(self._api_key),
+                                                   timeout=self._client_timeout) as response:
+                    # Same retries as the urllib3 Retry of the blocking client
+                    if response.status in [429, 500, 502, 503, 504] and attempt < self._retries:
+                        await asyncio.sleep(self._backoff_factor * 2 ** attempt)
+                        continue
+                    response.raise_for_status()
+                    content: bytes = await response.read()
+                    return self._handle_response(content, response.content_length or len(content), start)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self._retries:
+                    raise
+                await asyncio.sleep(self._backoff_factor * 2 ** attempt)
+
+    async def _get_from_pubhtml_async(self):
+        parser: PubhtmlParser = PubhtmlParser()
+        async with self._async_session.get(self._pubhtml_url, timeout=self._client_timeout) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(PUBHTML_CHUNK_SIZE):
+                parser.feed_chunk(chunk)
+        return parser.finish()
+
+
+class TelegramApiError(Exception):
+
+    def __init__(self, method: str, error_code: int, description: str, retry_after: Optional[float] = None):
+        super().__init__(f"{method} failed with {error_code}: {description}")
+        self.error_code: int = error_code
+        self.description: str = description
+        self.retry_after: Optional[float] = retry_after
+
+
+# The few methods of the Bot API the asyncio runtime needs
+class AsyncTelegramClient:
+
+    def __init__(self, token: str, session: aiohttp.ClientSession, api_url: str = "https://api.telegram.org"):
+        self._url: str = f"{api_url}/bot{token}"
+        self._session: aiohttp.ClientSession = session
+
+    async def get_me(self) -> Dict:
+        return await self._call("getMe", {})
+
+    async def get_updates(self, offset: Optional[int], timeout: int) -> List[Dict]:
+        parameters: Dict[str, Any] = {"timeout": timeout, "allowed_updates": ["message"]}
+        if offset is not None:
+            parameters["offset"] = offset
+        return await self._call("getUpdates", parameters, aiohttp.ClientTimeout(total=timeout + 10))
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: Optional[str] = None,
+                           reply_to_message_id: Optional[int] = None) -> Dict:
+        parameters: Dict[str, Any] = {"chat_id": chat_id, "text": text}
+        if parse_mode is not None:
+            parameters["parse_mode"] = parse_mode
+        if reply_to_message_id is not None:
+            parameters["reply_to_message_id"] = reply_to_message_id
+        return await self._call("sendMessage", parameters)
+
+    async def _call(self, method: str, parameters: Dict[str, Any],
+                    timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(total=30)) -> Any:
+        async with self._session.post(f"{self._url}/{method}", json=parameters, timeout=timeout) as response:
+            try:
+                result: Dict = await response.json(content_type=None)
+            except ValueError:
+                # A proxy in front of the Bot API answers with an HTML page (e.g. 502), which is retried like a 5xx
+                raise TelegramApiError(method, response.status, f"no JSON in the response ({response.content_type})")
+        if not result.get("ok"):
+            retry_after: Optional[float] = result.get("parameters", {}).get("retry_after")
+            raise TelegramApiError(method, result.get("error_code", response.status), result.get("description", ""),
+                                   retry_after)
+        return result["result"]
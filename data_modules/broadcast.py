@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Dict, Callable, Optional
+
+from telegram import Bot
+from telegram.error import RetryAfter, BadRequest, NetworkError, TelegramError
+
+import data_modules.helper_functions as help
+from data_modules import sql, metrics
+from data_modules.database import PostgresDatabase
+from data_modules.rate_limit import TokenBucket
+
+# Telegram allows roughly 30 messages per second in total and one message per second per chat
+GLOBAL_MESSAGES_PER_SECOND: float = 30
+MESSAGES_PER_SECOND_PER_CHAT: float = 1
+
+
+@dataclass
+class BroadcastReport:
+    delivered: int
+    failed: int
+    duration_seconds: float
+    messages_per_second: float
+    latency_p50: float
+    latency_p95: float
+    latency_p99: float
+
+
+# Sends one message to every active subscriber. The message is rendered once per broadcast, the subscribers are read
+# when the broadcast starts (so chats that used /start after the bot booted are included) and the messages are sent by
+# a small thread pool that respects the rate limits of Telegram.
+
+class NotificationBroadcaster:
+
+    def __init__(self, bot: Bot, postgres_db: PostgresDatabase, workers: int = 8, max_attempts: int = 5):
+        self._bot: Bot = bot
+        self._postgres_db: PostgresDatabase = postgres_db
+        self._workers: int = workers
+        self._max_attempts: int = max_attempts
+        self._global_bucket: TokenBucket = TokenBucket(GLOBAL_MESSAGES_PER_SECOND, 1)
+        self._lock: threading.Lock = threading.Lock()
+
+    def broadcast(self, render_message: Callable[[], str]) -> BroadcastReport:
+        chat_ids: List[int] = self._postgres_db.get(sql.get_active_chat_ids(), "get_active_chat_ids").convert_to_primitive_type(int)
+        message_markdown: str = render_message()
+
+        # The buckets of the chats only live as long as the broadcast, a chat gets one message per broadcast (and its retries)
+        chat_buckets: Dict[int, TokenBucket] = {}
+        start: float = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            latencies: List[Optional[float]] = list(executor.map(lambda chat_id: self._send(chat_id, message_markdown, chat_buckets),
+                                                                 chat_ids))
+        duration: float = time.perf_counter() - start
+        metrics.observe("notification_broadcast_seconds", duration)
+
+        return create_report(latencies, duration)
+
+    # Returns how long the delivery took, or None if the message could not be delivered
+    def _send(self, chat_id: int, message_markdown: str, chat_buckets: Dict[int, TokenBucket]) -> Optional[float]:
+        start: float = time.perf_counter()
+        for attempt in range(self._max_attempts):
+            self._global_bucket.acquire()
+            self._get_chat_bucket(chat_buckets, chat_id).acquire()
+            try:
+                with metrics.track("notification_send"):
+                    self._bot.send_message(chat_id=chat_id, text=message_markdown, parse_mode="MarkdownV2")
+                latency: float = time.perf_counter() - start
+                metrics.observe("notification_delivery_seconds", latency)
+                return latency
+            except RetryAfter as error:
+                metrics.increment("notification_retries_total", reason="retry_after")
+                time.sleep(error.retry_after)
+            except BadRequest:
+                logging.exception(f"Could not notify chat {chat_id}:")
+                metrics.increment("notification_failures_total", reason="bad_request")
+                return None
+            # Timeouts and connection problems (BadRequest is a NetworkError as well, but retrying it does not help)
+            except NetworkError:
+                metrics.increment("notification_retries_total", reason="network")
+                time.sleep(2 ** attempt)
+            except TelegramError:
+                logging.exception(f"Could not notify chat {chat_id}:")
+                metrics.increment("notification_failures_total", reason="telegram")
+                return None
+        logging.error(f"Giving up on notifying chat {chat_id} after {self._max_attempts} attempts")
+        metrics.increment("notification_failures_total", reason="attempts_exhausted")
+        return None
+
+    def _get_chat_bucket(self, chat_buckets: Dict[int, TokenBucket], chat_id: int) -> TokenBucket:
+        with self._lock:
+            if chat_id not in chat_buckets:
+                chat_buckets[chat_id] = TokenBucket(MESSAGES_PER_SECOND_PER_CHAT, 1)
+            return chat_buckets[chat_id]
+
+
+def create_report(latencies: List[Optional[float]], duration: float) -> BroadcastReport:
+    delivered: List[float] = sorted([latency for latency in latencies if latency is not None])
+    report: BroadcastReport = BroadcastReport(delivered=len(delivered), failed=len(latencies) - len(delivered),
+                                              duration_seconds=duration,
+                                              messages_per_second=len(delivered) / duration if duration > 0 else 0.0,
+                                              latency_p50=help.get_percentile(delivered, 50),
+                                              latency_p95=help.get_percentile(delivered, 95),
+                                              latency_p99=help.get_percentile(delivered, 99))
+    print(f"Broadcast finished: {report.delivered} delivered, {report.failed} failed in {report.duration_seconds:.1f} s "
+          f"({report.messages_per_second:.1f} msg/s), latency p50={report.latency_p50:.2f} s "
+          f"p95={report.latency_p95:.2f} s p99={report.latency_p99:.2f} s")
+    return report
@@ -0,0 +1,110 @@
+import threading
+from collections import OrderedDict
+from typing import Tuple, Callable, Hashable, Optional, Dict
+
+from data_modules import metrics
+
+
+# Runs a computation only once for all the callers that ask for the same key while it is in flight. The callers that
+# came later wait for it and get the same result (or the same exception).
+
+class _Flight:
+
+    def __init__(self):
+        self.done: threading.Event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock: threading.Lock = threading.Lock()
+        self.coalesced: int = 0
+
+    def run(self, key: Hashable, compute: Callable[[], str], kind: str = "") -> str:
+        with self._lock:
+            flight: Optional[_Flight] = self._flights.get(key)
+            is_leader: bool = flight is None
+            if is_leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+        if not is_leader:
+            metrics.increment("commands_coalesced_total", kind=kind)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = compute()
+            return flight.result
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+# Keeps rendered bot messages until the data behind them changes. Every ingest that writes something bumps the version,
+# which drops all entries at once. Entries are evicted in LRU order when the cache is full. Misses of the same entry at
+# the same time are rendered once.
+
+class ResponseCache:
+
+    def __init__(self, max_size: int = 1024):
+        self._max_size: int = max_size
+        self._entries: "OrderedDict[Tuple[int, Hashable], str]" = OrderedDict()
+        self._version: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._renders: SingleFlight = SingleFlight()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> str:
+        versioned_key, cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        # Rendering runs outside the lock, so one slow query does not block the other commands
+        return self._renders.run(versioned_key, lambda: self._render_and_store(versioned_key, render),
+                                 key[0] if isinstance(key, tuple) else "")
+
+    @property
+    def coalesced(self) -> int:
+        return self._renders.coalesced
+
+    def _render_and_store(self, versioned_key: Tuple[int, Hashable], render: Callable[[], str]) -> str:
+        rendered: str = render()
+        self._store(versioned_key, rendered)
+        return rendered
+
+    def _lookup(self, key: Hashable) -> Tuple[Tuple[int, Hashable], Optional[str]]:
+        with self._lock:
+            versioned_key: Tuple[int, Hashable] = (self._version, key)
+            if versioned_key in self._entries:
+                self._entries.move_to_end(versioned_key)
+                self.hits += 1
+                return versioned_key, self._entries[versioned_key]
+            self.misses += 1
+            return versioned_key, None
+
+    def _store(self, versioned_key: Tuple[int, Hashable], rendered: str):
+        with self._lock:
+            # If an ingest happened in the meantime, the message might be based on outdated data and is not stored
+            if versioned_key[0] == self._version:
+                self._entries[versioned_key] = rendered
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
@@ -0,0 +1,222 @@
+import threading
+from datetime import timedelta, datetime
+from typing import List, Dict, Optional
+
+import numpy as np
+
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import Changeset
+from data_modules.intraday import BUCKETS_PER_DAY, get_prognosis
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet
+from data_modules.scheme import Kreis, Fallzahl, FallzahlenKurve
+
+# The last 28 days of fallzahlen (everything the database keeps) and the Kreise, in memory, so the read commands need
+# no database round trip. One row per day and one column per Kreis id:
+#   cases    new cases (0 where there is no row)
+#   present  whether fallzahlen has a row for the day and Kreis
+#   entered  is_already_entered
+#   links    the link of the row
+# plus the population and Bundesland of every column, and the reporting curves of the completed days (see
+# data_modules/intraday.py). The matrix is rebuilt from the database on boot and when the ingest reloads its snapshot (on
+# a new day and after a restart), in between it subscribes to the changesets of FallzahlenIngest and updates the changed cells.
+# The queries return the same rows as the queries in sql.py they replace, benchmarks/check_case_matrix.py compares them.
+
+WINDOW_DAYS: int = 28
+DAYS_BACK: int = 7
+RISIKOGEBIET_INCIDENCE: int = 50
+
+
+class CaseMatrix:
+
+    def __init__(self, postgres_db: PostgresDatabase):
+        self._postgres_db: PostgresDatabase = postgres_db
+        self._end_date: Optional[datetime.date] = None
+        self._columns: int = 0
+        self._cases: np.ndarray = np.zeros((WINDOW_DAYS, 0), dtype=np.int64)
+        self._present: np.ndarray = np.zeros((WINDOW_DAYS, 0), dtype=bool)
+        self._entered: np.ndarray = np.zeros((WINDOW_DAYS, 0), dtype=bool)
+        self._links: np.ndarray = np.empty((WINDOW_DAYS, 0), dtype=object)
+        self._curves: np.ndarray = np.zeros((WINDOW_DAYS, BUCKETS_PER_DAY), dtype=np.int64)
+        self._has_curve: np.ndarray = np.zeros(WINDOW_DAYS, dtype=bool)
+        self._population: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._names: List[str] = []
+        # Position of the Kreis in ORDER BY bundesland, kreis (of the database), for ties and the Kreise of a Bundesland
+        self._name_rank: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._bundeslaender: List[str] = []
+        self._bundesland_ids: np.ndarray = np.zeros(0, dtype=np.int64)
+        self._bundesland_ids_by_name: Dict[str, int] = {}
+        self._kreis_ids_by_bundesland: List[np.ndarray] = []
+        self._kreis_ids_by_name: Dict[str, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def end_date(self) -> Optional[datetime.date]:
+        return self._end_date
+
+    # Loads the window of days that ends with end_date. The arrays are built outside the lock and swapped in at once.
+    def rebuild(self, end_date: datetime.date):
+        kreise: List[Kreis] = self._postgres_db.get(sql.get_kreise_in_name_order(), "get_kreise_in_name_order")\
+            .convert_rows_to_records(Kreis)
+        fallzahlen: List[Fallzahl] = self._postgres_db\
+            .get(sql.get_fallzahlen_between(end_date - timedelta(days=WINDOW_DAYS - 1), end_date), "get_fallzahlen_between")\
+            .convert_rows_to_records(Fallzahl)
+        kurven: List[FallzahlenKurve] = self._postgres_db\
+            .get(sql.get_fallzahlen_kurven_between(end_date - timedelta(days=WINDOW_DAYS - 1), end_date), "get_fallzahlen_kurven_between")\
+            .convert_rows_to_records(FallzahlenKurve)
+
+        # Kreise
+        columns: int = max([kreis.id for kreis in kreise] + [fallzahl.kreis_id for fallzahl in fallzahlen] + [-1]) + 1
+        population: np.ndarray = np.zeros(columns, dtype=np.int64)
+        names: List[str] = [""] * columns
+        name_rank: np.ndarray = np.full(columns, len(kreise), dtype=np.int64)
+        bundeslaender: List[str] = []
+        bundesland_ids: np.ndarray = np.full(columns, -1, dtype=np.int64)
+        kreis_ids_by_name: Dict[str, int] = {}
+        for rank, kreis in enumerate(kreise):
+            if not bundeslaender or bundeslaender[-1] != kreis.bundesland:
+                bundeslaender.append(kreis.bundesland)
+            population[kreis.id] = kreis.population or 0
+            names[kreis.id] = kreis.kreis
+            name_rank[kreis.id] = rank
+            bundesland_ids[kreis.id] = len(bundeslaender) - 1
+            kreis_ids_by_name.setdefault(kreis.kreis, kreis.id)
+        bundesland_ids_by_name: Dict[str, int] = {bundesland: bundesland_id for bundesland_id, bundesland in enumerate(bundeslaender)}
+        ordered_ids: np.ndarray = np.array([kreis.id for kreis in kreise], dtype=np.int64)
+        kreis_ids_by_bundesland: List[np.ndarray] = [ordered_ids[bundesland_ids[ordered_ids] == bundesland_id]
+                                                     for bundesland_id in range(len(bundeslaender))]
+
+        # Fallzahlen
+        cases: np.ndarray = np.zeros((WINDOW_DAYS, columns), dtype=np.int64)
+        present: np.ndarray = np.zeros((WINDOW_DAYS, columns), dtype=bool)
+        entered: np.ndarray = np.zeros((WINDOW_DAYS, columns), dtype=bool)
+        links: np.ndarray = np.empty((WINDOW_DAYS, columns), dtype=object)
+        if fallzahlen:
+            rows: np.ndarray = np.array([WINDOW_DAYS - 1 - (end_date - fallzahl.date).days for fallzahl in fallzahlen])
+            kreis_ids: np.ndarray = np.array([fallzahl.kreis_id for fallzahl in fallzahlen])
+            cases[rows, kreis_ids] = [fallzahl.number_of_new_cases or 0 for fallzahl in fallzahlen]
+            present[rows, kreis_ids] = True
+            entered[rows, kreis_ids] = [bool(fallzahl.is_already_entered) for fallzahl in fallzahlen]
+            links[rows, kreis_ids] = [fallzahl.link for fallzahl in fallzahlen]
+
+        # Curves
+        curves: np.ndarray = np.zeros((WINDOW_DAYS, BUCKETS_PER_DAY), dtype=np.int64)
+        has_curve: np.ndarray = np.zeros(WINDOW_DAYS, dtype=bool)
+        if kurven:
+            rows = np.array([WINDOW_DAYS - 1 - (end_date - kurve.date).days for kurve in kurven])
+            curves[rows, [kurve.bucket for kurve in kurven]] = [kurve.cumulative_cases or 0 for kurve in kurven]
+            has_curve[rows] = True
+
+        with self._lock:
+            self._end_date, self._columns = end_date, columns
+            self._cases, self._present, self._entered, self._links = cases, present, entered, links
+            self._curves, self._has_curve = curves, has_curve
+            self._population, self._names, self._name_rank = population, names, name_rank
+            self._bundeslaender, self._bundesland_ids, self._bundesland_ids_by_name = bundeslaender, bundesland_ids, bundesland_ids_by_name
+            self._kreis_ids_by_bundesland, self._kreis_ids_by_name = kreis_ids_by_bundesland, kreis_ids_by_name
+        print(f"Rebuilt case matrix until {end_date}, {len(fallzahlen)} fallzahlen of {len(kreise)} Kreise")
+
+    # Subscriber of FallzahlenIngest, the changeset is already committed
+    def apply(self, changeset: Changeset):
+        with self._lock:
+            needs_rebuild: bool = self._end_date is None or changeset.date > self._end_date or changeset.snapshot_reloaded \
+                                  or any([change.kreis_id >= self._columns for change in changeset.changes])
+            if not needs_rebuild:
+                row: Optional[int] = self._get_row(changeset.date)
+                if row is None:
+                    return
+                for change in changeset.changes:
+                    self._cases[row, change.kreis_id] = change.new_number_of_new_cases or 0
+                    self._present[row, change.kreis_id] = True
+                    self._entered[row, change.kreis_id] = change.is_already_entered
+                    self._links[row, change.kreis_id] = change.link
+        # A new day shifts the whole window and brings the curve of yesterday, reading it again also drops anything that
+        # went wrong the day before
+        if needs_rebuild:
+            self.rebuild(changeset.date)
+
+    # Like sql.get_bundesland_summen: the Bundeslaender with Kreise that are already entered today
+    def get_bundesland_summen(self, today: datetime.date) -> List[BundeslandSummary]:
+        with self._lock:
+            row: Optional[int] = self._get_row(today)
+            if row is None:
+                return []
+            last_week_cases: np.ndarray = self._get_cases(today - timedelta(days=DAYS_BACK))
+            entered: np.ndarray = self._entered[row] & (self._bundesland_ids >= 0)
+            bundesland_ids: np.ndarray = self._bundesland_ids[entered]
+            bundeslaender: int = len(self._bundeslaender)
+            new_cases: np.ndarray = np.bincount(bundesland_ids, weights=self._cases[row, entered], minlength=bundeslaender)
+            new_cases_last_week: np.ndarray = np.bincount(bundesland_ids, weights=last_week_cases[entered], minlength=bundeslaender)
+            has_entered: np.ndarray = np.bincount(bundesland_ids, minlength=bundeslaender) > 0
+            cases_total_last_week: int = int(last_week_cases.sum())
+            return [BundeslandSummary(self._bundeslaender[bundesland_id], int(new_cases[bundesland_id]),
+                                      int(new_cases_last_week[bundesland_id]), cases_total_last_week)
+                    for bundesland_id in np.flatnonzero(has_entered)]
+
+    # The cases of all Kreise today, extrapolated with the curve of the same day last week (see intraday.get_prognosis)
+    def get_prognosis(self, today: datetime.date, bucket: int) -> Optional[float]:
+        with self._lock:
+            row: Optional[int] = self._get_row(today)
+            last_week_row: Optional[int] = self._get_row(today - timedelta(days=DAYS_BACK))
+            if row is None or last_week_row is None or not self._has_curve[last_week_row]:
+                return None
+            return get_prognosis(int(self._cases[row].sum()), self._curves[last_week_row].tolist(), bucket)
+
+    # Like sql.get_kreiszahlen_of_bundesland
+    def get_kreiszahlen_of_bundesland(self, today: datetime.date, bundesland: str) -> List[KreisComparison]:
+        with self._lock:
+            row: Optional[int] = self._get_row(today)
+            bundesland_id: Optional[int] = self._bundesland_ids_by_name.get(bundesland)
+            if row is None or bundesland_id is None:
+                return []
+            kreis_ids: np.ndarray = self._kreis_ids_by_bundesland[bundesland_id]
+            kreis_ids = kreis_ids[self._entered[row, kreis_ids]]
+            new_cases: List[int] = self._cases[row, kreis_ids].tolist()
+            new_cases_last_week: List[int] = self._get_cases(today - timedelta(days=DAYS_BACK))[kreis_ids].tolist()
+            return [KreisComparison(self._names[kreis_id], new_cases[i], new_cases_last_week[i])
+                    for i, kreis_id in enumerate(kreis_ids.tolist())]
+
+    # Like sql.get_history_for_kreis: the days in (today - days, today] that have a row, newest first
+    def get_history_for_kreis(self, kreis: str, today: datetime.date, days: int) -> List[KreisHistoryEntry]:
+        with self._lock:
+            kreis_id: Optional[int] = self._kreis_ids_by_name.get(kreis)
+            if kreis_id is None:
+                return []
+            history: List[KreisHistoryEntry] = []
+            for day in range(days):
+                row: Optional[int] = self._get_row(today - timedelta(days=day))
+                if row is not None and self._present[row, kreis_id]:
+                    history.append(KreisHistoryEntry(kreis, int(self._population[kreis_id]),
+                                                     int(self._cases[row, kreis_id]), self._links[row, kreis_id]))
+            return history
+
+    # Like sql.get_risikogebiete, from the seven days before today: the cases times 100000 divided by the population,
+    # rounded down like the integer division of the query. Ties are sorted by name.
+    def get_risikogebiete(self, today: datetime.date) -> List[Risikogebiet]:
+        with self._lock:
+            if self._end_date is None:
+                return []
+            rows: List[int] = [row for row in [self._get_row(today - timedelta(days=day)) for day in range(1, DAYS_BACK + 1)]
+                               if row is not None]
+            has_rows: np.ndarray = self._present[rows].any(axis=0) & (self._population > 0)
+            kreis_ids: np.ndarray = np.flatnonzero(has_rows)
+            seven_day_cases: np.ndarray = self._cases[rows][:, kreis_ids].sum(axis=0)
+            population: np.ndarray = self._population[kreis_ids]
+            incidence: np.ndarray = seven_day_cases * 100000 // population
+            is_risikogebiet: np.ndarray = incidence >= RISIKOGEBIET_INCIDENCE
+            kreis_ids, incidence = kreis_ids[is_risikogebiet], incidence[is_risikogebiet]
+            order: np.ndarray = np.lexsort((self._name_rank[kreis_ids], -incidence))
+            return [Risikogebiet(int(incidence[i]), self._names[kreis_ids[i]]) for i in order]
+
+    def _get_row(self, date: datetime.date) -> Optional[int]:
+        if self._end_date is None:
+            return None
+        row: int = WINDOW_DAYS - 1 - (self._end_date - date).days
+        return row if 0 <= row < WINDOW_DAYS else None
+
+    # The cases of every Kreis on date, 0 for Kreise without a row and days outside of the window
+    def _get_cases(self, date: datetime.date) -> np.ndarray:
+        row: Optional[int] = self._get_row(date)
+        if row is None:
+            return np.zeros(self._columns, dtype=np.int64)
+        return self._cases[row]
@@ -1,22 +1,31 @@
 import inspect
 import logging
-from typing import List, Dict, Any, Tuple, TypeVar, Type
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, TypeVar, Type, Iterator, Optional
 
 import psycopg2
 from psycopg2.extensions import cursor as Cursor
 from psycopg2.extensions import connection as Connection
 
-from psycopg2.sql import SQL, Identifier, Composable, Literal
+from psycopg2.sql import SQL, Identifier, Composable, Composed, Literal
 from psycopg2.extras import execute_values
 from sqlalchemy import MetaData, create_engine
 from sqlalchemy.ext.declarative import DeclarativeMeta
 
+from data_modules import metrics
+
 
 # Helper
 
 T = TypeVar('T')
 S = TypeVar('S')
 
+# Label of the query metrics when the caller does not name the query
+UNNAMED_QUERY: str = "unnamed"
+
 class DbEntry:
 
     def __init__(self, postgres_db, table_name: str, data: List[Dict]):
@@ -32,121 +41,258 @@ class DbEntry:
 
 class DbResult:
 
-    def __init__(self, data: List[Dict]):
-        self.data = data
+    def __init__(self, column_names: List[str], rows: List[Tuple]):
+        self.column_names: List[str] = column_names
+        self.rows: List[Tuple] = rows
+
+    @property
+    def data(self) -> List[Dict]:
+        return [dict(zip(self.column_names, row)) for row in self.rows]
 
     def convert_rows_to(self, type: Type[T], accept_error=False) -> List[T]:
-        # Get Info On Type
-        empty_instance: T = _instanciate_new_instance(type)
-        instance_variables: List[str] = _get_variables_of_type(empty_instance)
-        # Recreate Type
-        result: List[T] = []
-        for entry in self.data:
-            new_instance: T = _instanciate_new_instance(type)
-            for variable in instance_variables:
-                if variable in entry.keys():
-                    value = entry[variable]
-                # When the columns have duplicates (in joins), they need to be aliased in order for the mapping to work.
-                # We check if that is case. The alias has a specified scheme: "table_column". Aka a column
-                # "name" in table "movies" would be aliased as "movies_name".
-                elif self.get_column_alias(type.__tablename__, variable) in entry.keys():
-                    value = entry[self.get_column_alias(type.__tablename__, variable)]
-                # We can not find a fitting column
-                else:
-                    if not accept_error:
-                        raise Exception(f"Could not find a value for {variable}. Please check if your result contains duplicate"
-                                        f"column names. If yes, you need to alias the columns with 'table_column', for instance"
-                                        f"'movies_name'")
-                    logging.error(f"could not find value for column {variable}. We fill it with None")
-                    value = None
-                setattr(new_instance, variable, value)
-            result.append(new_instance)
-        return result
+        plan: _RowMappingPlan = _get_row_mapping_plan(type, self.column_names, accept_error)
+        return [plan.create_instance(row) for row in self.rows]
+
+    # Read-only variant of convert_rows_to. The records are named tuples with the same attribute names as the type,
+    # which is a lot cheaper than creating the actual instances.
+    def convert_rows_to_records(self, type: Type[T], accept_error=False) -> List[Tuple]:
+        plan: _RowMappingPlan = _get_row_mapping_plan(type, self.column_names, accept_error)
+        return [plan.create_record(row) for row in self.rows]
 
     def convert_to_two_types(self, first_type: Type[T], second_type: Type[S], accept_error=False) -> List[Tuple[T, S]]:
-        result_wrong_shape = [self.convert_rows_to(type, accept_error) for type in [first_type, second_type]]
-        # noinspection PyTypeChecker
-        return list(zip(*result_wrong_shape))
+        first_plan: _RowMappingPlan = _get_row_mapping_plan(first_type, self.column_names, accept_error)
+        second_plan: _RowMappingPlan = _get_row_mapping_plan(second_type, self.column_names, accept_error)
+        return [(first_plan.create_instance(row), second_plan.create_instance(row)) for row in self.rows]
 
     def convert_to_primitive_type(self, primitive_type: Type[T]) -> List[T]:
-        assert all([len(row) == 1 for row in self.data])
-        assert all([isinstance(list(row.values())[0], primitive_type) for row in self.data])
-        return [list(row.values())[0] for row in self.data]
+        assert len(self.column_names) == 1
+        assert all([isinstance(row[0], primitive_type) for row in self.rows])
+        return [row[0] for row in self.rows]
 
     @staticmethod
     def get_column_alias(table_name: str, column: str) -> str:
         return f"{table_name}_{column}"
 
 
+# Looking up the attributes of a type and the matching columns is the expensive part of the mapping, so it is only done
+# once per type and column set. The resulting plan then builds instances straight from the cursor tuples.
+
+class _RowMappingPlan:
+
+    def __init__(self, type: Type[T], column_names: List[str], accept_error: bool):
+        empty_instance: T = _instanciate_new_instance(type)
+        instance_variables: List[str] = _get_variables_of_type(empty_instance)
+        column_indices: Dict[str, int] = {column_name: index for index, column_name in enumerate(column_names)}
+        self._type: Type[T] = type
+        self._attributes: List[Tuple[str, Optional[int]]] = [
+            (variable, _find_column_index(type, variable, column_indices, accept_error)) for variable in instance_variables]
+        self._record_type = namedtuple(f"{type.__name__}Record", instance_variables)
+        self._record_indices: List[Optional[int]] = [index for _, index in self._attributes]
+        # Dataclasses (and similar) get all values through the constructor, everything else is created empty and filled
+        constructor_arguments: List[str] = [key for key in inspect.signature(type.__init__).parameters.keys() if key != "self"]
+        index_by_variable: Dict[str, Optional[int]] = dict(self._attributes)
+        self._constructor_indices: Optional[List[Optional[int]]] = None
+        if sorted(constructor_arguments) == sorted(instance_variables):
+            self._constructor_indices = [index_by_variable[argument] for argument in constructor_arguments]
+        self._empty_arguments: Dict[str, None] = {key: None for key in constructor_arguments}
+        try:
+            type(**self._empty_arguments)
+        except TypeError:
+            self._empty_arguments = {}
+
+    def create_instance(self, row: Tuple) -> T:
+        if self._constructor_indices is not None:
+            return self._type(*_pick(row, self._constructor_indices))
+        new_instance: T = self._type(**self._empty_arguments)
+        for variable, index in self._attributes:
+            setattr(new_instance, variable, row[index] if index is not None else None)
+        return new_instance
+
+    def create_record(self, row: Tuple) -> Tuple:
+        return self._record_type._make(_pick(row, self._record_indices))
+
+
+def _pick(row: Tuple, indices: List[Optional[int]]) -> List[Any]:
+    return [row[index] if index is not None else None for index in indices]
+
+
+_row_mapping_plans: Dict[Tuple[type, Tuple[str, ...], bool], _RowMappingPlan] = {}
+
+def _get_row_mapping_plan(type: Type[T], column_names: List[str], accept_error: bool) -> _RowMappingPlan:
+    key: Tuple[type, Tuple[str, ...], bool] = (type, tuple(column_names), accept_error)
+    if key not in _row_mapping_plans:
+        _row_mapping_plans[key] = _RowMappingPlan(type, column_names, accept_error)
+    return _row_mapping_plans[key]
+
+def _find_column_index(type: Type[T], variable: str, column_indices: Dict[str, int], accept_error: bool) -> Optional[int]:
+    if variable in column_indices:
+        return column_indices[variable]
+    # When the columns have duplicates (in joins), they need to be aliased in order for the mapping to work.
+    # We check if that is case. The alias has a specified scheme: "table_column". Aka a column
+    # "name" in table "movies" would be aliased as "movies_name".
+    table_name: Optional[str] = getattr(type, "__tablename__", None)
+    if table_name is not None and DbResult.get_column_alias(table_name, variable) in column_indices:
+        return column_indices[DbResult.get_column_alias(table_name, variable)]
+    # We can not find a fitting column
+    if not accept_error:
+        raise Exception(f"Could not find a value for {variable}. Please check if your result contains duplicate"
+                        f"column names. If yes, you need to alias the columns with 'table_column', for instance"
+                        f"'movies_name'")
+    logging.error(f"could not find value for column {variable}. We fill it with None")
+    return None
+
+
 # Database
 
-# This class is not thread-safe, mostly because the cursor is an instance variable. When the app has a lot of users,
-# this is a problem, since the results can be corrupted from requests at the same time. For now it is fine however.
-# Anyways, the easiest solution for this problem would be to create a new instance of this class per thread.
+# Connections are handed out by a bounded pool and every call gets its own cursor, so one instance can be shared by the
+# dispatcher workers and the background threads. A connection that was idle for longer than health_check_after seconds
+# gets pinged before it is reused, broken connections are replaced instead of being returned to the pool.
+
+class ConnectionPool:
+
+    def __init__(self, database_url: str, max_size: int, checkout_timeout: float, health_check_after: float,
+                 **connect_kwargs):
+        self._database_url: str = database_url
+        self._connect_kwargs: Dict[str, Any] = connect_kwargs
+        self._checkout_timeout: float = checkout_timeout
+        self._health_check_after: float = health_check_after
+        self._slots: threading.BoundedSemaphore = threading.BoundedSemaphore(max_size)
+        self._idle: List[Tuple[Connection, float]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        if not self._slots.acquire(timeout=self._checkout_timeout):
+            raise TimeoutError(f"Could not get a database connection within {self._checkout_timeout} seconds")
+        connection: Optional[Connection] = None
+        try:
+            connection = self._checkout()
+            yield connection
+            connection.commit()
+        except Exception:
+            self._rollback(connection)
+            raise
+        finally:
+            if connection is not None:
+                self._checkin(connection)
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            connection.close()
+
+    def _checkout(self) -> Connection:
+        with self._lock:
+            connection, returned_at = self._idle.pop() if self._idle else (None, 0.0)
+        if connection is not None and time.monotonic() - returned_at > self._health_check_after \
+                and not self._is_healthy(connection):
+            connection.close()
+            connection = None
+        if connection is None:
+            connection = psycopg2.connect(self._database_url, **self._connect_kwargs)
+        return connection
+
+    def _checkin(self, connection: Connection):
+        if connection.closed:
+            return
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+    @staticmethod
+    def _is_healthy(connection: Connection) -> bool:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _rollback(connection: Optional[Connection]):
+        if connection is None or connection.closed:
+            return
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            logging.exception("Rollback failed, the connection is discarded:")
+            connection.close()
+
 
 class PostgresDatabase:
 
-    def __init__(self, database_url: str):
-        self._connection: Connection = psycopg2.connect(database_url)
-        self._cursor: Cursor = self._connection.cursor()
+    def __init__(self, database_url: str, upsert_batch_size: int = 1000, pool_size: int = 1,
+                 checkout_timeout: float = 30, health_check_after: float = 60, **connect_kwargs):
+        self._pool: ConnectionPool = ConnectionPool(database_url, pool_size, checkout_timeout, health_check_after,
+                                                    **connect_kwargs)
         self._database_url: str = database_url
+        self._upsert_batch_size: int = upsert_batch_size
+        # The scheme does not change while the bot is running, so the catalog lookups are only done once per table
+        self._primary_keys: Dict[str, List[str]] = {}
+        self._column_names: Dict[str, List[str]] = {}
+        self._upsert_statements: Dict[Tuple[str, Tuple[str, ...]], Composed] = {}
 
     def initialize_tables(self, database_url: str, metadata:MetaData):
+        # create_all opens its own engine and checks the tables one by one, which is only needed when a table is missing
+        existing_tables: List[str] = [table_name for (table_name,) in self.get_table_names()]
+        if all([table_name in existing_tables for table_name in metadata.tables.keys()]):
+            return
         engine = create_engine(database_url)
         metadata.create_all(engine)
+        engine.dispose()
 
     def get_table_names(self) -> List[str]:
-        self._cursor.execute("""SELECT table_name FROM information_schema.tables
-           WHERE table_schema = 'public'""")
-        tables: List[str] = self._cursor.fetchall()
+        with self._cursor() as cursor:
+            cursor.execute("""SELECT table_name FROM information_schema.tables
+               WHERE table_schema = 'public'""")
+            tables: List[str] = cursor.fetchall()
         return tables
 
     def get_column_names(self, table_name: str) -> List[str]:
-        self._cursor.execute(SQL("SELECT * FROM {}").format(Identifier(table_name)))
-        columnnames: List[str] = [desc[0] for desc in self._cursor.description]
-        return columnnames
+        if table_name not in self._column_names:
+            with self._cursor() as cursor:
+                cursor.execute(SQL("SELECT * FROM {} LIMIT 0").format(Identifier(table_name)))
+                self._column_names[table_name] = [desc[0] for desc in cursor.description]
+        return self._column_names[table_name]
 
-    def execute(self, sql: Composable):
-        self._cursor.execute(sql)
-        self._connection.commit()
+    def execute(self, sql: Composable, query_name: str = UNNAMED_QUERY):
+        with metrics.track("db_query", operation="execute", query=query_name) as tracker, self._cursor() as cursor:
+            cursor.execute(sql)
+            tracker.rows = max(cursor.rowcount, 0)
 
     def insert(self, table_name: str, data: List[Dict[str, Any]]):
         keys: List[str] = list(data[0].keys())
         as_identifiers: List[Identifier] = [Identifier(key) for key in keys]
         values = [list(entry.values()) for entry in data]
-        execute_values(self._cursor, SQL("INSERT INTO {table_name} ({fields}) VALUES %s") \
-                       .format(table_name=Identifier(table_name), fields=SQL(",").join(as_identifiers)),
-                       values)
-        self._connection.commit()
-
-    def upsert(self, table_name: str, data: List[Dict]):
+        with self._cursor() as cursor:
+            execute_values(cursor, SQL("INSERT INTO {table_name} ({fields}) VALUES %s") \
+                           .format(table_name=Identifier(table_name), fields=SQL(",").join(as_identifiers)),
+                           values)
+
+    def upsert(self, table_name: str, data: List[Dict], query_name: Optional[str] = None):
+        if not data:
+            return
         primary_keys: List[str] = self._get_primary_keys(table_name)
-        column_names: List[Identifier] = [Identifier(key) for key in data[0].keys()]
-        all_values: List[List[Any]] = [list(entry.values()) for entry in data]
-        for values in all_values:
-            remaining_columns: List[Identifier] = [column_name for column_name in column_names if
-                                                   not column_name.string in primary_keys]
-            as_literals: List[Literal] = [Literal(value) for value in values]
-            primary_keys_as_identifier = [Identifier(key) for key in primary_keys]
-            a = "(" if len(remaining_columns) > 1 else ""
-            b = ")" if len(remaining_columns) > 1 else ""
-            sql: Composable = SQL("INSERT INTO {table_name} ({fields}) VALUES ({as_literals}) "
-                                  "ON CONFLICT ({primary_keys}) "
-                                  "DO UPDATE SET" + a + "{remaining_columns}" + b + " = " + a + "{remaining_values}" + b) \
-                .format(table_name=Identifier(table_name), fields=SQL(",").join(column_names), as_literals=SQL(",").join(as_literals), primary_keys=SQL(",").join(primary_keys_as_identifier),
-                        remaining_columns=SQL(",").join(remaining_columns), remaining_values=SQL("EXCLUDED.") + SQL(", EXCLUDED.").join(remaining_columns))
-            self._cursor.execute(sql)
-        self._connection.commit()
-
-    def get(self, sql: Composable) -> DbResult:
-        self._cursor.execute(sql)
-        results_raw: List[Tuple] = self._cursor.fetchall()
-        columnnames: List[str] = [desc[0] for desc in self._cursor.description]
-        results: List[Dict] = []
-        for result in results_raw:
-            entry: Dict = dict(zip(columnnames, result))
-            results.append(entry)
-        return DbResult(results)
+        keys: List[str] = list(data[0].keys())
+        # "ON CONFLICT DO UPDATE" can not touch the same row twice within one statement, so duplicates are collapsed
+        # beforehand. Like the old row-by-row upsert, the last entry wins.
+        rows_by_primary_key: Dict[Tuple, List[Any]] = {tuple(entry[key] for key in primary_keys): [entry[key] for key in keys]
+                                                       for entry in data}
+        statement: Composed = self._get_upsert_statement(table_name, keys, primary_keys)
+        with metrics.track("db_query", operation="upsert", query=query_name or table_name) as tracker, \
+                self._cursor() as cursor:
+            execute_values(cursor, statement, list(rows_by_primary_key.values()), page_size=self._upsert_batch_size)
+            tracker.rows = len(rows_by_primary_key)
+
+    def get(self, sql: Composable, query_name: str = UNNAMED_QUERY) -> DbResult:
+        with metrics.track("db_query", operation="get", query=query_name) as tracker, self._cursor() as cursor:
+            cursor.execute(sql)
+            results_raw: List[Tuple] = cursor.fetchall()
+            columnnames: List[str] = [desc[0] for desc in cursor.description]
+            tracker.rows = len(results_raw)
+        return DbResult(columnnames, results_raw)
 
     def getAll(self, table_name: str) -> DbResult:
         sql: Composable = SQL("SELECT * FROM {table_name}").format(table_name=Identifier(table_name))
@@ -165,14 +311,75 @@ class PostgresDatabase:
             db_entry.append(db_row)
         return DbEntry(self, table_name, db_entry)
 
-    def _get_primary_keys(self, table_name: str) -> List[str]:
-        sql: Composable = SQL("SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS data_type "
-                              "FROM pg_index i JOIN  pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
-                              "WHERE  i.indrelid = {table_name}::regclass AND i.indisprimary") \
-            .format(table_name=Literal(table_name))
-        results: List[Dict] = self.get(sql).data
-        return [result["attname"] for result in results]
+    def close(self):
+        self._pool.close()
+
+    # All calls on the yielded database run on one connection and are committed together when the block ends
+    @contextmanager
+    def transaction(self) -> Iterator["PostgresDatabase"]:
+        with self._pool.connection() as connection:
+            yield _TransactionDatabase(self, connection)
 
+    @contextmanager
+    def _cursor(self) -> Iterator[Cursor]:
+        with self._pool.connection() as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    def _get_upsert_statement(self, table_name: str, keys: List[str], primary_keys: List[str]) -> Composed:
+        cache_key: Tuple[str, Tuple[str, ...]] = (table_name, tuple(keys))
+        if cache_key not in self._upsert_statements:
+            self._upsert_statements[cache_key] = create_upsert_statement(table_name, keys, primary_keys)
+        return self._upsert_statements[cache_key]
+
+    def _get_primary_keys(self, table_name: str) -> List[str]:
+        if table_name in self._primary_keys:
+            return self._primary_keys[table_name]
+        results: List[Dict] = self.get(get_primary_keys_query(table_name)).data
+        self._primary_keys[table_name] = [result["attname"] for result in results]
+        return self._primary_keys[table_name]
+
+
+class _TransactionDatabase(PostgresDatabase):
+
+    def __init__(self, postgres_db: PostgresDatabase, connection: Connection):
+        # Shares the pool and the catalog caches with the database the transaction was started from
+        self._pool = postgres_db._pool
+        self._database_url = postgres_db._database_url
+        self._upsert_batch_size = postgres_db._upsert_batch_size
+        self._primary_keys = postgres_db._primary_keys
+        self._column_names = postgres_db._column_names
+        self._upsert_statements = postgres_db._upsert_statements
+        self._connection: Connection = connection
+
+    @contextmanager
+    def transaction(self) -> Iterator[PostgresDatabase]:
+        yield self
+
+    @contextmanager
+    def _cursor(self) -> Iterator[Cursor]:
+        with self._connection.cursor() as cursor:
+            yield cursor
+
+
+# "VALUES %s" is filled by execute_values
+# The rows go into values, which is the placeholder of execute_values unless they are composed into the statement
+def create_upsert_statement(table_name: str, keys: List[str], primary_keys: List[str], values: Composable = SQL("%s")) -> Composed:
+    remaining_columns: List[Identifier] = [Identifier(key) for key in keys if key not in primary_keys]
+    on_conflict: Composable = SQL("DO NOTHING")
+    if remaining_columns:
+        on_conflict = SQL("DO UPDATE SET {assignments}").format(
+            assignments=SQL(", ").join([SQL("{column} = EXCLUDED.{column}").format(column=column)
+                                        for column in remaining_columns]))
+    return SQL("INSERT INTO {table_name} ({fields}) VALUES {values} ON CONFLICT ({primary_keys}) {on_conflict}") \
+        .format(table_name=Identifier(table_name), fields=SQL(",").join([Identifier(key) for key in keys]), values=values,
+                primary_keys=SQL(",").join([Identifier(key) for key in primary_keys]), on_conflict=on_conflict)
+
+def get_primary_keys_query(table_name: str) -> Composed:
+    return SQL("SELECT a.attname, format_type(a.atttypid, a.atttypmod) AS data_type "
+               "FROM pg_index i JOIN  pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+               "WHERE  i.indrelid = {table_name}::regclass AND i.indisprimary") \
+        .format(table_name=Literal(table_name))
 
 def get_column_names(table: DeclarativeMeta):
     # noinspection PyTypeChecker
@@ -1,7 +1,9 @@
 
 from datetime import datetime
+import asyncio
 import logging
 import signal
+from typing import List, Callable, Awaitable
 
 import pytz
 
@@ -13,28 +15,38 @@ def periodic(scheduler, interval, action, actionargs=()):
     except Exception:
         logging.exception("Periodic Event Failed:")
 
+# Like periodic, but the action returns the seconds until it runs again
+def periodic_adaptive(scheduler, action: Callable[[], float], interval_after_failure: float):
+    try:
+        interval: float = action()
+    except Exception:
+        logging.exception("Periodic Event Failed:")
+        interval = interval_after_failure
+    scheduler.enter(interval, 1, periodic_adaptive, (scheduler, action, interval_after_failure))
+
+async def periodic_async(interval: float, action: Callable[[], Awaitable[None]]):
+    while True:
+        try:
+            await action()
+        except Exception:
+            logging.exception("Periodic Event Failed:")
+        await asyncio.sleep(interval)
+
+async def periodic_adaptive_async(action: Callable[[], Awaitable[float]], interval_after_failure: float):
+    while True:
+        try:
+            interval: float = await action()
+        except Exception:
+            logging.exception("Periodic Event Failed:")
+            interval = interval_after_failure
+        await asyncio.sleep(interval)
+
 
 def get_current_german_time() -> datetime:
     tz = pytz.timezone('Europe/Berlin')
     berlin_now: datetime = datetime.now(tz)
     return berlin_now
 
-def escape_markdown_chars(unescaped_markdown: str) -> str:
-    escaped_unsafe: str = unescaped_markdown.replace("(", "\(")
-    escaped_unsafe = escaped_unsafe.replace(")", "\)")
-    escaped_unsafe = escaped_unsafe.replace("*", "\*")
-    escaped_unsafe = escaped_unsafe.replace("_", "\_")
-    escaped_unsafe = escaped_unsafe.replace("%", "\%")
-    return escaped_unsafe
-
-def escape_unnormal_markdown_chars(unescaped_markdown: str) -> str:
-    markdown = unescaped_markdown.replace("-", "\-")
-    markdown = markdown.replace(".", "\.")
-    markdown = markdown.replace("+", "\+")
-    markdown = markdown.replace("#", "\#")
-    markdown = markdown.replace("=", "\=")
-    return markdown
-
 # Needed because Telegram can not handle some characters in its commands
 def normalise_string(normal_german_string: str) -> str:
     without_special_characters: str = normal_german_string.replace("ä", "ae").replace("ö", "oe").replace("ü", "ue").replace("ß", "ss")
@@ -53,4 +65,10 @@ class timeout:
         signal.signal(signal.SIGALRM, self.handle_timeout)
         signal.alarm(self.seconds)
     def __exit__(self, type, value, traceback):
-        signal.alarm(0)
\ No newline at end of file
+        signal.alarm(0)
+
+def get_percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index: int = min(len(sorted_values) - 1, int(round(percentile / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,132 @@
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Dict, Optional, Callable
+
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+from data_modules.partitions import FallzahlenPartitions
+from data_modules.risklayer import KreisInformation
+from data_modules.scheme import Fallzahl
+
+
+@dataclass
+class KreisChange:
+    kreis_id: int
+    kreis: str
+    old_number_of_new_cases: Optional[int]
+    new_number_of_new_cases: int
+    is_newly_entered: bool
+    # The rest of the new row, for subscribers that keep their own copy of fallzahlen
+    is_already_entered: bool = False
+    link: Optional[str] = None
+
+
+@dataclass
+class Changeset:
+    date: datetime.date
+    changes: List[KreisChange]
+    # True when the snapshot was (re)loaded from the database for this ingest, which happens on startup and when the
+    # date changes. Everything derived from the snapshot should then be recomputed completely.
+    snapshot_reloaded: bool = False
+    # When the numbers were polled (German time), None means now
+    polled_at: Optional[datetime] = None
+
+    def get_changed_kreis_ids(self) -> List[int]:
+        return [change.kreis_id for change in self.changes]
+
+    def get_newly_entered(self) -> List[KreisChange]:
+        return [change for change in self.changes if change.is_newly_entered]
+
+    # The changes of rows that were already there. On a new day every Kreis gets its first row (with whatever the sheet
+    # shows right after midnight), which is no report.
+    def get_updated(self) -> List[KreisChange]:
+        return [change for change in self.changes if change.old_number_of_new_cases is not None]
+
+
+# Keeps the last accepted snapshot of the current day in memory and only writes the Kreise whose numbers changed since
+# then. Everything that depends on fallzahlen can subscribe to the resulting changesets instead of polling the database.
+# Writers run inside the transaction of the fallzahlen write, subscribers are notified after it was committed.
+
+class FallzahlenIngest:
+
+    def __init__(self, postgres_db: PostgresDatabase):
+        self._postgres_db: PostgresDatabase = postgres_db
+        self.partitions: FallzahlenPartitions = FallzahlenPartitions(postgres_db)
+        self._snapshot: Dict[int, Fallzahl] = {}
+        self._snapshot_date: Optional[datetime.date] = None
+        self._snapshot_reloaded: bool = False
+        self._subscribers: List[Callable[[Changeset], None]] = []
+        self._writers: List[Callable[[PostgresDatabase, Changeset], None]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[Changeset], None]):
+        self._subscribers.append(callback)
+
+    def add_writer(self, writer: Callable[[PostgresDatabase, Changeset], None]):
+        self._writers.append(writer)
+
+    def load_snapshot(self, date: datetime.date):
+        fallzahlen: List[Fallzahl] = self._postgres_db.get(sql.get_fallzahlen_on_date(date), "get_fallzahlen_on_date").convert_rows_to(Fallzahl)
+        self._snapshot = {fallzahl.kreis_id: fallzahl for fallzahl in fallzahlen}
+        self._snapshot_date = date
+        self._snapshot_reloaded = True
+
+    def ingest(self, kreis_infos: List[KreisInformation], polled_at: Optional[datetime] = None) -> Changeset:
+        with self._lock:
+            date: datetime.date = kreis_infos[0].date
+            if date != self._snapshot_date:
+                self.partitions.create_ahead(date)
+                self.load_snapshot(date)
+            snapshot_reloaded: bool = self._snapshot_reloaded
+
+            # Compare With Snapshot
+            changed: List[KreisInformation] = [kreis_info for kreis_info in kreis_infos
+                                                if _has_changed(self._snapshot.get(kreis_info.kreis_id), kreis_info)]
+            changes: List[KreisChange] = [_to_change(self._snapshot.get(kreis_info.kreis_id), kreis_info)
+                                          for kreis_info in changed]
+
+            changeset: Changeset = Changeset(date, changes, snapshot_reloaded, polled_at)
+
+            # Write Only The Changed Rows
+            if changed or snapshot_reloaded:
+                try:
+                    with self._postgres_db.transaction() as transaction:
+                        if changed:
+                            transaction.convert_to_db_entry(changed, "fallzahlen").upsert()
+                        for writer in self._writers:
+                            writer(transaction, changeset)
+                except Exception:
+                    # Nothing was written, so the next ingest starts again from what is in the database
+                    self._snapshot_date = None
+                    raise
+            self._snapshot_reloaded = False
+            for kreis_info in changed:
+                self._snapshot[kreis_info.kreis_id] = Fallzahl(kreis_id=kreis_info.kreis_id, date=kreis_info.date,
+                                                               number_of_new_cases=kreis_info.number_of_new_cases,
+                                                               link=kreis_info.link,
+                                                               is_already_entered=kreis_info.is_already_entered)
+        self._publish(changeset)
+        return changeset
+
+    def _publish(self, changeset: Changeset):
+        for subscriber in self._subscribers:
+            try:
+                subscriber(changeset)
+            except Exception:
+                logging.exception("Changeset subscriber failed:")
+
+
+def _has_changed(old: Optional[Fallzahl], new: KreisInformation) -> bool:
+    return old is None or old.number_of_new_cases != new.number_of_new_cases \
+           or old.is_already_entered != new.is_already_entered or old.link != new.link
+
+
+def _to_change(old: Optional[Fallzahl], new: KreisInformation) -> KreisChange:
+    was_entered: bool = old is not None and bool(old.is_already_entered)
+    return KreisChange(kreis_id=new.kreis_id, kreis=new.kreis,
+                       old_number_of_new_cases=old.number_of_new_cases if old is not None else None,
+                       new_number_of_new_cases=new.number_of_new_cases,
+                       is_newly_entered=new.is_already_entered and not was_entered,
+                       is_already_entered=new.is_already_entered, link=new.link)
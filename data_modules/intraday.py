@@ -0,0 +1,72 @@
+from datetime import datetime, date as Date
+from typing import List, Tuple, Optional, Dict
+
+from data_modules import sql, helper_functions as help
+from data_modules.database import PostgresDatabase
+from data_modules.ingest import Changeset
+from data_modules.scheme import FallzahlenKurve
+
+# The reporting curve of a day: every poll appends the changes of the new cases per Kreis to fallzahlen_log, in 15
+# minute buckets of the day. When the ingest reloads its snapshot (on a new day and after a restart), the log of the
+# completed days is compacted into fallzahlen_kurven, the cases of all Kreise reported until the end of every bucket,
+# and deleted. fallzahlen itself is still written by every poll, everything else reads the current numbers from there.
+# The curve of the same day last week gives the share of the cases that was reported by this time of day, which is
+# what the /update prognosis uses.
+
+BUCKET_MINUTES: int = 15
+BUCKETS_PER_DAY: int = 24 * 60 // BUCKET_MINUTES
+
+
+def get_bucket(date: datetime.date, polled_at: datetime) -> int:
+    # The sheet still shows yesterday shortly after midnight, those numbers are the end of yesterday
+    if polled_at.date() > date:
+        return BUCKETS_PER_DAY - 1
+    if polled_at.date() < date:
+        return 0
+    return (polled_at.hour * 60 + polled_at.minute) // BUCKET_MINUTES
+
+
+# Runs as writer of FallzahlenIngest, in the same transaction as the fallzahlen rows
+def log_changes(postgres_db: PostgresDatabase, changeset: Changeset):
+    if changeset.snapshot_reloaded:
+        completed_days: List[Date] = postgres_db\
+            .get(sql.get_fallzahlen_log_dates_before(changeset.date), "get_fallzahlen_log_dates_before")\
+            .convert_to_primitive_type(Date)
+        for day in completed_days:
+            postgres_db.execute(sql.compact_fallzahlen_log(day, BUCKETS_PER_DAY), "compact_fallzahlen_log")
+    deltas: List[Tuple[int, int]] = [(change.kreis_id, (change.new_number_of_new_cases or 0) - (change.old_number_of_new_cases or 0))
+                                     for change in changeset.changes]
+    deltas = [(kreis_id, delta) for kreis_id, delta in deltas if delta != 0]
+    if not deltas:
+        return
+    polled_at: datetime = changeset.polled_at if changeset.polled_at is not None else help.get_current_german_time()
+    postgres_db.execute(sql.append_fallzahlen_log(changeset.date, get_bucket(changeset.date, polled_at), deltas),
+                        "append_fallzahlen_log")
+
+
+# Today's cases so far, extrapolated with the share of the cases that was reported by the same bucket one week ago.
+# None when that day has no curve or nothing was reported by then.
+def get_prognosis(cases_so_far: int, curve_last_week: Optional[List[int]], bucket: int) -> Optional[float]:
+    if curve_last_week is None or curve_last_week[bucket] <= 0 or curve_last_week[-1] <= 0:
+        return None
+    return cases_so_far * curve_last_week[-1] / curve_last_week[bucket]
+
+
+# The share of the cases of a day that was reported in every hour, averaged over the days between first_day and
+# last_day that have a curve. None when there is none. An hour whose corrections outweigh its new cases shrinks the
+# curve, it counts as an hour without reports.
+def get_hour_shares(postgres_db: PostgresDatabase, first_day: datetime.date, last_day: datetime.date) -> Optional[List[float]]:
+    curves: Dict[Date, List[int]] = {}
+    for kurve in postgres_db.get(sql.get_fallzahlen_kurven_between(first_day, last_day), "get_fallzahlen_kurven_between")\
+            .convert_rows_to_records(FallzahlenKurve):
+        curves.setdefault(kurve.date, [0] * BUCKETS_PER_DAY)[kurve.bucket] = kurve.cumulative_cases
+    reported_days: List[List[int]] = [curve for curve in curves.values() if curve[-1] > 0]
+    if not reported_days:
+        return None
+    buckets_per_hour: int = 60 // BUCKET_MINUTES
+    shares: List[float] = [0.0] * 24
+    for curve in reported_days:
+        for hour in range(24):
+            cases_before: int = curve[hour * buckets_per_hour - 1] if hour > 0 else 0
+            shares[hour] += max(0.0, (curve[(hour + 1) * buckets_per_hour - 1] - cases_before) / curve[-1]) / len(reported_days)
+    return shares
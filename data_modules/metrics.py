@@ -0,0 +1,216 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Tuple
+
+# Latency histograms and counters in the Prometheus text format. Nothing is recorded until enable() was called, so the
+# instrumented code only pays for one global lookup while metrics are disabled.
+#   with metrics.track("db_query", operation="get", query="get_risikogebiete") as tracker:
+#       ...
+#       tracker.rows = len(rows)
+# records corona_bot_db_query_seconds, corona_bot_db_query_errors_total (when the block raises) and
+# corona_bot_db_query_rows_total (when rows was set).
+
+PREFIX: str = "corona_bot_"
+LATENCY_BUCKETS: List[float] = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Histograms that are not latencies
+QUEUE_DEPTH_BUCKETS: List[float] = [0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+BUCKETS: Dict[str, List[float]] = {"ingest_poll_interval_seconds": [60, 120, 180, 300, 450, 600, 900, 1200, 1800, 3600],
+                                   "webhook_queue_depth": QUEUE_DEPTH_BUCKETS, "polling_queue_depth": QUEUE_DEPTH_BUCKETS}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+
+    def __init__(self, buckets: List[float]):
+        self._buckets: List[float] = buckets
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, labels: Labels, value: float):
+        with self._lock:
+            if labels not in self._counts:
+                self._counts[labels] = [0] * (len(self._buckets) + 1)
+                self._sums[labels] = 0.0
+            counts: List[int] = self._counts[labels]
+            for i, bucket in enumerate(self._buckets):
+                if value <= bucket:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[labels] += value
+
+    def render(self, name: str) -> List[str]:
+        lines: List[str] = [f"# TYPE {name} histogram"]
+        with self._lock:
+            for labels, counts in self._counts.items():
+                cumulative: int = 0
+                for bucket, count in zip(self._buckets + [float("inf")], counts):
+                    cumulative += count
+                    bucket_label: str = "+Inf" if bucket == float("inf") else repr(float(bucket))
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bucket_label),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {self._sums[labels]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self):
+        self._values: Dict[Labels, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def increment(self, labels: Labels, value: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def get(self, labels: Labels = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self, name: str) -> List[str]:
+        lines: List[str] = [f"# TYPE {name} counter"]
+        with self._lock:
+            for labels, value in self._values.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, Counter] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def histogram(self, name: str) -> Histogram:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(BUCKETS.get(name, LATENCY_BUCKETS))
+            return self._histograms[name]
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter()
+            return self._counters[name]
+
+    def render(self) -> str:
+        with self._lock:
+            histograms: List[Tuple[str, Histogram]] = sorted(self._histograms.items())
+            counters: List[Tuple[str, Counter]] = sorted(self._counters.items())
+        lines: List[str] = []
+        for name, histogram in histograms:
+            lines += histogram.render(PREFIX + name)
+        for name, counter in counters:
+            lines += counter.render(PREFIX + name)
+        return "\n".join(lines) + "\n"
+
+
+class _Tracker:
+
+    def __init__(self, registry: MetricsRegistry, name: str, labels: Labels):
+        self._registry: MetricsRegistry = registry
+        self._name: str = name
+        self._labels: Labels = labels
+        self._start: float = 0.0
+        self.rows: Optional[int] = None
+
+    def __enter__(self) -> "_Tracker":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self._registry.histogram(f"{self._name}_seconds").observe(self._labels, time.perf_counter() - self._start)
+        if exception_type is not None:
+            self._registry.counter(f"{self._name}_errors_total").increment(self._labels)
+        if self.rows is not None:
+            self._registry.counter(f"{self._name}_rows_total").increment(self._labels, self.rows)
+        return False
+
+
+class _DisabledTracker:
+
+    rows: Optional[int] = None
+
+    def __enter__(self) -> "_DisabledTracker":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_registry: Optional[MetricsRegistry] = None
+_disabled_tracker: _DisabledTracker = _DisabledTracker()
+
+
+def enable() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    return _registry
+
+
+def get_registry() -> Optional[MetricsRegistry]:
+    return _registry
+
+
+def track(name: str, **labels: str):
+    if _registry is None:
+        return _disabled_tracker
+    return _Tracker(_registry, name, tuple(sorted(labels.items())))
+
+
+def increment(name: str, value: float = 1, **labels: str):
+    if _registry is None:
+        return
+    _registry.counter(name).increment(tuple(sorted(labels.items())), value)
+
+
+def observe(name: str, value: float, **labels: str):
+    if _registry is None:
+        return
+    _registry.histogram(name).observe(tuple(sorted(labels.items())), value)
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != "/metrics" or _registry is None:
+            self.send_error(404)
+            return
+        body: bytes = _registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serves /metrics in a daemon thread. It listens on localhost by default, the metrics are not meant to be public.
+def start_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    enable()
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped: List[str] = [f'{key}="{_escape_label_value(str(value))}"' for key, value in labels]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
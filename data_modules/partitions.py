@@ -0,0 +1,74 @@
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+
+# fallzahlen is partitioned by date, one partition per day (see scheme.Fallzahl). The ingest creates the partition of a
+# day and of the days after it before it writes, and the retention drops whole partitions instead of deleting rows,
+# which leaves nothing behind to vacuum. A database that was not migrated yet keeps the plain table and the DELETE.
+
+TABLE_NAME: str = "fallzahlen"
+PARTITION_DATE_FORMAT: str = "%Y%m%d"
+DAYS_AHEAD: int = 2
+
+
+def get_partition_name(date: datetime.date) -> str:
+    return f"{TABLE_NAME}_{date.strftime(PARTITION_DATE_FORMAT)}"
+
+
+def get_partition_date(partition_name: str) -> Optional[datetime.date]:
+    try:
+        return datetime.strptime(partition_name[len(TABLE_NAME) + 1:], PARTITION_DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+class FallzahlenPartitions:
+
+    def __init__(self, postgres_db: PostgresDatabase):
+        self._postgres_db: PostgresDatabase = postgres_db
+        self._is_partitioned: Optional[bool] = None
+        self._existing: Set[datetime.date] = set()
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def is_partitioned(self) -> bool:
+        if self._is_partitioned is None:
+            self._is_partitioned = self._postgres_db.get(sql.is_partitioned(TABLE_NAME), "is_partitioned")\
+                .convert_to_primitive_type(bool)[0]
+        return self._is_partitioned
+
+    # Creates the partitions of date and the DAYS_AHEAD days after it, as far as they do not exist yet
+    def create_ahead(self, date: datetime.date):
+        if not self.is_partitioned:
+            return
+        with self._lock:
+            if not self._existing:
+                self._existing = set(self._get_partition_dates())
+            for day in [date + timedelta(days=days) for days in range(DAYS_AHEAD + 1)]:
+                if day in self._existing:
+                    continue
+                self._postgres_db.execute(sql.create_partition(TABLE_NAME, get_partition_name(day), day,
+                                                               day + timedelta(days=1)), "create_partition")
+                self._existing.add(day)
+                print(f"Created partition {get_partition_name(day)}")
+
+    # Removes the fallzahlen of date and every day before it
+    def drop_until(self, date: datetime.date):
+        if not self.is_partitioned:
+            self._postgres_db.execute(sql.delete_fallzahlen_from_before(date), "delete_fallzahlen_from_before")
+            return
+        with self._lock:
+            expired: List[datetime.date] = [day for day in self._get_partition_dates() if day <= date]
+            if expired:
+                self._postgres_db.execute(sql.drop_tables([get_partition_name(day) for day in expired]), "drop_partitions")
+                print(f"Dropped {len(expired)} partitions of {TABLE_NAME}")
+            self._existing = set()
+
+    def _get_partition_dates(self) -> List[datetime.date]:
+        partition_names: List[str] = self._postgres_db.get(sql.get_partitions(TABLE_NAME), "get_partitions")\
+            .convert_to_primitive_type(str)
+        partition_dates: List[Optional[datetime.date]] = [get_partition_date(name) for name in partition_names]
+        return [partition_date for partition_date in partition_dates if partition_date is not None]
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+# Classic token bucket: up to "capacity" calls can happen at once, after that the bucket refills with "rate" tokens per
+# second.
+
+class TokenBucket:
+
+    def __init__(self, rate: float, capacity: float):
+        self._rate: float = rate
+        self._capacity: float = capacity
+        self._tokens: float = capacity
+        self._last_refill: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        return self._reserve(allow_debt=False) == 0
+
+    def acquire(self):
+        seconds_to_wait: float = self._reserve(allow_debt=True)
+        if seconds_to_wait > 0:
+            time.sleep(seconds_to_wait)
+
+    async def acquire_async(self):
+        seconds_to_wait: float = self._reserve(allow_debt=True)
+        if seconds_to_wait > 0:
+            await asyncio.sleep(seconds_to_wait)
+
+    # Returns how long the caller has to wait for a token. With allow_debt, the token is taken right away and
+    # "borrowed" from the future, so callers that wait at the same time are served in order.
+    def _reserve(self, allow_debt: bool) -> float:
+        with self._lock:
+            now: float = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_refill) * self._rate)
+            self._last_refill = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            if not allow_debt:
+                return (1 - self._tokens) / self._rate
+            self._tokens -= 1
+            return -self._tokens / self._rate
+
+
+# One token bucket per chat, for the commands of a chat. The buckets of the chats that were quiet the longest are
+# dropped when there are more than max_chats, they start full again with the next command.
+
+class ChatRateLimiter:
+
+    def __init__(self, rate: float, capacity: float, max_chats: int = 10000):
+        self._rate: float = rate
+        self._capacity: float = capacity
+        self._max_chats: int = max_chats
+        self._buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self.throttled: int = 0
+
+    def try_acquire(self, chat_id: int) -> bool:
+        with self._lock:
+            bucket: Optional[TokenBucket] = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = TokenBucket(self._rate, self._capacity)
+                self._buckets[chat_id] = bucket
+                while len(self._buckets) > self._max_chats:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(chat_id)
+        if bucket.try_acquire():
+            return True
+        with self._lock:
+            self.throttled += 1
+        return False
@@ -0,0 +1,178 @@
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import List, Dict, Optional
+
+from data_modules.routing import create_bundesland_command, create_kreis_command
+
+# Builds the MarkdownV2 messages of the bot. The static text of the templates is escaped once, here in the source, and
+# only the dynamic fields (numbers, names, links) are escaped, with one translate pass per field. The names of the
+# Bundeslaender and Kreise, their commands and links are an almost fixed set, so they are escaped once and cached, and
+# numbers without a sign or decimal point need no escaping at all. The lines of a message are collected in a list and joined once.
+# benchmarks/golden_check.py compares every message with its saved output, benchmarks/rendering_benchmark.py with the
+# old way of escaping the whole message.
+
+# Every character with a meaning in MarkdownV2, see https://core.telegram.org/bots/api#markdownv2-style
+SPECIAL_CHARACTERS: str = "\\_*[]()~`>#+-=|{}.!"
+_ESCAPE_TABLE: Dict[int, str] = str.maketrans({character: "\\" + character for character in SPECIAL_CHARACTERS})
+NAME_CACHE_SIZE: int = 1024
+
+
+def escape(text: object) -> str:
+    return str(text).translate(_ESCAPE_TABLE)
+
+
+def escape_number(number: object) -> str:
+    text: str = str(number)
+    return text if text.isdigit() else text.translate(_ESCAPE_TABLE)
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def escape_name(name: str) -> str:
+    return escape(name)
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_bundesland_command(bundesland: str) -> str:
+    return escape(create_bundesland_command(bundesland))
+
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def get_kreis_command(kreis: str) -> str:
+    return escape(create_kreis_command(kreis))
+
+
+# Templates (positional fields, which format a lot faster than named ones)
+
+# cases today, cases last week, prognosis
+CASE_NUMBER_HEADER = ("Today there are *{}* new cases so far\\. For the same districts, there were *{}* cases "
+                      "last week\\. Prognosis for today: *{}* cases \n \n").format
+# emoji, command, new cases, new cases last week
+COMPARISON_LINE = "{} */{}*: {} \\({}\\) \n".format
+# Bundesland
+BUNDESLAND_HEADER = "*{}*:\n".format
+# Kreis, last seven days, average, incidence, link text, link
+KREIS_MESSAGE = ("*{}*:\n*Last Seven Days:*{}\n*Average*: {} \n*7\\-Day Incidence*: {} per 100\\.000 \n"
+                 "*Link:* [{}]({})").format
+# number of Risikogebiete
+RISIKOGEBIETE_HEADER = ("Here are the risky areas of Germany\\. There are in total *{}* of such areas\\. "
+                        "Incidence per 100k: \n \n").format
+# command, incidence
+RISIKOGEBIET_LINE = "*/{}*: {} \n".format
+# Kreis
+HISTORY_HEADER = "*{}*: new cases per week \n".format
+# first day, last day, new cases, incidence
+HISTORY_LINE = "*{} \\- {}*: {} \\({} per 100\\.000\\) \n".format
+# first day, last day
+HISTORY_LINE_WITHOUT_DATA = "*{} \\- {}*: no data \n".format
+# weeks
+HISTORY_USAGE = "Usage: /history Kreis weeks, for instance /history Dithmarschen {} \n".format
+HISTORY_WITHOUT_ARCHIVE: str = "There is no history yet, the first days are archived after midnight\\."
+HISTORY_DATE_FORMAT: str = "%d\\.%m\\.%Y"
+
+
+@dataclass
+class BundeslandSummary:
+    bundesland: str
+    new_cases: int
+    new_cases_last_week: int
+    cases_total_last_week: int
+
+# Without a prognosis (no reporting curve of last week), the cases of last week are scaled by today's share of the same Kreise
+def render_case_number(bundesland_summen: List[BundeslandSummary], prognosis: Optional[float] = None) -> str:
+    cases_one_week_ago: int = bundesland_summen[0].cases_total_last_week if bundesland_summen else 0
+
+    # Sort
+    sorted_desc_by_growth: List[BundeslandSummary] = sorted(bundesland_summen, key=lambda summe: summe.new_cases - summe.new_cases_last_week, reverse=True)
+
+    # Construct Message
+    cases_today_so_far: int = sum([summe.new_cases for summe in bundesland_summen])
+    cases_last_week_same_districts: int = sum([summe.new_cases_last_week for summe in bundesland_summen])
+    if prognosis is None:
+        prognosis = cases_today_so_far / cases_last_week_same_districts * cases_one_week_ago
+    lines: List[str] = [CASE_NUMBER_HEADER(
+        escape_number(cases_today_so_far), escape_number(cases_last_week_same_districts), escape_number(round(prognosis, 0)))]
+    lines += [COMPARISON_LINE(get_emoji_for_case_numbers(int(summe.new_cases_last_week), int(summe.new_cases)),
+                              get_bundesland_command(summe.bundesland), escape_number(summe.new_cases),
+                              escape_number(summe.new_cases_last_week))
+              for summe in sorted_desc_by_growth]
+    return "".join(lines)
+
+
+@dataclass
+class KreisComparison:
+    kreis: str
+    number_of_new_cases: int
+    number_of_new_cases_last_week: int
+
+def render_bundesland(bundesland: str, kreis_comparisons: List[KreisComparison]) -> str:
+    lines: List[str] = [BUNDESLAND_HEADER(escape_name(bundesland))]
+    lines += [COMPARISON_LINE(get_emoji_for_case_numbers(kreis.number_of_new_cases_last_week, kreis.number_of_new_cases),
+                              get_kreis_command(kreis.kreis), escape_number(kreis.number_of_new_cases),
+                              escape_number(kreis.number_of_new_cases_last_week))
+              for kreis in kreis_comparisons]
+    return "".join(lines)
+
+
+@dataclass
+class KreisHistoryEntry:
+    kreis: str
+    population: int
+    number_of_new_cases: int
+    link: str
+
+def render_kreis(kreis: str, kreis_cases_history: List[KreisHistoryEntry]) -> str:
+    # Today is the first entry, the seven days before it follow
+    last_seven_days: List[int] = [case_number.number_of_new_cases for case_number in kreis_cases_history[1:8]]
+    case_number_sum: int = sum(last_seven_days)
+    last_seven_days_markdown: str = "\\-".join([escape_number(case_number) for case_number in last_seven_days])
+    return KREIS_MESSAGE(escape_name(kreis), " " + last_seven_days_markdown if last_seven_days else "",
+                         escape_number(round(case_number_sum / 7, 2)),
+                         escape_number(round(case_number_sum / kreis_cases_history[0].population * 100_000, 2)),
+                         escape_name(kreis_cases_history[0].kreis), escape_name(kreis_cases_history[0].link))
+
+
+@dataclass
+class Risikogebiet:
+    seven_day_incidence: int
+    kreis: str
+
+def render_risikogebiete(risikogebiete: List[Risikogebiet]) -> str:
+    lines: List[str] = [RISIKOGEBIETE_HEADER(escape_number(len(risikogebiete)))]
+    lines += [RISIKOGEBIET_LINE(get_kreis_command(risikogebiet.kreis), escape_number(risikogebiet.seven_day_incidence))
+              for risikogebiet in risikogebiete]
+    return "".join(lines)
+
+
+@dataclass
+class WeeklyCases:
+    first_day: datetime.date
+    last_day: datetime.date
+    new_cases: Optional[int]
+
+def render_history(kreis: str, population: int, weekly_cases: List[WeeklyCases]) -> str:
+    lines: List[str] = [HISTORY_HEADER(escape_name(kreis))]
+    for week in weekly_cases:
+        first_day: str = week.first_day.strftime(HISTORY_DATE_FORMAT)
+        last_day: str = week.last_day.strftime(HISTORY_DATE_FORMAT)
+        if week.new_cases is None:
+            lines.append(HISTORY_LINE_WITHOUT_DATA(first_day, last_day))
+        else:
+            lines.append(HISTORY_LINE(first_day, last_day, escape_number(week.new_cases),
+                                      escape_number(round(week.new_cases / population * 100_000, 1))))
+    return "".join(lines)
+
+
+def render_history_usage(weeks: int, has_archive: bool) -> str:
+    if not has_archive:
+        return HISTORY_USAGE(escape_number(weeks)) + HISTORY_WITHOUT_ARCHIVE
+    return HISTORY_USAGE(escape_number(weeks))
+
+
+def get_emoji_for_case_numbers(cases_last_week: int, cases_this_week: int) -> str:
+    if cases_this_week > 1.25 * cases_last_week:
+        return "🛑"
+    elif cases_this_week < 0.8 * cases_last_week or cases_last_week == 0:
+        return "✅"
+    else:
+        return "⚠️"
@@ -1,18 +1,22 @@
 # Domain-Specific Names stay in German for (hopefully) better readability
+import codecs
+import hashlib
+import json
+import logging
+import time
 from dataclasses import dataclass
 from datetime import datetime
+from html.parser import HTMLParser
+from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
 import requests
-from bs4 import BeautifulSoup, ResultSet
-from psycopg2.sql import SQL
-from requests import Response
-from selenium.webdriver.firefox.options import Options
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import data_modules.helper_functions as help
-
-from selenium import webdriver
-from data_modules.database import PostgresDatabase
+from data_modules import metrics
 
 
 @dataclass
@@ -25,70 +29,202 @@ class KreisInformation:
     bundesland: Optional[str]
     date: datetime.date
 
-def get_new_data(api_key: str) -> List[KreisInformation]:
-    kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw = _get_from_API(api_key)
-    kreis_infos: List[KreisInformation] = _preprocess_raw_data(kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw)
-    return kreis_infos
-
-def get_all_kreise(postgres_db: PostgresDatabase) -> List[str]:
-    sql: SQL = SQL("SELECT kreis FROM kreise")
-    results: List[str] = postgres_db.get(sql).convert_to_primitive_type(str)
-    return results
-
-
-def get_all_bundeslaender(postgres_db: PostgresDatabase) -> List[str]:
-    sql: SQL = SQL("SELECT DISTINCT bundesland FROM kreise")
-    results = postgres_db.get(sql).convert_to_primitive_type(str)
-    return results
-
-def _get_from_API(api_key: str) -> Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]:
-    # Define Spreadsheet Url
-    RISKLAYER_SPREADSHEET_ID = "1wg-s4_Lz2Stil6spQEYFdZaBEp8nWW26gVyfHqvcl8s"
-    parameters: Dict[str, str] = {"key": api_key}
-    spreadsheet_query_url: str = f'https://sheets.googleapis.com/v4/spreadsheets/{RISKLAYER_SPREADSHEET_ID}/values'
-
-    # Query Data
-    kreis_names_raw: List[List[str]] = requests.get(f'{spreadsheet_query_url}/Haupt!A6:A406', parameters).json()["values"]
-    new_cases_today_raw: List[List[str]] = requests.get(f'{spreadsheet_query_url}/Haupt!T6:T406', parameters).json()["values"]
-    contributors_raw: List[List[str]] = requests.get(f'{spreadsheet_query_url}/Haupt!S6:S406', parameters).json()["values"]
-    links_raw: List[List[str]] = requests.get(f'{spreadsheet_query_url}/Haupt!R6:R406', parameters).json()["values"]
-
-    return kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw
-
-def _get_from_scraping() -> Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]:
-    # Init Session
-    options = Options()
-    options.headless = True
-    URL: str = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTB9XnOufMUQ4Plp6JWi2UAoND8jvBH2oH_vPQGIw5btYHqnSXxeVnpCz-1cwgjNpI48tqDgs51kO7n/pubhtml#"
-    driver: webdriver.Firefox = webdriver.Firefox(options=options)
-    driver.set_page_load_timeout(30)
-    driver.get(URL)
-    html: str  = driver.page_source
-    driver.quit()
-
-    # Init BeautifulSoup
-    html_page: BeautifulSoup = BeautifulSoup(html)
-    all_rows: ResultSet = html_page.findAll("tr")
-    only_valid_rows = [row for row in all_rows if _is_valid_row(row)]
-
-    # Push Results
-    kreis_names_raw: List[List[str]] = []
-    new_cases_today_raw: List[List[str]] = []
-    contributors_raw: List[List[str]] = []
-    links_raw: List[List[str]] = []
-    for row in only_valid_rows:
-        kreis_names_raw.append([str(row.findAll("td")[0].text)])
-        new_cases_today_raw.append([str(row.findAll("td")[20].text)])
-        contributors_raw.append([str(row.findAll("td")[19].text)])
-        links_raw.append([str(row.findAll("td")[18].text)])
-    return kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw
-
-def _is_valid_row(row) -> bool:
-    if len(row.findAll("td")) < 5:
+@dataclass
+class FetchStatistics:
+    latency_seconds: float
+    bytes_transferred: int
+    is_unchanged: bool
+
+
+RISKLAYER_SPREADSHEET_ID: str = "1wg-s4_Lz2Stil6spQEYFdZaBEp8nWW26gVyfHqvcl8s"
+SHEETS_API_URL: str = "https://sheets.googleapis.com/v4/spreadsheets"
+# Kreis names, new cases today, contributors and links. The order is the one _preprocess_raw_data expects.
+HAUPT_RANGES: List[str] = ["Haupt!A6:A406", "Haupt!T6:T406", "Haupt!S6:S406", "Haupt!R6:R406"]
+# The published sheet, used when the Sheets API fails. The columns are counted in <td> cells of a row.
+PUBHTML_URL: str = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTB9XnOufMUQ4Plp6JWi2UAoND8jvBH2oH_vPQGIw5btYHqnSXxeVnpCz-1cwgjNpI48tqDgs51kO7n/pubhtml"
+PUBHTML_CHUNK_SIZE: int = 64 * 1024
+PUBHTML_KREIS_COLUMN: int = 0
+PUBHTML_LINK_COLUMN: int = 18
+PUBHTML_CONTRIBUTORS_COLUMN: int = 19
+PUBHTML_NEW_CASES_COLUMN: int = 20
+
+
+# What the blocking and the asyncio client (see data_modules/async_clients.py) share, everything but the HTTP session
+class BaseRisklayerClient:
+
+    def __init__(self, api_key: str, api_url: str = SHEETS_API_URL, pubhtml_url: str = PUBHTML_URL):
+        self._api_key: str = api_key
+        self._api_url: str = api_url
+        self._pubhtml_url: str = pubhtml_url
+        # The digest of the last ingested sheet, and the one of the last fetch until commit_fetch confirms it
+        self._last_digest: Optional[str] = None
+        self._fetched_digest: Optional[str] = None
+        self.last_statistics: Optional[FetchStatistics] = None
+
+    # Called once the fetched data was ingested. Until then, the next poll returns the same sheet again instead of None,
+    # so numbers that failed to be written are not skipped until the sheet changes.
+    def commit_fetch(self):
+        self._last_digest = self._fetched_digest
+
+    def _handle_response(self, content: bytes, bytes_transferred: int, start: float) \
+            -> Optional[Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]]:
+        # Check If Anything Changed (The date is part of the digest, since the same values mean new rows on a new day)
+        current_date: datetime.date = datetime.date(help.get_current_german_time())
+        digest: str = hashlib.sha256(content + str(current_date).encode()).hexdigest()
+        is_unchanged: bool = digest == self._last_digest
+        self._fetched_digest = digest
+        self.last_statistics = FetchStatistics(time.perf_counter() - start, bytes_transferred, is_unchanged)
+        print(f"Fetched Risklayer data in {self.last_statistics.latency_seconds * 1000:.0f} ms, "
+              f"{self.last_statistics.bytes_transferred} bytes{', unchanged' if is_unchanged else ''}")
+        metrics.increment("risklayer_bytes_total", self.last_statistics.bytes_transferred)
+        metrics.increment("risklayer_polls_total", unchanged=str(is_unchanged).lower())
+        if is_unchanged:
+            return None
+
+        # Google leaves out "values" completely when a range is empty
+        value_ranges: List[Dict] = json.loads(content)["valueRanges"]
+        kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw = [value_range.get("values", [])
+                                                                             for value_range in value_ranges]
+        return kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw
+
+
+class RisklayerClient(BaseRisklayerClient):
+
+    def __init__(self, api_key: str, session: Optional[Session] = None, connect_timeout: float = 5,
+                 read_timeout: float = 30, retries: int = 3, backoff_factor: float = 1, api_url: str = SHEETS_API_URL,
+                 pubhtml_url: str = PUBHTML_URL):
+        super().__init__(api_key, api_url=api_url, pubhtml_url=pubhtml_url)
+        self._session: Session = session if session is not None else _create_session(retries, backoff_factor)
+        self._timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+
+    # Returns None when the sheet did not change since the last committed poll, so the caller can skip the rest of the pipeline
+    def get_new_data(self) -> Optional[List[KreisInformation]]:
+        with metrics.track("risklayer_fetch") as tracker:
+            try:
+                raw_data = self._get_from_API()
+            except (requests.RequestException, ValueError, KeyError):
+                # The published sheet has the same columns, it is slower but works without the API (key, quota)
+                logging.exception("Sheets API failed, using the published sheet:")
+                metrics.increment("risklayer_fallbacks_total")
+                raw_data = _get_from_pubhtml(self._session, self._pubhtml_url, self._timeout)
+            if raw_data is None:
+                return None
+            kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw = raw_data
+            kreis_infos: List[KreisInformation] = _preprocess_raw_data(kreis_names_raw, new_cases_today_raw, contributors_raw, links_raw)
+            tracker.rows = len(kreis_infos)
+        return kreis_infos
+
+    def _get_from_API(self) -> Optional[Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]]:
+        # Query Data (all four columns in one request)
+        start: float = time.perf_counter()
+        response: Response = self._session.get(f"{self._api_url}/{RISKLAYER_SPREADSHEET_ID}/values:batchGet",
+                                               params=get_batch_parameters(self._api_key), timeout=self._timeout)
+        response.raise_for_status()
+        return self._handle_response(response.content, int(response.headers.get("Content-Length", len(response.content))), start)
+
+
+# Stand-in for the Sheets API that answers every request with a response that was saved by record_response. Passing it
+# as session to RisklayerClient makes the ingest work without network access.
+class RecordedSession:
+
+    def __init__(self, path: Path):
+        self._path: Path = path
+
+    def get(self, url: str, params=None, timeout=None, stream=False) -> Response:
+        response: Response = Response()
+        response.status_code = 200
+        response._content = self._path.read_bytes()
+        response._content_consumed = True
+        response.headers["Content-Length"] = str(len(response._content))
+        response.url = url
+        return response
+
+
+def record_response(api_key: str, path: Path):
+    response: Response = requests.get(f"{SHEETS_API_URL}/{RISKLAYER_SPREADSHEET_ID}/values:batchGet",
+                                      params=get_batch_parameters(api_key), timeout=(5, 30))
+    response.raise_for_status()
+    path.write_bytes(response.content)
+
+
+def record_pubhtml(path: Path):
+    response: Response = requests.get(PUBHTML_URL, timeout=(5, 30))
+    response.raise_for_status()
+    path.write_bytes(response.content)
+
+
+def get_batch_parameters(api_key: str) -> List[Tuple[str, str]]:
+    return [("key", api_key)] + [("ranges", value_range) for value_range in HAUPT_RANGES]
+
+
+def _create_session(retries: int, backoff_factor: float) -> Session:
+    retry: Retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504])
+    session: Session = Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    return session
+
+# Streaming parser for the published sheet. Only the cells of the current row are kept, every row is checked and its
+# four values are taken as soon as the row ends, so the memory does not grow with the size of the page.
+class PubhtmlParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._cells: List[str] = []
+        self._cell_text: Optional[List[str]] = None
+        self._kreis_names_raw: List[List[str]] = []
+        self._new_cases_today_raw: List[List[str]] = []
+        self._contributors_raw: List[List[str]] = []
+        self._links_raw: List[List[str]] = []
+
+    def feed_chunk(self, chunk: bytes):
+        self.feed(self._decoder.decode(chunk))
+
+    def finish(self) -> Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]:
+        self.feed(self._decoder.decode(b"", final=True))
+        self.close()
+        return self._kreis_names_raw, self._new_cases_today_raw, self._contributors_raw, self._links_raw
+
+    def handle_starttag(self, tag: str, attrs):
+        if tag == "tr":
+            self._cells = []
+        elif tag == "td":
+            self._cell_text = []
+
+    def handle_endtag(self, tag: str):
+        if tag == "td" and self._cell_text is not None:
+            self._cells.append("".join(self._cell_text))
+            self._cell_text = None
+        elif tag == "tr":
+            if _is_valid_row(self._cells):
+                self._kreis_names_raw.append([self._cells[PUBHTML_KREIS_COLUMN]])
+                self._new_cases_today_raw.append([self._cells[PUBHTML_NEW_CASES_COLUMN]])
+                self._contributors_raw.append([self._cells[PUBHTML_CONTRIBUTORS_COLUMN]])
+                self._links_raw.append([self._cells[PUBHTML_LINK_COLUMN]])
+            self._cells = []
+
+    def handle_data(self, data: str):
+        if self._cell_text is not None:
+            self._cell_text.append(data)
+
+
+def _get_from_pubhtml(session: Session, url: str, timeout: Tuple[float, float]) \
+        -> Tuple[List[List[str]], List[List[str]], List[List[str]], List[List[str]]]:
+    parser: PubhtmlParser = PubhtmlParser()
+    with session.get(url, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(PUBHTML_CHUNK_SIZE):
+            parser.feed_chunk(chunk)
+    return parser.finish()
+
+def _is_valid_row(cells: List[str]) -> bool:
+    # Rows of a Kreis have the kind of Kreis in the third and a percentage in the sixth cell
+    if len(cells) <= PUBHTML_NEW_CASES_COLUMN:
         return False
-    if "kreis" not in str(row.findAll("td")[2].text).lower():
+    if "kreis" not in cells[2].lower():
         return False
-    if "%" not in str(row.findAll("td")[5].text).lower():
+    if "%" not in cells[5]:
         return False
     return True
 
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update, MessageEntity
+from telegram.ext import Handler, CallbackContext, Dispatcher
+
+import data_modules.helper_functions as help
+from data_modules import sql
+from data_modules.database import PostgresDatabase
+from data_modules.scheme import Kreis
+
+BUNDESLAND: str = "bundesland"
+KREIS: str = "kreis"
+
+
+@dataclass(frozen=True)
+class Route:
+    kind: str
+    name: str
+
+
+def create_bundesland_command(bundesland_unformatted: str) -> str:
+    without_special_characters: str = help.normalise_string(bundesland_unformatted)
+    return without_special_characters
+
+def create_kreis_command(kreis_unformatted: str) -> str:
+    without_special_characters: str = help.normalise_string(kreis_unformatted)
+    if without_special_characters in ["Bremen", "Hamburg", "Berlin"]:
+        without_special_characters += "_K"
+    return without_special_characters
+
+
+# One handler for all Bundesland and Kreis commands. Instead of checking ~420 CommandHandlers one after another, the
+# command is looked up in a dict. The callback gets the matched Route as context.route.
+
+class CommandRouter(Handler):
+
+    def __init__(self, callback):
+        super().__init__(callback)
+        self._routes: Dict[str, Route] = {}
+        self._kreise: List[Tuple[int, str, str]] = []
+
+    def refresh(self, postgres_db: PostgresDatabase):
+        self.set_kreise(postgres_db.get(sql.get_all_kreise(), "get_all_kreise").convert_rows_to_records(Kreis))
+
+    def set_kreise(self, kreis_records: List[Kreis]):
+        kreise: List[Tuple[int, str, str]] = [(kreis.id, kreis.kreis, kreis.bundesland) for kreis in kreis_records]
+        if kreise != self._kreise:
+            self._routes = create_routes(kreise)
+            self._kreise = kreise
+            print(f"Rebuilt command routes, {len(self._routes)} commands")
+
+    def check_update(self, update: Update) -> Optional[Route]:
+        if not isinstance(update, Update) or not update.effective_message:
+            return None
+        message = update.effective_message
+        if not (message.entities and message.entities[0].type == MessageEntity.BOT_COMMAND
+                and message.entities[0].offset == 0 and message.text and message.bot):
+            return None
+        command, _, bot_name = message.text[1:message.entities[0].length].partition("@")
+        if bot_name and bot_name.lower() != message.bot.username.lower():
+            return None
+        return self.find_route(command)
+
+    def find_route(self, command: str) -> Optional[Route]:
+        return self._routes.get(command.lower())
+
+    def collect_additional_context(self, context: CallbackContext, update: Update, dispatcher: Dispatcher,
+                                   check_result: Route):
+        context.args = update.effective_message.text.split()[1:]
+        context.update({"route": check_result})
+
+
+def create_routes(kreise: List[Tuple[int, str, str]]) -> Dict[str, Route]:
+    # Telegram commands are case-insensitive. When two commands collide (for instance after normalise_string cut them
+    # to 25 characters), the first one wins and Bundeslaender come before Kreise, like it was with one CommandHandler
+    # per command.
+    routes: Dict[str, Route] = {}
+    for bundesland in sorted({bundesland for _, _, bundesland in kreise}):
+        routes.setdefault(create_bundesland_command(bundesland).lower(), Route(BUNDESLAND, bundesland))
+    for _, kreis, _ in kreise:
+        routes.setdefault(create_kreis_command(kreis).lower(), Route(KREIS, kreis))
+    return routes
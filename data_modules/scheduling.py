@@ -0,0 +1,104 @@
+import math
+from datetime import datetime, timedelta, date as Date
+from typing import List, Optional, Tuple
+
+from data_modules import metrics
+
+# Decides when the next poll of Risklayer happens. The interval follows the square root law: with an expected rate r of
+# changed rows, polling every base_seconds * sqrt(average rate / r) keeps the number of polls of a day at or below the
+# fixed base_seconds interval, while the changes wait less for the poll that picks them up (most of them happen when
+# polls are frequent). The expected rate is the larger one of
+#   - the rate of changed rows since the last poll, smoothed over the last polls, so a burst shortens the interval
+#   - the reporting profile of this and the next hour: the changed rows per hour of day, learned from the polls and
+#     smoothed across days, seeded at boot from the intraday curves of the last week (see data_modules/intraday.py)
+# and the average rate is the one of the profile. Without a profile yet, every poll waits base_seconds, like before.
+# The interval is bounded by min_seconds and max_seconds. Every decision is recorded as
+# corona_bot_ingest_poll_interval_seconds and corona_bot_ingest_polls_total with the reason that decided it.
+
+HOURS_PER_DAY: int = 24
+
+
+class AdaptivePollSchedule:
+
+    def __init__(self, base_seconds: float = 600, min_seconds: float = 120, max_seconds: float = 1800,
+                 rate_smoothing: float = 0.5, profile_smoothing: float = 0.3):
+        if not 0 < min_seconds <= base_seconds <= max_seconds:
+            raise Exception(f"The poll intervals have to be 0 < min ({min_seconds}) <= base ({base_seconds}) <= max ({max_seconds})")
+        self._base_seconds: float = base_seconds
+        self._min_seconds: float = min_seconds
+        self._max_seconds: float = max_seconds
+        self._rate_smoothing: float = rate_smoothing
+        self._profile_smoothing: float = profile_smoothing
+        # Changed rows per second since the last polls
+        self._rate: float = 0.0
+        # Changed rows per hour of day, empty until it was seeded or one day was observed
+        self._profile: List[float] = []
+        # The changed rows of the current day, from the first hour that was observed on it
+        self._day: Optional[Date] = None
+        self._first_hour: int = 0
+        self._day_changes: List[float] = [0.0] * HOURS_PER_DAY
+        self._last_poll: Optional[datetime] = None
+        self.last_interval: float = base_seconds
+        self.last_reason: str = "base"
+
+    def seed_profile(self, changes_per_hour: List[float]):
+        if len(changes_per_hour) != HOURS_PER_DAY:
+            raise Exception(f"A profile has {HOURS_PER_DAY} hours, not {len(changes_per_hour)}")
+        # Negative hours would break the square roots of _decide, there are no negative changes
+        self._profile = [max(0.0, changes) for changes in changes_per_hour]
+
+    # Called after every poll with the number of changed rows (0 when the sheet is unchanged), None when the poll failed
+    def next_interval(self, changed_rows: Optional[int], now: datetime) -> float:
+        self._observe(changed_rows, now)
+        interval, reason = self._decide(now)
+        self.last_interval = interval
+        self.last_reason = reason
+        metrics.observe("ingest_poll_interval_seconds", interval, reason=reason)
+        metrics.increment("ingest_polls_total", reason=reason)
+        if changed_rows:
+            metrics.increment("ingest_changed_rows_total", changed_rows)
+        return interval
+
+    def _observe(self, changed_rows: Optional[int], now: datetime):
+        if self._day != now.date():
+            self._fold_day()
+            self._day = now.date()
+            self._first_hour = now.hour
+            self._day_changes = [0.0] * HOURS_PER_DAY
+        if changed_rows is None:
+            return
+        if self._last_poll is not None and now > self._last_poll:
+            rate: float = changed_rows / (now - self._last_poll).total_seconds()
+            self._rate = self._rate_smoothing * rate + (1 - self._rate_smoothing) * self._rate
+        self._last_poll = now
+        self._day_changes[now.hour] += changed_rows
+
+    # Only the hours that were observed change the profile, a restart at noon says nothing about the morning
+    def _fold_day(self):
+        if self._day is None:
+            return
+        if not self._profile:
+            if self._first_hour > 0:
+                return
+            self._profile = list(self._day_changes)
+            return
+        for hour in range(self._first_hour, HOURS_PER_DAY):
+            self._profile[hour] = self._profile_smoothing * self._day_changes[hour] + (1 - self._profile_smoothing) * self._profile[hour]
+
+    def _decide(self, now: datetime) -> Tuple[float, str]:
+        if not self._profile or sum(self._profile) <= 0:
+            return self._base_seconds, "base"
+        next_hour: int = (now + timedelta(seconds=self._max_seconds)).hour
+        profile_rate: float = max(self._profile[now.hour], self._profile[next_hour]) / 3600
+        expected_rate: float = max(self._rate, profile_rate)
+        reason: str = "observed" if self._rate > profile_rate else "profile"
+        if expected_rate <= 0:
+            return self._max_seconds, "max"
+        # k / sqrt(rate), with k so that the changes of a day like the profile wait base_seconds / 2 on average
+        k: float = self._base_seconds * sum(self._profile) / 3600 / sum([math.sqrt(max(0.0, changes) / 3600) for changes in self._profile])
+        interval: float = k / math.sqrt(expected_rate)
+        if interval <= self._min_seconds:
+            return self._min_seconds, "min"
+        if interval >= self._max_seconds:
+            return self._max_seconds, "max"
+        return interval, reason
@@ -1,11 +1,18 @@
-from sqlalchemy import Column, Integer, ForeignKey, String, Date, Boolean, MetaData
+from sqlalchemy import Column, Integer, SmallInteger, ForeignKey, String, Date, Boolean, MetaData, Index, text
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 
 Base = declarative_base()
 
 
+# The indexes match the queries in data_modules/sql.py (see benchmarks/check_query_plans.py), keep them in sync with
+# the alembic migrations
+
 class Kreis(Base):
     __tablename__ = "kreise"
+    __table_args__ = (
+        Index("ix_kreise_kreis", "kreis"),
+        Index("ix_kreise_bundesland", "bundesland"),
+    )
 
     id = Column(Integer, primary_key=True)
     bundesland = Column(String)
@@ -14,6 +21,14 @@ class Kreis(Base):
 
 class Fallzahl(Base):
     __tablename__ = "fallzahlen"
+    __table_args__ = (
+        # Covers the sums per date without touching the table
+        Index("ix_fallzahlen_date", "date", "kreis_id", "number_of_new_cases", "is_already_entered"),
+        # The Kreise that are already entered today
+        Index("ix_fallzahlen_date_entered", "date", "kreis_id", postgresql_where=text("is_already_entered")),
+        # One partition per day, created by the ingest (see data_modules/partitions.py)
+        {"postgresql_partition_by": "RANGE (date)"},
+    )
 
     kreis_id = Column(ForeignKey("kreise.id"), primary_key=True)
     date = Column(Date, primary_key=True)
@@ -23,10 +38,33 @@ class Fallzahl(Base):
 
 class Notification(Base):
     __tablename__ = "notifications"
+    __table_args__ = (
+        Index("ix_notifications_active", "chat_id", postgresql_where=text("is_active")),
+    )
 
     chat_id = Column(Integer, primary_key=True)
     is_active = Column(Boolean)
 
+# Intraday reporting curve, maintained by the ingest (see data_modules/intraday.py)
+
+class FallzahlLog(Base):
+    __tablename__ = "fallzahlen_log"
+
+    # Change of the new cases of the Kreis within the 15 minute bucket of date, appended by every poll. Only the current
+    # day is kept, the completed days are compacted into fallzahlen_kurven.
+    date = Column(Date, primary_key=True)
+    bucket = Column(SmallInteger, primary_key=True)
+    kreis_id = Column(SmallInteger, primary_key=True)
+    delta = Column(Integer)
+
+class FallzahlenKurve(Base):
+    __tablename__ = "fallzahlen_kurven"
+
+    # New cases of all Kreise reported on date until the end of the bucket, one row for each of the 96 buckets
+    date = Column(Date, primary_key=True)
+    bucket = Column(SmallInteger, primary_key=True)
+    cumulative_cases = Column(Integer)
+
 def get_table_metadata() -> MetaData:
     return Base.metadata
 
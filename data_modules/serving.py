@@ -0,0 +1,214 @@
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional, Tuple
+
+from telegram import Update, Bot
+from telegram.error import TelegramError
+from telegram.ext import Dispatcher
+
+from data_modules import metrics
+from data_modules.rate_limit import TokenBucket
+
+# The updates are handled by a fixed number of worker threads that take them from a bounded queue and run the handlers
+# with dispatcher.process_update (UpdateWorkerPool). The queue depth when an update arrives and the time it waited are
+# recorded as corona_bot_<name>_queue_depth and corona_bot_<name>_queue_wait_seconds, so the workers and the queue can
+# be sized from the evening peaks.
+#
+# Webhook mode (BOT_MODE=webhook): Telegram posts every update to a local HTTP server instead of the bot long polling
+# getUpdates. The server only parses the update and puts it in the queue.
+# When the queue is full the update is answered with 503 and a Retry-After header. Telegram delivers the update again
+# later, so a burst of commands slows the bot down instead of piling up in memory.
+#
+# Polling mode: UpdatePoller long polls getUpdates and puts the updates in the queue. Telegram does not deliver an
+# update again once it was fetched, so when the queue is full the overload policy decides: "shed" drops the update,
+# "busy" also tells the chat to try again later (at most BUSY_REPLIES_PER_SECOND replies, the rest is dropped).
+
+RETRY_AFTER_SECONDS: int = 5
+MAX_UPDATE_BYTES: int = 1024 * 1024
+GET_UPDATES_TIMEOUT: int = 30
+SHED: str = "shed"
+BUSY: str = "busy"
+BUSY_MESSAGE: str = "The bot is very busy right now, please try again in a minute."
+BUSY_REPLIES_PER_SECOND: float = 5
+
+
+class UpdateWorkerPool:
+
+    def __init__(self, dispatcher: Dispatcher, name: str, queue_size: int = 256, workers: int = 4):
+        self._dispatcher: Dispatcher = dispatcher
+        self._name: str = name
+        self._updates: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._workers: List[threading.Thread] = [threading.Thread(target=self._work, name=f"{name}_worker_{i}", daemon=True)
+                                                 for i in range(workers)]
+
+    @property
+    def workers(self) -> int:
+        return len(self._workers)
+
+    @property
+    def queue_size(self) -> int:
+        return self._updates.maxsize
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        # Updates that are already queued are still handled before the workers stop
+        for worker in self._workers:
+            self._updates.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    # False when the queue is full, the caller decides what happens with the update
+    def enqueue(self, update: Update) -> bool:
+        metrics.observe(f"{self._name}_queue_depth", self._updates.qsize())
+        try:
+            self._updates.put_nowait((update, time.perf_counter()))
+        except queue.Full:
+            metrics.increment(f"{self._name}_updates_total", status="rejected")
+            return False
+        metrics.increment(f"{self._name}_updates_total", status="accepted")
+        return True
+
+    def _work(self):
+        while True:
+            item: Optional[Tuple[Update, float]] = self._updates.get()
+            if item is None:
+                return
+            update, received = item
+            metrics.observe(f"{self._name}_queue_wait_seconds", time.perf_counter() - received)
+            try:
+                self._dispatcher.process_update(update)
+            except Exception:
+                logging.exception("Handling an update failed:")
+
+
+class WebhookServer:
+
+    def __init__(self, dispatcher: Dispatcher, host: str, port: int, path: str, queue_size: int = 256, workers: int = 4):
+        self._dispatcher: Dispatcher = dispatcher
+        self._path: str = "/" + path.lstrip("/")
+        self._pool: UpdateWorkerPool = UpdateWorkerPool(dispatcher, "webhook", queue_size, workers)
+        self._server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), _create_request_handler(self))
+        self._server.daemon_threads = True
+
+    @property
+    def server_address(self) -> Tuple[str, int]:
+        return self._server.server_address
+
+    def start(self):
+        self._pool.start()
+        threading.Thread(target=self._server.serve_forever, name="webhook_server", daemon=True).start()
+        print(f"Receiving updates on http://{self.server_address[0]}:{self.server_address[1]}/..., "
+              f"{self._pool.workers} workers, queue size {self._pool.queue_size}")
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._pool.stop()
+
+    def accepts_path(self, path: str) -> bool:
+        return path == self._path
+
+    def enqueue(self, update_json: dict) -> bool:
+        return self._pool.enqueue(Update.de_json(update_json, self._dispatcher.bot))
+
+
+class UpdatePoller:
+
+    def __init__(self, dispatcher: Dispatcher, queue_size: int = 256, workers: int = 4, overload_policy: str = BUSY):
+        if overload_policy not in [SHED, BUSY]:
+            raise Exception(f"Unknown overload policy {overload_policy}, it has to be {SHED} or {BUSY}")
+        self._bot: Bot = dispatcher.bot
+        self._pool: UpdateWorkerPool = UpdateWorkerPool(dispatcher, "polling", queue_size, workers)
+        self._overload_policy: str = overload_policy
+        self._busy_replies: TokenBucket = TokenBucket(BUSY_REPLIES_PER_SECOND, BUSY_REPLIES_PER_SECOND)
+        self._running: threading.Event = threading.Event()
+        self._thread: threading.Thread = threading.Thread(target=self._poll, name="update_poller", daemon=True)
+
+    def start(self):
+        # getUpdates does not work while a webhook is set
+        self._bot.delete_webhook()
+        self._pool.start()
+        self._running.set()
+        self._thread.start()
+        print(f"Polling updates, {self._pool.workers} workers, queue size {self._pool.queue_size}, "
+              f"{self._overload_policy} when the queue is full")
+
+    # Stops after the running getUpdates returned, the updates that were already queued are still handled
+    def stop(self):
+        self._running.clear()
+        self._thread.join()
+        self._pool.stop()
+
+    def _poll(self):
+        offset: Optional[int] = None
+        while self._running.is_set():
+            try:
+                updates: List[Update] = self._bot.get_updates(offset, timeout=GET_UPDATES_TIMEOUT, allowed_updates=["message"])
+            except TelegramError:
+                logging.exception("Getting updates failed:")
+                time.sleep(RETRY_AFTER_SECONDS)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                if not self._pool.enqueue(update):
+                    self._reject(update)
+
+    def _reject(self, update: Update):
+        if self._overload_policy != BUSY or update.effective_chat is None or not self._busy_replies.try_acquire():
+            metrics.increment("polling_overload_total", action=SHED)
+            return
+        metrics.increment("polling_overload_total", action=BUSY)
+        try:
+            self._bot.send_message(update.effective_chat.id, BUSY_MESSAGE)
+        except TelegramError:
+            logging.exception("Replying busy failed:")
+
+
+def _create_request_handler(webhook_server: WebhookServer):
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if not webhook_server.accepts_path(self.path):
+                self.send_error(404)
+                return
+            content_length: int = int(self.headers.get("Content-Length", 0))
+            if content_length <= 0 or content_length > MAX_UPDATE_BYTES:
+                self.send_error(400)
+                return
+            try:
+                update_json: dict = json.loads(self.rfile.read(content_length))
+            except ValueError:
+                self.send_error(400)
+                return
+            if not isinstance(update_json, dict):
+                self.send_error(400)
+                return
+            if not webhook_server.enqueue(update_json):
+                self.send_response(503)
+                self.send_header("Retry-After", str(RETRY_AFTER_SECONDS))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return WebhookRequestHandler
+
+
+# Registers the webhook at Telegram. The secret part of the url is the path, which is the bot token by default.
+def set_webhook(bot: Bot, url: str, path: str, max_connections: int = 40):
+    webhook_url: str = url.rstrip("/") + "/" + path.lstrip("/")
+    if not bot.set_webhook(url=webhook_url, max_connections=max_connections, allowed_updates=["message"]):
+        raise Exception(f"Could not set the webhook to {url}")
@@ -1,4 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
 import data_modules.helper_functions as help
 
 from psycopg2.sql import Composed, SQL, Identifier, Literal
@@ -14,31 +16,128 @@ def get_case_number_on_data(date: datetime.date) -> Composed:
     sql: SQL = SQL("SELECT SUM(number_of_new_cases::integer) AS cases_total FROM fallzahlen WHERE date = {date} GROUP BY date")
     return sql.format(date=Literal(date))
 
-def get_kreiszahlen_of_bundesland(date: datetime.date, today: datetime.date, bundesland: str) -> Composed:
-    sql: SQL = SQL("SELECT *  FROM fallzahlen f LEFT JOIN kreise k ON f.kreis_id = k.id "
-                                 "WHERE k.bundesland = {bundesland} AND f.date = {date} AND f.kreis_id IN "
-                          "                 (SELECT kreis_id FROM fallzahlen WHERE date = {today} AND is_already_entered = True)"
-                          " ORDER BY k.kreis")
-    return sql.format(today=Literal(today), date=Literal(date), bundesland=Literal(bundesland))
-
-def get_risikogebiete(today: datetime.date, last_week: datetime.date) -> Composed:
-    sql_cases_in_last_7_days: SQL = SQL("SELECT (SUM(number_of_new_cases) / k.population * 100000)::integer as seven_day_incidence, k.id, k.kreis "
-                                        "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
-                                        "WHERE date >= {last_week} AND date < {today} "
-                                        "GROUP BY k.id "
-                                        "HAVING SUM(number_of_new_cases) / k.population * 100000 >= 50 "
-                                        "ORDER BY SUM(number_of_new_cases) / k.population * 100000 DESC")
-    return sql_cases_in_last_7_days.format(today=Literal(today), last_week=Literal(last_week))
-
-def get_history_for_kreis(kreis: str) -> Composed:
-    sql: SQL = SQL("SELECT * FROM fallzahlen f LEFT JOIN kreise k ON f.kreis_id = k.id "
-        "WHERE k.kreis = {kreis} ORDER BY f.date DESC")
-    return sql.format(kreis=Literal(kreis))
-
-def delete_all_from_before(date: datetime.date) -> Composed:
+# The Kreise of bundesland that are already entered today, next to their cases of last week
+def get_kreiszahlen_of_bundesland(today: datetime.date, last_week: datetime.date, bundesland: str) -> Composed:
+    sql: SQL = SQL("SELECT k.kreis, f.number_of_new_cases, COALESCE(w.number_of_new_cases, 0) AS number_of_new_cases_last_week "
+                   "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+                   "LEFT JOIN fallzahlen w ON w.kreis_id = f.kreis_id AND w.date = {last_week} "
+                   "WHERE k.bundesland = {bundesland} AND f.date = {today} AND f.is_already_entered = True "
+                   "ORDER BY k.kreis")
+    return sql.format(today=Literal(today), last_week=Literal(last_week), bundesland=Literal(bundesland))
+
+# The Bundesland sums of the Kreise that are already entered on date next to their cases one week before, every row
+# carries the total of all Kreise one week before
+def get_bundesland_summen(date: datetime.date, last_week: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT k.bundesland, SUM(f.number_of_new_cases)::integer AS new_cases, "
+                   "COALESCE(SUM(w.number_of_new_cases), 0)::integer AS new_cases_last_week, COALESCE(t.cases_total, 0) AS cases_total_last_week "
+                   "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+                   "LEFT JOIN fallzahlen w ON w.kreis_id = f.kreis_id AND w.date = {last_week} "
+                   "CROSS JOIN (SELECT SUM(number_of_new_cases)::integer AS cases_total FROM fallzahlen WHERE date = {last_week}) t "
+                   "WHERE f.date = {date} AND f.is_already_entered = True "
+                   "GROUP BY k.bundesland, t.cases_total ORDER BY k.bundesland")
+    return sql.format(date=Literal(date), last_week=Literal(last_week))
+
+# The Kreise with a seven day incidence of at least 50 in the seven days before today
+def get_risikogebiete(today: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT (SUM(f.number_of_new_cases) * 100000 / k.population)::integer AS seven_day_incidence, k.id, k.kreis "
+                   "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+                   "WHERE f.date >= {last_week} AND f.date < {today} "
+                   "GROUP BY k.id "
+                   "HAVING SUM(f.number_of_new_cases) * 100000 / k.population >= 50 "
+                   "ORDER BY seven_day_incidence DESC")
+    return sql.format(today=Literal(today), last_week=Literal(today - timedelta(days=7)))
+
+# The last days of kreis until today, newest first (the date range limits the query to the partitions of these days)
+def get_history_for_kreis(kreis: str, today: datetime.date, days: int) -> Composed:
+    sql: SQL = SQL("SELECT k.kreis, k.population, f.date, f.number_of_new_cases, f.link "
+                   "FROM fallzahlen f INNER JOIN kreise k ON f.kreis_id = k.id "
+                   "WHERE k.kreis = {kreis} AND f.date > {first_day} AND f.date <= {today} "
+                   "ORDER BY f.date DESC LIMIT {days}")
+    return sql.format(kreis=Literal(kreis), first_day=Literal(today - timedelta(days=days)), today=Literal(today),
+                      days=Literal(days))
+
+def get_fallzahlen_on_date(date: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT * FROM fallzahlen WHERE date = {date}")
+    return sql.format(date=Literal(date))
+
+# The days from first_day (or the oldest day, if first_day is None) until last_day, for the archive and the case matrix
+def get_fallzahlen_between(first_day: Optional[datetime.date], last_day: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT kreis_id, date, number_of_new_cases, link, is_already_entered FROM fallzahlen "
+                   "WHERE date >= {first_day} AND date <= {last_day} ORDER BY date, kreis_id")
+    return sql.format(first_day=Literal(first_day if first_day is not None else datetime.min.date()),
+                      last_day=Literal(last_day))
+
+def get_all_kreise() -> Composed:
+    sql: SQL = SQL("SELECT * FROM kreise ORDER BY id")
+    return sql.format()
+
+# Sorted like the ORDER BY of the Bundesland and Kreis queries, so the case matrix can use the collation of the database
+def get_kreise_in_name_order() -> Composed:
+    sql: SQL = SQL("SELECT * FROM kreise ORDER BY bundesland, kreis")
+    return sql.format()
+
+def get_active_chat_ids() -> Composed:
+    sql: SQL = SQL("SELECT chat_id FROM notifications WHERE is_active = True")
+    return sql.format()
+
+# Adds the deltas (Kreis id, delta) to the bucket of date, a second poll within the same bucket adds to the first one
+def append_fallzahlen_log(date: datetime.date, bucket: int, deltas: List[Tuple[int, int]]) -> Composed:
+    sql: SQL = SQL("INSERT INTO fallzahlen_log (date, bucket, kreis_id, delta) VALUES {values} "
+                   "ON CONFLICT (date, bucket, kreis_id) DO UPDATE SET delta = fallzahlen_log.delta + EXCLUDED.delta")
+    values: Composed = SQL(", ").join([SQL("({date}, {bucket}, {kreis_id}, {delta})").format(
+        date=Literal(date), bucket=Literal(bucket), kreis_id=Literal(kreis_id), delta=Literal(delta)) for kreis_id, delta in deltas])
+    return sql.format(values=values)
+
+def get_fallzahlen_log_dates_before(date: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT DISTINCT date FROM fallzahlen_log WHERE date < {date} ORDER BY date")
+    return sql.format(date=Literal(date))
+
+# Turns the log of the completed day into its cumulative curve and deletes it. Cases that are in fallzahlen but not in
+# the log (the log started during the day) count as reported in the first bucket.
+def compact_fallzahlen_log(date: datetime.date, buckets: int) -> Composed:
+    sql: SQL = SQL("INSERT INTO fallzahlen_kurven (date, bucket, cumulative_cases) "
+                   "SELECT {date}, b.bucket, t.cases_before_log + SUM(COALESCE(l.delta, 0)) OVER (ORDER BY b.bucket) "
+                   "FROM generate_series(0, {last_bucket}) AS b(bucket) "
+                   "CROSS JOIN (SELECT COALESCE((SELECT SUM(number_of_new_cases) FROM fallzahlen WHERE date = {date}), 0) "
+                   "                - COALESCE((SELECT SUM(delta) FROM fallzahlen_log WHERE date = {date}), 0) AS cases_before_log) t "
+                   "LEFT JOIN (SELECT bucket, SUM(delta) AS delta FROM fallzahlen_log WHERE date = {date} GROUP BY bucket) l "
+                   "    ON l.bucket = b.bucket "
+                   "ON CONFLICT (date, bucket) DO UPDATE SET cumulative_cases = EXCLUDED.cumulative_cases; "
+                   "DELETE FROM fallzahlen_log WHERE date = {date}")
+    return sql.format(date=Literal(date), last_bucket=Literal(buckets - 1))
+
+def get_fallzahlen_kurven_between(first_day: datetime.date, last_day: datetime.date) -> Composed:
+    sql: SQL = SQL("SELECT date, bucket, cumulative_cases FROM fallzahlen_kurven "
+                   "WHERE date >= {first_day} AND date <= {last_day} ORDER BY date, bucket")
+    return sql.format(first_day=Literal(first_day), last_day=Literal(last_day))
+
+# fallzahlen is not part of this, its partitions are dropped instead (see data_modules/partitions.py)
+def delete_aggregates_from_before(date: datetime.date) -> Composed:
     print("Deleting Values")
+    sql: SQL = SQL("DELETE FROM fallzahlen_kurven WHERE date <= {date}")
+    return sql.format(date=Literal(date))
+
+# Only used while fallzahlen is not partitioned yet
+def delete_fallzahlen_from_before(date: datetime.date) -> Composed:
     sql: SQL = SQL("DELETE FROM fallzahlen WHERE date <= {date}")
     return sql.format(date=Literal(date))
 
+def is_partitioned(table_name: str) -> Composed:
+    sql: SQL = SQL("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass({table_name})) AS is_partitioned")
+    return sql.format(table_name=Literal(table_name))
+
+def get_partitions(table_name: str) -> Composed:
+    sql: SQL = SQL("SELECT c.relname FROM pg_inherits i INNER JOIN pg_class c ON i.inhrelid = c.oid "
+                   "WHERE i.inhparent = to_regclass({table_name}) ORDER BY c.relname")
+    return sql.format(table_name=Literal(table_name))
+
+def create_partition(table_name: str, partition_name: str, first_day: datetime.date, end: datetime.date) -> Composed:
+    sql: SQL = SQL("CREATE TABLE IF NOT EXISTS {partition_name} PARTITION OF {table_name} FOR VALUES FROM ({first_day}) TO ({end})")
+    return sql.format(partition_name=Identifier(partition_name), table_name=Identifier(table_name),
+                      first_day=Literal(first_day), end=Literal(end))
+
+def drop_tables(table_names: List[str]) -> Composed:
+    sql: SQL = SQL("DROP TABLE IF EXISTS {table_names}")
+    return sql.format(table_names=SQL(", ").join([Identifier(table_name) for table_name in table_names]))
 
 
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Tuple, Callable, Dict, Iterator
+
+from data_modules import metrics
+
+# Times the boot of the bot phase by phase, from the start of the process (the imports are the first phase) until the
+# bot receives updates, and the time until the first update was answered. Both are compared with the cold start
+# budget (STARTUP_BUDGET_SECONDS), a dyno restart should not keep users waiting longer than that.
+
+
+def _get_process_start() -> float:
+    # Linux only, /proc/self/stat has the start of the process in clock ticks since boot
+    try:
+        start_ticks: int = int(Path("/proc/self/stat").read_text().rsplit(")", 1)[1].split()[19])
+        seconds_since_process_start: float = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.time() - seconds_since_process_start
+    except (OSError, ValueError, IndexError, AttributeError):
+        return time.time()
+
+
+_process_start: float = _get_process_start()
+
+
+class StartupReport:
+
+    def __init__(self, budget_seconds: float):
+        self._budget_seconds: float = budget_seconds
+        self._phases: List[Tuple[str, float]] = [("imports", time.time() - _process_start)]
+        self._lock: threading.Lock = threading.Lock()
+        self._first_update_handled: bool = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._phases.append((name, time.perf_counter() - start))
+
+    # Runs independent boot steps in threads and returns what they returned by name. Every step is its own phase.
+    def run_concurrently(self, steps: Dict[str, Callable[[], object]]) -> Dict[str, object]:
+        with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="boot") as executor:
+            futures: Dict[str, Future] = {name: executor.submit(self._run_phase, name, step) for name, step in steps.items()}
+            return {name: future.result() for name, future in futures.items()}
+
+    def ready(self):
+        seconds_since_start: float = time.time() - _process_start
+        with self._lock:
+            phases: List[Tuple[str, float]] = list(self._phases)
+        for name, duration in phases:
+            metrics.observe("startup_phase_seconds", duration, phase=name)
+        metrics.observe("startup_seconds", seconds_since_start)
+        phase_summary: str = ", ".join([f"{name} {duration * 1000:.0f} ms" for name, duration in phases])
+        print(f"Receiving updates {seconds_since_start:.2f}s after the process started ({phase_summary})")
+        if seconds_since_start > self._budget_seconds:
+            print(f"The boot took longer than the cold start budget of {self._budget_seconds:.2f}s")
+
+    def update_handled(self):
+        if self._first_update_handled:
+            return
+        self._first_update_handled = True
+        seconds_since_start: float = time.time() - _process_start
+        metrics.observe("startup_first_update_seconds", seconds_since_start)
+        print(f"First update answered {seconds_since_start:.2f}s after the process started")
+        if seconds_since_start > self._budget_seconds:
+            print(f"The first answer took longer than the cold start budget of {self._budget_seconds:.2f}s")
+
+    def _run_phase(self, name: str, step: Callable[[], object]) -> object:
+        with self.phase(name):
+            return step()
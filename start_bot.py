@@ -1,264 +1,379 @@
 import sched
 import time
-from dataclasses import dataclass
 from datetime import datetime, timedelta, time as Time
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Dict
 
 import os
+from pathlib import Path
 
 import pytz
-from psycopg2.sql import SQL, Composed
+from psycopg2.sql import Composed
 from telegram import Update
-from data_modules import helper_functions as help, sql, risklayer
+from data_modules import helper_functions as help, sql, metrics
 
 from data_modules.database import PostgresDatabase
-from telegram.ext import Updater, Dispatcher, CommandHandler, CallbackContext
-from data_modules.risklayer import KreisInformation
+from telegram.ext import Updater, Dispatcher, CommandHandler, CallbackContext, TypeHandler, MessageHandler, Filters, \
+    DispatcherHandlerStop
+from data_modules.risklayer import KreisInformation, RisklayerClient, RecordedSession
+from data_modules.ingest import FallzahlenIngest, Changeset
+from data_modules.partitions import FallzahlenPartitions
+from data_modules.archive import FallzahlenArchive, ArchivedKreis, archive_completed_days
+from data_modules.cache import ResponseCache
+from data_modules.rate_limit import ChatRateLimiter
+from data_modules.case_matrix import CaseMatrix
+from data_modules.intraday import log_changes, get_bucket, get_hour_shares
+from data_modules.scheduling import AdaptivePollSchedule
+from data_modules.broadcast import NotificationBroadcaster
+from data_modules.serving import WebhookServer, UpdatePoller, set_webhook, BUSY
+from data_modules.startup import StartupReport
+from data_modules.rendering import BundeslandSummary, KreisComparison, KreisHistoryEntry, Risikogebiet, WeeklyCases, \
+    render_case_number, render_bundesland, render_kreis, render_risikogebiete, render_history, render_history_usage
+from data_modules.routing import CommandRouter, Route, BUNDESLAND, create_kreis_command
 import threading
 
 from data_modules.scheme import *
 
 DAYS_BACK: int = 7
+HISTORY_WEEKS: int = 8
+MAX_HISTORY_WEEKS: int = 52
 
 
-@dataclass
-class BundeslandInfo:
-    new_cases: int
-    bundesland: str
+# The read commands are answered from the case matrix (data_modules/case_matrix.py), without a database round trip
 
-@dataclass
-class ChatInfo:
-    chat_id: str
-    is_active: bool
+def post_summary(update: Update, context: CallbackContext, case_matrix: CaseMatrix, response_cache: ResponseCache):
+    with metrics.track("command", command="update"):
+        message_markdown: str = response_cache.get_or_render(get_case_number_key(),
+                                                             lambda: get_summarized_case_number(case_matrix))
+        update.message.reply_markdown_v2(message_markdown)
 
 
-def post_summary(update: Update, context: CallbackContext, postgres_db: PostgresDatabase):
-    message_markdown: str = get_summarized_case_number(postgres_db)
-    update.message.reply_markdown_v2(message_markdown)
-
-
-def notify_user(context: CallbackContext, postgres_db: PostgresDatabase):
-    message_markdown: str = get_summarized_case_number(postgres_db)
-    context.bot.send_message(chat_id=context.job.context, text=message_markdown, parse_mode="MarkdownV2")
-
-
-def get_summarized_case_number(postgres_db: PostgresDatabase) -> str:
-    # Prepare Query
-    today: datetime.date = datetime.date(help.get_current_german_time())
-    sql_to_get_data_of_last_week: Composed = sql.get_bundesland_cases_on_date(today - timedelta(days=DAYS_BACK), today)
-    sql_to_get_data_of_today: Composed = sql.get_bundesland_cases_on_date(today, today)
-    sql_to_get_cases_of_last_week: Composed = sql.get_case_number_on_data(today - timedelta(days=DAYS_BACK))
-
-    # Get Results
-    data_one_week_ago: List[BundeslandInfo] = postgres_db\
-        .get(sql_to_get_data_of_last_week)\
-        .convert_rows_to(BundeslandInfo)
-    data_today: List[BundeslandInfo] = postgres_db\
-        .get(sql_to_get_data_of_today)\
-        .convert_rows_to(BundeslandInfo)
-    cases_one_week_ago: int = postgres_db\
-        .get(sql_to_get_cases_of_last_week)\
-        .convert_to_primitive_type(int)[0]
-
-    # Combine
-    combined_info: List[Tuple[BundeslandInfo, BundeslandInfo]] = list(zip(data_today, data_one_week_ago))
-    sorted_desc_by_growth: List[Tuple[BundeslandInfo, BundeslandInfo]] = sorted(combined_info, key=lambda info: info[0].new_cases - info[1].new_cases, reverse=True)
-
-    # Construct Message
-    cases_today_so_far: int = sum([data.new_cases for data in data_today])
-    cases_last_week_same_districts: int = sum([data.new_cases for data in data_one_week_ago])
-    markdown: str = f"Today there are *{cases_today_so_far}* new cases so far. For the same districts, there" \
-                    f" were *{cases_last_week_same_districts}* cases last week. " \
-                    f"Prognosis for today: *{round(cases_today_so_far/cases_last_week_same_districts * cases_one_week_ago, 0)}* cases \n \n"
-    for bundesland in sorted_desc_by_growth:
-        info_today: BundeslandInfo = bundesland[0]
-        info_last_week: BundeslandInfo = bundesland[1]
-        emoji: str = get_emoji_for_case_numbers(int(info_last_week.new_cases), int(info_today.new_cases))
-        bundesland_name: str = help.escape_markdown_chars(create_bundesland_command(info_today.bundesland))
-        markdown += f'{emoji} */{bundesland_name}*: {info_today.new_cases} \({info_last_week.new_cases}\) \n'
-    markdown = help.escape_unnormal_markdown_chars(markdown)
-    return markdown
-
-
-def get_data_for_bundesland(update: Update, context: CallbackContext, postgres_db: PostgresDatabase, bundesland: str):
-    # Define Query
-    today: datetime.date = datetime.date(help.get_current_german_time())
-    sql_kreis_cases_last_week = sql.get_kreiszahlen_of_bundesland(today - timedelta(days=DAYS_BACK), today, bundesland)
-    sql_kreis_cases_today = sql.get_kreiszahlen_of_bundesland(today, today, bundesland)
-
-    # Get Results
-    data_one_week_ago: List[KreisInformation] = postgres_db\
-        .get(sql_kreis_cases_last_week)\
-        .convert_rows_to(KreisInformation)
-    data_today: List[KreisInformation] = postgres_db\
-        .get(sql_kreis_cases_today)\
-        .convert_rows_to(KreisInformation)
-
-    # Construct Message
-    combined_info: List[Tuple[KreisInformation, KreisInformation]] = list(zip(data_today, data_one_week_ago))
-    markdown = f"*{bundesland}*:\n"
-    for kreis in combined_info:
-        emoji: str = get_emoji_for_case_numbers(kreis[1].number_of_new_cases, kreis[0].number_of_new_cases)
-        kreis_name = help.escape_markdown_chars(create_kreis_command(kreis[0].kreis))
-        markdown += f"{emoji} */{kreis_name}*: " \
-                    f"{kreis[0].number_of_new_cases} \({kreis[1].number_of_new_cases}\) \n"
-    update.message.reply_markdown_v2(help.escape_unnormal_markdown_chars(markdown))
-
-
-def get_data_for_kreis(update: Update, context: CallbackContext, postgres_db: PostgresDatabase, kreis: str):
-    # Define Query
-    sql_kreis_cases = sql.get_history_for_kreis(kreis)
-
-    # Get Results
-    kreis_cases_history: List[Tuple[Kreis, Fallzahl]] = postgres_db\
-        .get(sql_kreis_cases)\
-        .convert_to_two_types(Kreis, Fallzahl)
-
-    # Construct Message
-    markdown = f"*{help.escape_markdown_chars(kreis)}*:\n"
-    markdown += "*Last Seven Days:* "
-    for kreis, case_number in kreis_cases_history[1:8]:
-        markdown += f"{case_number.number_of_new_cases}-"
-    case_number_sum: int = sum([case_number.number_of_new_cases for kreis, case_number in kreis_cases_history[1:8]])
-    markdown = markdown[:-1]
-    markdown += "\n"
-    markdown += "*Average*: "
-    markdown += f"{round(case_number_sum/7, 2)} \n"
-    markdown += f"*7-Day Incidence*: {round(case_number_sum / kreis_cases_history[0][0].population * 100_000, 2)} per 100.000 \n"
-    markdown += f"*Link:* [{help.escape_markdown_chars(kreis_cases_history[0][0].kreis)}]({help.escape_markdown_chars(kreis_cases_history[0][1].link)})"
-    update.message.reply_markdown_v2(help.escape_unnormal_markdown_chars(markdown))
-
-
-@dataclass
-class Risikogebiet:
-    seven_day_incidence: int
-    kreis: str
-
-def get_risikogebiete(update: Update, context: CallbackContext, postgres_db: PostgresDatabase):
-    # Get Data
-    today: datetime.date = datetime.date(help.get_current_german_time())
-    last_week: datetime.date = today - timedelta(days=7)
-    sql_to_get_risikogebiete: Composed = sql.get_risikogebiete(today=today, last_week=last_week)
-    risikogebiete: List[Risikogebiet] = postgres_db\
-        .get(sql_to_get_risikogebiete)\
-        .convert_rows_to(Risikogebiet)
-
-    # Construct Message
-    markdown: str = f"Here are the risky areas of Germany. There are in total *{len(risikogebiete)}* of such areas. Incidence per 100k: \n \n"
-    for risikogebiet in risikogebiete:
-        kreis_name = help.escape_markdown_chars(create_kreis_command(risikogebiet.kreis))
-        markdown += f"*/{kreis_name}*: {risikogebiet.seven_day_incidence} \n"
-    update.message.reply_markdown_v2(help.escape_unnormal_markdown_chars(markdown))
+def notify_users(context: CallbackContext, case_matrix: CaseMatrix, response_cache: ResponseCache,
+                 broadcaster: NotificationBroadcaster):
+    broadcaster.broadcast(lambda: response_cache.get_or_render(get_case_number_key(),
+                                                               lambda: get_summarized_case_number(case_matrix)))
 
 
-def start_notifications(update: Update, context: CallbackContext, postgres_db: PostgresDatabase):
-    db_entry = {"chat_id": update.message.chat_id, "is_active": True}
-    postgres_db.upsert("notifications", [db_entry])
-    update.message.reply_text("You will now get a notification each day at 22h!")
-
+def get_summarized_case_number(case_matrix: CaseMatrix) -> str:
+    now: datetime = help.get_current_german_time()
+    bundesland_summen: List[BundeslandSummary] = case_matrix.get_bundesland_summen(now.date())
+    prognosis: Optional[float] = case_matrix.get_prognosis(now.date(), get_bucket(now.date(), now))
+    return render_case_number(bundesland_summen, prognosis)
 
-def stop_notifications(update: Update, context: CallbackContext):
-    db_entry = {"chat_id": update.message.chat_id, "is_active": False}
-    postgres_db.upsert("notifications", [db_entry])
-    update.message.reply_text("You succesfully unsubscribed!")
 
+# The prognosis changes with the time of day, so the message is cached per bucket
+def get_case_number_key() -> Tuple[str, datetime.date, int]:
+    now: datetime = help.get_current_german_time()
+    return "update", now.date(), get_bucket(now.date(), now)
 
-def get_emoji_for_case_numbers(cases_last_week: int, cases_this_week: int) -> str:
-    if cases_this_week > 1.25 * cases_last_week:
-        return "🛑"
-    elif cases_this_week < 0.8 * cases_last_week or cases_last_week == 0:
-        return "✅"
-    else:
-        return "⚠️"
-
-def update_data_periodically(database: PostgresDatabase, api_key: str):
-    scheduler = sched.scheduler(time.time, time.sleep)
-    seconds_to_wait: int = 600
-    help.periodic(scheduler, seconds_to_wait, lambda: update_data(database, api_key))
-    scheduler.run()
-
-def delete_data_periodically(database: PostgresDatabase):
-    scheduler = sched.scheduler(time.time, time.sleep)
-    seconds_in_one_day: int = 86400
-    help.periodic(scheduler, seconds_in_one_day, lambda: delete_data(database))
-    scheduler.run()
 
-def update_data(database: PostgresDatabase, api_key: str):
-    print(f"Updating Values, date={help.get_current_german_time()}")
-    kreis_infos: List[KreisInformation] = risklayer.get_new_data(api_key)
-    data_was_resetted: bool = help.get_current_german_time().hour > 18 and sum([kreis.number_of_new_cases for kreis in kreis_infos]) < 100
-    if data_was_resetted:
-        print("data was resetted")
-        return
-    database.convert_to_db_entry(kreis_infos, "fallzahlen").upsert()
-
-def delete_data(database: PostgresDatabase):
-    date_to_delete_everything_before: datetime.date = datetime.date(help.get_current_german_time() - timedelta(days=28))
-    sql_to_delete_fallzahlen: Composed = sql.delete_all_from_before(date_to_delete_everything_before)
-    database.execute(sql_to_delete_fallzahlen)
+def get_data_for_bundesland(update: Update, context: CallbackContext, case_matrix: CaseMatrix,
+                            response_cache: ResponseCache, bundesland: str):
+    message_markdown: str = response_cache.get_or_render(("bundesland", bundesland, get_today()),
+                                                         lambda: get_summarized_bundesland(case_matrix, bundesland))
+    update.message.reply_markdown_v2(message_markdown)
 
-def get_users_to_notifiy(postgres_db: PostgresDatabase) -> List[str]:
-    sql: SQL = SQL("SELECT * FROM notifications WHERE is_active = True")
-    chat_info: List[ChatInfo] = postgres_db.get(sql).convert_rows_to(ChatInfo)
-    return [info.chat_id for info in chat_info]
 
-def create_bundesland_command(bundesland_unformatted: str) -> str:
-    without_special_characters: str = help.normalise_string(bundesland_unformatted)
-    return without_special_characters
+def get_summarized_bundesland(case_matrix: CaseMatrix, bundesland: str) -> str:
+    kreis_comparisons: List[KreisComparison] = case_matrix.get_kreiszahlen_of_bundesland(get_today(), bundesland)
+    return render_bundesland(bundesland, kreis_comparisons)
 
-def create_kreis_command(kreis_unformatted: str) -> str:
-    without_special_characters: str = help.normalise_string(kreis_unformatted)
-    if without_special_characters in ["Bremen", "Hamburg", "Berlin"]:
-        without_special_characters += "_K"
-    return without_special_characters
 
+def get_data_for_kreis(update: Update, context: CallbackContext, case_matrix: CaseMatrix,
+                       response_cache: ResponseCache, kreis: str):
+    message_markdown: str = response_cache.get_or_render(("kreis", kreis, get_today()),
+                                                         lambda: get_summarized_kreis(case_matrix, kreis))
+    update.message.reply_markdown_v2(message_markdown)
 
 
+def get_summarized_kreis(case_matrix: CaseMatrix, kreis: str) -> str:
+    # Today and the seven days before
+    kreis_cases_history: List[KreisHistoryEntry] = case_matrix.get_history_for_kreis(kreis, get_today(), DAYS_BACK + 1)
+    return render_kreis(kreis, kreis_cases_history)
+
+
+def get_risikogebiete(update: Update, context: CallbackContext, case_matrix: CaseMatrix, response_cache: ResponseCache):
+    with metrics.track("command", command="risikogebiete"):
+        message_markdown: str = response_cache.get_or_render(("risikogebiete", get_today()),
+                                                             lambda: get_summarized_risikogebiete(case_matrix))
+        update.message.reply_markdown_v2(message_markdown)
+
+
+def get_summarized_risikogebiete(case_matrix: CaseMatrix) -> str:
+    risikogebiete: List[Risikogebiet] = case_matrix.get_risikogebiete(get_today())
+    return render_risikogebiete(risikogebiete)
+
+
+def get_history(update: Update, context: CallbackContext, archive: FallzahlenArchive):
+    with metrics.track("command", command="history"):
+        update.message.reply_markdown_v2(get_summarized_history(archive, context.args or []))
+
+
+# Served from the archive only, so it works without the database and for more than the 28 days in it
+def get_summarized_history(archive: FallzahlenArchive, args: List[str]) -> str:
+    # Parse Arguments (/history <kreis> <weeks>, the Kreis written like its command)
+    weeks: int = HISTORY_WEEKS
+    if len(args) > 1 and args[-1].isdigit():
+        weeks = min(max(int(args[-1]), 1), MAX_HISTORY_WEEKS)
+        args = args[:-1]
+    kreis: Optional[ArchivedKreis] = find_archived_kreis(archive.kreise, " ".join(args))
+    last_date: Optional[datetime.date] = archive.last_date
+    if kreis is None or last_date is None:
+        return render_history_usage(HISTORY_WEEKS, last_date is not None)
+
+    # Get Data (full weeks only, the last one ends with the last archived day)
+    weeks = max(1, min(weeks, ((last_date - archive.first_date).days + 1) // 7))
+    first_day: datetime.date = last_date - timedelta(days=7 * weeks - 1)
+    series: List[Tuple[datetime.date, Optional[int]]] = archive.get_kreis_series(kreis.id, first_day, last_date)
+    weekly_cases: List[WeeklyCases] = []
+    for week in range(weeks):
+        week_start: datetime.date = first_day + timedelta(days=7 * week)
+        known: List[int] = [new_cases for date, new_cases in series
+                            if week_start <= date < week_start + timedelta(days=7) and new_cases is not None]
+        weekly_cases.append(WeeklyCases(week_start, week_start + timedelta(days=6), sum(known) if known else None))
+    return render_history(kreis.kreis, kreis.population, weekly_cases)
+
+
+def find_archived_kreis(kreise: List[ArchivedKreis], name: str) -> Optional[ArchivedKreis]:
+    name = name.lower()
+    for kreis in kreise:
+        if name == kreis.kreis.lower() or name == create_kreis_command(kreis.kreis).lower():
+            return kreis
+    return None
+
+
+def route_command(update: Update, context: CallbackContext, case_matrix: CaseMatrix, response_cache: ResponseCache):
+    route: Route = context.route
+    # Labeled by kind, one label per Bundesland and Kreis would be too many
+    with metrics.track("command", command=route.kind):
+        if route.kind == BUNDESLAND:
+            get_data_for_bundesland(update, context, case_matrix, response_cache, route.name)
+        else:
+            get_data_for_kreis(update, context, case_matrix, response_cache, route.name)
+
+
+# Runs before the command handlers: the commands of a chat that floods the bot are dropped before they reach the case
+# matrix or the database
+def throttle_commands(update: Update, context: CallbackContext, chat_rate_limiter: ChatRateLimiter):
+    if update.effective_chat is None or chat_rate_limiter.try_acquire(update.effective_chat.id):
+        return
+    metrics.increment("commands_throttled_total")
+    raise DispatcherHandlerStop()
 
-# Load Data
-API_KEY: str = os.environ["API_KEY"]
-TELEGRAM_TOKEN: str = os.environ["TELEGRAM_TOKEN"]
-DATABASE_URL: str = os.environ["DATABASE_URL"]
-postgres_db: PostgresDatabase = PostgresDatabase(DATABASE_URL)
-postgres_db.initialize_tables(DATABASE_URL, get_table_metadata())
 
-# Schedule Updates and Deletes (Deletes are neccessary for Heroku)
-update_database_thread = threading.Thread(target=lambda: update_data_periodically(PostgresDatabase(DATABASE_URL), API_KEY))
-update_database_thread.start()
-delete_database_thread = threading.Thread(target=lambda: delete_data_periodically(PostgresDatabase(DATABASE_URL)))
-delete_database_thread.start()
+def start_notifications(update: Update, context: CallbackContext, postgres_db: PostgresDatabase):
+    with metrics.track("command", command="start"):
+        db_entry = {"chat_id": update.message.chat_id, "is_active": True}
+        postgres_db.upsert("notifications", [db_entry])
+        update.message.reply_text("You will now get a notification each day at 22h!")
+
+
+def stop_notifications(update: Update, context: CallbackContext, postgres_db: PostgresDatabase):
+    with metrics.track("command", command="stop"):
+        db_entry = {"chat_id": update.message.chat_id, "is_active": False}
+        postgres_db.upsert("notifications", [db_entry])
+        update.message.reply_text("You succesfully unsubscribed!")
+
+
+# Updates, route refreshs and deletes share one timer thread that runs the scheduler
+def update_data_periodically(scheduler: sched.scheduler, fallzahlen_ingest: FallzahlenIngest, risklayer_client: RisklayerClient,
+                             command_router: CommandRouter, database: PostgresDatabase, poll_schedule: AdaptivePollSchedule):
+    seconds_to_wait_for_routes: int = 3600
+    # The routes were already built at boot, so the first refresh waits one interval
+    scheduler.enter(seconds_to_wait_for_routes, 1, help.periodic,
+                    (scheduler, seconds_to_wait_for_routes, lambda: command_router.refresh(database)))
+    scheduler.enter(0, 1, help.periodic_adaptive,
+                    (scheduler, lambda: poll_schedule.next_interval(update_data(fallzahlen_ingest, risklayer_client),
+                                                                    help.get_current_german_time()),
+                     poll_schedule.last_interval))
+
+def delete_data_periodically(scheduler: sched.scheduler, database: PostgresDatabase, partitions: FallzahlenPartitions,
+                             archive: FallzahlenArchive):
+    seconds_in_one_day: int = 86400
+    scheduler.enter(0, 1, help.periodic, (scheduler, seconds_in_one_day, lambda: delete_data(database, partitions, archive)))
+
+# Seeded with the intraday curves of the last week: every Kreis enters its numbers about once a day, spread over the
+# day like the cases
+def create_poll_schedule(database: PostgresDatabase, base_seconds: float, min_seconds: float, max_seconds: float) -> AdaptivePollSchedule:
+    poll_schedule: AdaptivePollSchedule = AdaptivePollSchedule(base_seconds, min_seconds, max_seconds)
+    hour_shares: Optional[List[float]] = get_hour_shares(database, get_today() - timedelta(days=7), get_today() - timedelta(days=1))
+    if hour_shares is not None:
+        number_of_kreise: int = len(database.get(sql.get_all_kreise(), "get_all_kreise").rows)
+        poll_schedule.seed_profile([share * number_of_kreise for share in hour_shares])
+    return poll_schedule
+
+# Returns the number of Kreise whose row changed, for the poll schedule: 0 when the sheet is unchanged, the first
+# rows of a new day do not count. None when the data was not ingested.
+def update_data(fallzahlen_ingest: FallzahlenIngest, risklayer_client: RisklayerClient) -> Optional[int]:
+    print(f"Updating Values, date={help.get_current_german_time()}")
+    with metrics.track("job", job="update_data") as tracker:
+        kreis_infos: Optional[List[KreisInformation]] = risklayer_client.get_new_data()
+        if kreis_infos is None:
+            return 0
+        if data_was_resetted(kreis_infos):
+            print("data was resetted")
+            return
+        changeset: Changeset = fallzahlen_ingest.ingest(kreis_infos)
+        risklayer_client.commit_fetch()
+        tracker.rows = len(changeset.changes)
+    print(f"{len(changeset.changes)} Kreise changed, {len(changeset.get_newly_entered())} newly entered")
+    return len(changeset.get_updated())
+
+def data_was_resetted(kreis_infos: List[KreisInformation]) -> bool:
+    return help.get_current_german_time().hour > 18 and sum([kreis.number_of_new_cases for kreis in kreis_infos]) < 100
+
+def invalidate_responses(changeset: Changeset, response_cache: ResponseCache):
+    if not changeset.changes:
+        return
+    print(f"Invalidating response cache, {response_cache.hits} hits and {response_cache.misses} misses so far")
+    response_cache.invalidate()
 
-# Schedule Notifications
-users_to_notify: List[str] = get_users_to_notifiy(postgres_db)
-updater: Updater = Updater(token=TELEGRAM_TOKEN, use_context=True)
-for user in users_to_notify:
+def delete_data(database: PostgresDatabase, partitions: FallzahlenPartitions, archive: FallzahlenArchive):
+    date_to_delete_everything_before: datetime.date = datetime.date(help.get_current_german_time() - timedelta(days=28))
+    sql_to_delete_aggregates: Composed = sql.delete_aggregates_from_before(date_to_delete_everything_before)
+    with metrics.track("job", job="delete_data"):
+        # Every completed day is archived first, nothing is dropped when that fails
+        archive_completed_days(database, archive, get_today() - timedelta(days=1))
+        partitions.drop_until(date_to_delete_everything_before)
+        database.execute(sql_to_delete_aggregates, "delete_aggregates_from_before")
+
+def get_today() -> datetime.date:
+    return datetime.date(help.get_current_german_time())
+
+
+def main():
+    startup_report: StartupReport = StartupReport(float(os.environ.get("STARTUP_BUDGET_SECONDS", "5")))
+    # Load Data
+    API_KEY: str = os.environ["API_KEY"]
+    TELEGRAM_TOKEN: str = os.environ["TELEGRAM_TOKEN"]
+    # For a local Bot API server, for instance http://localhost:8081/bot
+    TELEGRAM_API_URL: Optional[str] = os.environ.get("TELEGRAM_API_URL")
+    DATABASE_URL: str = os.environ["DATABASE_URL"]
+    DATABASE_POOL_SIZE: int = int(os.environ.get("DATABASE_POOL_SIZE", "4"))
+    # Metrics are only recorded when METRICS_PORT is set
+    METRICS_PORT: Optional[str] = os.environ.get("METRICS_PORT")
+    if METRICS_PORT:
+        metrics.enable()
+    postgres_db: PostgresDatabase = PostgresDatabase(DATABASE_URL, pool_size=DATABASE_POOL_SIZE)
+    # The updates are handled by UPDATE_WORKERS threads (see data_modules/serving.py). Every worker has its own connection
+    # for the handlers, so a slow ingest or broadcast can not hold up the commands.
+    UPDATE_WORKERS: int = int(os.environ.get("UPDATE_WORKERS", os.environ.get("WEBHOOK_WORKERS", "4")))
+    UPDATE_QUEUE_SIZE: int = int(os.environ.get("UPDATE_QUEUE_SIZE", os.environ.get("WEBHOOK_QUEUE_SIZE", "256")))
+    # What polling does with an update when the queue is full: "busy" tells the chat to try again, "shed" drops it
+    OVERLOAD_POLICY: str = os.environ.get("OVERLOAD_POLICY", BUSY)
+    handler_db: PostgresDatabase = PostgresDatabase(DATABASE_URL, pool_size=UPDATE_WORKERS)
+    # Setting RISKLAYER_RECORDED_RESPONSE replays a response saved with risklayer.record_response instead of calling Google
+    RECORDED_RESPONSE: Optional[str] = os.environ.get("RISKLAYER_RECORDED_RESPONSE")
+    risklayer_client: RisklayerClient = RisklayerClient(API_KEY, session=RecordedSession(Path(RECORDED_RESPONSE)) if RECORDED_RESPONSE else None)
+    # The snapshot of today is loaded by the first ingest, not at boot
+    fallzahlen_ingest: FallzahlenIngest = FallzahlenIngest(postgres_db)
+    fallzahlen_ingest.add_writer(log_changes)
+    RESPONSE_CACHE_SIZE: int = int(os.environ.get("RESPONSE_CACHE_SIZE", "1024"))
+    response_cache: ResponseCache = ResponseCache(RESPONSE_CACHE_SIZE)
+    # Long-term history, the days that are dropped from the database are kept there
+    archive: FallzahlenArchive = FallzahlenArchive(Path(os.environ.get("ARCHIVE_DIRECTORY", "archive")))
+    # Filled at boot, the cached responses are only dropped after the matrix has the new numbers
+    case_matrix: CaseMatrix = CaseMatrix(postgres_db)
+    fallzahlen_ingest.subscribe(case_matrix.apply)
+    fallzahlen_ingest.subscribe(lambda changeset: invalidate_responses(changeset, response_cache))
+
+    # Every chat can send CHAT_COMMAND_BURST commands at once, then one every 1 / CHAT_COMMAND_RATE seconds
+    chat_rate_limiter: ChatRateLimiter = ChatRateLimiter(float(os.environ.get("CHAT_COMMAND_RATE", "0.5")),
+                                                         float(os.environ.get("CHAT_COMMAND_BURST", "5")))
+    command_router: CommandRouter = CommandRouter(lambda update, context: route_command(update, context, case_matrix, response_cache))
+    NOTIFICATION_WORKERS: int = int(os.environ.get("NOTIFICATION_WORKERS", "8"))
     time_where_notifications_get_send: Time = Time(hour=21, minute=00, tzinfo=pytz.timezone('Europe/Berlin'))
-    updater.job_queue.run_daily(lambda context: notify_user(context, PostgresDatabase(DATABASE_URL)),time_where_notifications_get_send, context=user, job_kwargs={"misfire_grace_time" : None})
-
-#Register Functions To Dispatcher
-dispatcher: Dispatcher = updater.dispatcher
-dispatcher.add_handler(CommandHandler("update", lambda update, context: post_summary(update, context, postgres_db)))
-dispatcher.add_handler(CommandHandler("start", lambda update, context: start_notifications(update, context, postgres_db)))
-dispatcher.add_handler(CommandHandler("stop", stop_notifications))
-dispatcher.add_handler(CommandHandler("risikogebiete", lambda update, context: get_risikogebiete(update, context, postgres_db)))
-for bundesland in risklayer.get_all_bundeslaender(postgres_db):
-    bundesland_command: str = create_bundesland_command(bundesland)
-    callback_function = lambda update, context, bundesland=bundesland: \
-        get_data_for_bundesland(update, context, postgres_db, bundesland)
-    dispatcher.add_handler(CommandHandler(bundesland_command, callback_function))
-for kreis in risklayer.get_all_kreise(postgres_db):
-    kreis_command: str = create_kreis_command(kreis)
-    callback_function = lambda update, context, kreis=kreis: \
-        get_data_for_kreis(update, context, postgres_db, kreis)
-    dispatcher.add_handler(CommandHandler(kreis_command, callback_function))
-
-updater.start_polling()
-
-
-
-
-
-
-
-
+    # Risklayer is polled more often while the Kreise report and less at night, see data_modules/scheduling.py
+    POLL_BASE_SECONDS: float = float(os.environ.get("POLL_BASE_SECONDS", "600"))
+    POLL_MIN_SECONDS: float = float(os.environ.get("POLL_MIN_SECONDS", "120"))
+    POLL_MAX_SECONDS: float = float(os.environ.get("POLL_MAX_SECONDS", "1800"))
+
+    # The tables have to exist before the routes and the case matrix can be read, everything else at boot does not need the database
+    def prepare_database():
+        postgres_db.initialize_tables(DATABASE_URL, get_table_metadata())
+        command_router.refresh(postgres_db)
+        case_matrix.rebuild(get_today())
+
+    # BOT_RUNTIME=asyncio runs everything in one event loop (needs aiohttp and aiopg)
+    if os.environ.get("BOT_RUNTIME", "threads") == "asyncio":
+        import asyncio
+        import async_bot
+        with startup_report.phase("database"):
+            prepare_database()
+        if METRICS_PORT:
+            metrics.start_server(int(METRICS_PORT), os.environ.get("METRICS_HOST", "127.0.0.1"))
+        poll_schedule: AdaptivePollSchedule = create_poll_schedule(postgres_db, POLL_BASE_SECONDS, POLL_MIN_SECONDS, POLL_MAX_SECONDS)
+        startup_report.ready()
+        asyncio.run(async_bot.run(TELEGRAM_TOKEN, API_KEY, DATABASE_URL, DATABASE_POOL_SIZE, fallzahlen_ingest,
+                                  response_cache, command_router, archive, case_matrix, postgres_db, NOTIFICATION_WORKERS,
+                                  time_where_notifications_get_send, poll_schedule, chat_rate_limiter,
+                                  risklayer_client if RECORDED_RESPONSE else None))
+        return
 
+    boot_results: Dict[str, object] = startup_report.run_concurrently({
+        "database": prepare_database,
+        "telegram": lambda: create_updater(TELEGRAM_TOKEN, TELEGRAM_API_URL, postgres_db, handler_db, response_cache,
+                                           command_router, archive, case_matrix, chat_rate_limiter, UPDATE_WORKERS,
+                                           NOTIFICATION_WORKERS, time_where_notifications_get_send, startup_report),
+    })
+    updater: Updater = boot_results["telegram"]
+
+    # Schedule Updates and Deletes (Deletes are neccessary for Heroku)
+    poll_schedule: AdaptivePollSchedule = create_poll_schedule(postgres_db, POLL_BASE_SECONDS, POLL_MIN_SECONDS, POLL_MAX_SECONDS)
+    scheduler: sched.scheduler = sched.scheduler(time.time, time.sleep)
+    update_data_periodically(scheduler, fallzahlen_ingest, risklayer_client, command_router, postgres_db, poll_schedule)
+    delete_data_periodically(scheduler, postgres_db, fallzahlen_ingest.partitions, archive)
+    scheduler_thread = threading.Thread(target=scheduler.run)
+    scheduler_thread.start()
+
+    if METRICS_PORT:
+        metrics.start_server(int(METRICS_PORT), os.environ.get("METRICS_HOST", "127.0.0.1"))
+    # BOT_MODE=webhook receives the updates from Telegram on a local HTTP server instead of polling them
+    if os.environ.get("BOT_MODE", "polling") == "webhook":
+        WEBHOOK_URL: str = os.environ["WEBHOOK_URL"]
+        WEBHOOK_PATH: str = os.environ.get("WEBHOOK_PATH", TELEGRAM_TOKEN)
+        webhook_server: WebhookServer = WebhookServer(updater.dispatcher, os.environ.get("WEBHOOK_HOST", "0.0.0.0"),
+                                                      int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8443"))),
+                                                      WEBHOOK_PATH, UPDATE_QUEUE_SIZE, UPDATE_WORKERS)
+        webhook_server.start()
+        set_webhook(updater.bot, WEBHOOK_URL, WEBHOOK_PATH)
+    else:
+        update_poller: UpdatePoller = UpdatePoller(updater.dispatcher, UPDATE_QUEUE_SIZE, UPDATE_WORKERS, OVERLOAD_POLICY)
+        update_poller.start()
+    updater.job_queue.start()
+    startup_report.ready()
+
+
+def create_updater(telegram_token: str, telegram_api_url: Optional[str], postgres_db: PostgresDatabase,
+                   handler_db: PostgresDatabase, response_cache: ResponseCache, command_router: CommandRouter,
+                   archive: FallzahlenArchive, case_matrix: CaseMatrix, chat_rate_limiter: ChatRateLimiter, update_workers: int,
+                   notification_workers: int, notification_time: Time, startup_report: StartupReport) -> Updater:
+    # The update workers and the notification workers send at the same time, besides getUpdates and the job queue
+    updater: Updater = Updater(token=telegram_token, base_url=telegram_api_url, use_context=True,
+                               request_kwargs={"con_pool_size": update_workers + notification_workers + 4})
+
+    # Schedule Notifications
+    broadcaster: NotificationBroadcaster = NotificationBroadcaster(updater.bot, postgres_db, notification_workers)
+    updater.job_queue.run_daily(lambda context: notify_users(context, case_matrix, response_cache, broadcaster),
+                                notification_time, job_kwargs={"misfire_grace_time" : None})
+
+    #Register Functions To Dispatcher
+    register_handlers(updater.dispatcher, handler_db, response_cache, command_router, archive, case_matrix, chat_rate_limiter)
+    # Group 1 runs after the command handlers, so this sees when the first answer was sent
+    updater.dispatcher.add_handler(TypeHandler(Update, lambda update, context: startup_report.update_handled()), group=1)
+    return updater
+
+
+def register_handlers(dispatcher: Dispatcher, postgres_db: PostgresDatabase, response_cache: ResponseCache,
+                      command_router: CommandRouter, archive: FallzahlenArchive, case_matrix: CaseMatrix,
+                      chat_rate_limiter: ChatRateLimiter):
+    dispatcher.add_handler(MessageHandler(Filters.command, lambda update, context: throttle_commands(update, context, chat_rate_limiter)), group=-1)
+    dispatcher.add_handler(CommandHandler("update", lambda update, context: post_summary(update, context, case_matrix, response_cache)))
+    dispatcher.add_handler(CommandHandler("start", lambda update, context: start_notifications(update, context, postgres_db)))
+    dispatcher.add_handler(CommandHandler("stop", lambda update, context: stop_notifications(update, context, postgres_db)))
+    dispatcher.add_handler(CommandHandler("risikogebiete", lambda update, context: get_risikogebiete(update, context, case_matrix, response_cache)))
+    dispatcher.add_handler(CommandHandler("history", lambda update, context: get_history(update, context, archive)))
+    dispatcher.add_handler(command_router)
+
+
+if __name__ == "__main__":
+    main()